@@ -0,0 +1,357 @@
+"""
+bench_database.py - データベース操作のベンチマーク
+
+合成した台帳でDebtDatabaseの公開メソッドと読み込み・保存の時間を測り、
+レイテンシのパーセンタイルとファイルサイズを表示する
+
+使い方:
+  python -m benchmarks.bench_database --users 100 1000 10000 --history 100000
+  python -m benchmarks.bench_database --backend json sqlite --json result.json
+  python -m benchmarks.bench_database --compare result.json
+  python -m benchmarks.bench_database --memory --users 1000 --history 100000
+"""
+import argparse;
+import json;
+import os;
+import platform;
+import random;
+import shutil;
+import sys;
+import tempfile;
+import time;
+import tracemalloc;
+from datetime import datetime, timedelta;
+from typing import Callable, Dict, List, Optional, Tuple;
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))));
+
+from config import Config;
+from utils.database import create_database;
+
+# 測るバックエンド（STORAGE_BACKEND, PERSIST_MODE）
+BACKENDS = {
+  "json": ("json", "json"),
+  "journal": ("json", "journal"),
+  "sqlite": ("sqlite", "json")
+};
+
+def generate_ledger(users: int, history: int, debts_per_user: int, seed: int) -> Dict:
+  """
+  合成した台帳を作る
+  
+  Args:
+    users: ユーザー数
+    history: 履歴の件数
+    debts_per_user: 1人あたりの債権の件数
+    seed: 乱数のシード
+  
+  Returns:
+    Dict: debts.jsonと同じ形式のデータ
+  """
+  rng = random.Random(seed);
+  user_ids = [str(10 ** 17 + i) for i in range(users)];
+  debts = {};
+  for _ in range(users * debts_per_user):
+    creditor, debtor = rng.sample(user_ids, 2);
+    debtors = debts.setdefault(creditor, {});
+    debtors[debtor] = debtors.get(debtor, 0) + rng.randint(1, 100) * 100;
+  
+  start = datetime(2024, 1, 1);
+  entries = [];
+  for i in range(history):
+    creditor, debtor = rng.sample(user_ids, 2);
+    entries.append({
+      "action": rng.choice(("add", "add", "pay", "transfer")),
+      "creditor": creditor,
+      "debtor": debtor,
+      "amount": rng.randint(1, 100) * 100,
+      "description": "ベンチマーク",
+      "timestamp": (start + timedelta(seconds=i * 60)).isoformat()
+    });
+  return {"debts": debts, "history": entries, "user_settings": {}, "log_channels": {}};
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+  """
+  レイテンシのパーセンタイルを求める
+  
+  Args:
+    samples: 秒単位の計測値
+  
+  Returns:
+    Dict[str, float]: {"p50", "p95", "p99", "max", "mean"}（ミリ秒）
+  """
+  ordered = sorted(samples);
+  pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000;
+  return {
+    "p50": pick(0.50),
+    "p95": pick(0.95),
+    "p99": pick(0.99),
+    "max": ordered[-1] * 1000,
+    "mean": sum(ordered) / len(ordered) * 1000
+  };
+
+def measure(operation: Callable[[], object], repeat: int) -> Dict[str, float]:
+  """
+  操作をrepeat回実行して時間を測る
+  
+  Args:
+    operation: 操作
+    repeat: 回数
+  
+  Returns:
+    Dict[str, float]: パーセンタイル（ミリ秒）
+  """
+  samples = [];
+  for _ in range(repeat):
+    start = time.perf_counter();
+    operation();
+    samples.append(time.perf_counter() - start);
+  return percentiles(samples);
+
+def directory_size(path: str) -> int:
+  """
+  ディレクトリ内のファイルサイズの合計を求める
+  
+  Args:
+    path: ディレクトリ
+  
+  Returns:
+    int: バイト数
+  """
+  total = 0;
+  for root, _, files in os.walk(path):
+    total += sum(os.path.getsize(os.path.join(root, name)) for name in files);
+  return total;
+
+def run_case(backend: str, users: int, history: int, repeat: int, seed: int) -> Dict:
+  """
+  1つのバックエンド・規模でベンチマークを実行する
+  
+  Args:
+    backend: BACKENDSのキー
+    users: ユーザー数
+    history: 履歴の件数
+    repeat: 各操作の実行回数
+    seed: 乱数のシード
+  
+  Returns:
+    Dict: 結果
+  """
+  Config.STORAGE_BACKEND, Config.PERSIST_MODE = BACKENDS[backend];
+  Config.WRITE_BEHIND = False;
+  Config.HISTORY_ARCHIVE_DAYS = 0;
+  data_dir = tempfile.mkdtemp(prefix="fusaikanri-bench-");
+  try:
+    ledger = generate_ledger(users, history, 5, seed);
+    with open(os.path.join(data_dir, os.path.basename(Config.DB_PATH)), 'w', encoding='utf-8') as f:
+      json.dump(ledger, f, ensure_ascii=False, indent=2);
+    user_ids = [int(user) for user in ledger["debts"]] or [10 ** 17];
+    pairs = [(int(c), int(d)) for c, debtors in ledger["debts"].items() for d in debtors];
+    del ledger;
+    
+    # sqliteは初回にdebts.jsonを取り込むので、取り込みは読み込み時間に含めない
+    db = create_database(data_dir);
+    db.close();
+    start = time.perf_counter();
+    db = create_database(data_dir);
+    load_ms = (time.perf_counter() - start) * 1000;
+    
+    rng = random.Random(seed);
+    other = lambda user_id: user_id + 1 if user_id + 1 in user_ids else user_ids[0];
+    # 履歴のページ送りの続き（beforeに渡す通し番号）
+    cursor = lambda: rng.randint(1, max(1, history));
+    # 書き出しのように全体を読む操作は回数を減らす
+    few = max(1, repeat // 10);
+    results = {
+      "add_debt": measure(lambda: db.add_debt(rng.choice(user_ids), rng.choice(user_ids) + users, 100, "bench"), repeat),
+      "pay_debt": measure(lambda: db.pay_debt(*rng.choice(pairs), 1), repeat),
+      "transfer_debt": measure(lambda: db.transfer_debt(*rng.choice(pairs), other(rng.choice(user_ids)), 1), repeat),
+      "get_debt": measure(lambda: db.get_debt(*rng.choice(pairs)), repeat),
+      "get_user_debts": measure(lambda: db.get_user_debts(rng.choice(user_ids)), repeat),
+      "get_history": measure(lambda: db.get_history(rng.choice(user_ids), 10), repeat),
+      "get_history_all": measure(lambda: db.get_history(None, 10), repeat),
+      "get_summary": measure(lambda: db.get_summary(), repeat),
+      "get_history_page": measure(lambda: db.get_history_page(rng.choice(user_ids), 10), repeat),
+      "get_history_page_before": measure(lambda: db.get_history_page(rng.choice(user_ids), 10, cursor()), repeat),
+      "get_history_page_all": measure(lambda: db.get_history_page(None, 10, cursor()), repeat),
+      "get_rank": measure(lambda: db.get_rank(rng.choice(user_ids)), repeat),
+      "get_leaderboard": measure(lambda: db.get_leaderboard(rng.choice(("lent", "borrowed")), rng.randint(0, users), 20), repeat),
+      "get_debt_at": measure(lambda: db.get_debt_at(*rng.choice(pairs), datetime(2024, 1, 1) + timedelta(minutes=rng.randint(0, history))), repeat),
+      "set_log_channel": measure(lambda: db.set_log_channel(rng.randint(1, 100), rng.randint(1, 100)), repeat),
+      "get_log_channel": measure(lambda: db.get_log_channel(rng.randint(1, 100)), repeat),
+      "iter_debts": measure(lambda: sum(1 for _ in db.iter_debts()), few),
+      "iter_history": measure(lambda: sum(1 for _ in db.iter_history()), few),
+      "plan_settlement": measure(db.plan_settlement, few),
+      "add_debts_8": measure(lambda: db.add_debts([(user_ids[0], user_id, 100, "bench") for user_id in user_ids[1:9]]), few)
+    };
+    
+    # 台帳全体を書き換える操作は最後に1回だけ測る（精算は全債権、アーカイブは古い履歴の全て、コンパクションはジャーナル全体）
+    plan = db.plan_settlement();
+    results["apply_settlement"] = measure(lambda: db.apply_settlement(plan), 1);
+    # 合成した履歴は全て1日以上前の日時なので、全件がアーカイブの対象になる
+    Config.HISTORY_ARCHIVE_DAYS = 1;
+    results["archive_history"] = measure(db.archive_history, 1);
+    Config.HISTORY_ARCHIVE_DAYS = 0;
+    results["compact"] = measure(db.compact, 1);
+    
+    # 保存（jsonはファイル全体、journalはコンパクション、sqliteはコミットごとなので対象外）
+    save_ms = None;
+    if backend == "json":
+      save_ms = measure(db._save_data, 3)["p50"];
+    elif backend == "journal":
+      save_ms = results["compact"]["p50"];
+    db.close();
+    
+    return {
+      "backend": backend,
+      "users": users,
+      "debts": len(pairs),
+      "history": history,
+      "repeat": repeat,
+      "load_ms": load_ms,
+      "save_ms": save_ms,
+      "disk_bytes": directory_size(data_dir),
+      "operations": results
+    };
+  finally:
+    shutil.rmtree(data_dir, ignore_errors=True);
+
+def measure_memory(users: int, history: int, seed: int) -> Dict:
+  """
+  jsonバックエンドで台帳を読み込んだときのメモリ使用量を測る
+  履歴なしの台帳との差を件数で割り、履歴1件あたりのバイト数を求める
+  
+  Args:
+    users: ユーザー数
+    history: 履歴の件数
+    seed: 乱数のシード
+  
+  Returns:
+    Dict: {"users", "debts", "history", "base_bytes", "total_bytes", "bytes_per_history", "bytes_per_debt"}
+  """
+  Config.STORAGE_BACKEND, Config.PERSIST_MODE = BACKENDS["json"];
+  Config.WRITE_BEHIND = False;
+  Config.HISTORY_ARCHIVE_DAYS = 0;
+  
+  def loaded_bytes(history_count: int) -> Tuple[int, int]:
+    """
+    台帳を書き出して読み込み、読み込み中に確保されて残ったバイト数と債権数を返す
+    """
+    data_dir = tempfile.mkdtemp(prefix="fusaikanri-bench-");
+    try:
+      ledger = generate_ledger(users, history_count, 5, seed);
+      debts = sum(len(debtors) for debtors in ledger["debts"].values());
+      with open(os.path.join(data_dir, os.path.basename(Config.DB_PATH)), 'w', encoding='utf-8') as f:
+        json.dump(ledger, f, ensure_ascii=False);
+      del ledger;
+      tracemalloc.start();
+      try:
+        db = create_database(data_dir);
+        size = tracemalloc.get_traced_memory()[0];
+      finally:
+        tracemalloc.stop();
+      db.close();
+      return size, debts;
+    finally:
+      shutil.rmtree(data_dir, ignore_errors=True);
+  
+  empty_bytes, debts = loaded_bytes(0);
+  total_bytes, _ = loaded_bytes(history);
+  return {
+    "users": users,
+    "debts": debts,
+    "history": history,
+    "base_bytes": empty_bytes,
+    "total_bytes": total_bytes,
+    "bytes_per_history": (total_bytes - empty_bytes) / history if history else 0,
+    "bytes_per_debt": empty_bytes / debts if debts else 0
+  };
+
+def print_memory(result: Dict, baseline: Optional[Dict] = None):
+  """
+  メモリ使用量の結果を表示する（比較対象があれば倍率も出す）
+  
+  Args:
+    result: measure_memoryの結果
+    baseline: 同じ条件の以前の結果
+  """
+  ratio = lambda key: f" (x{result[key] / baseline[key]:.2f})" if baseline and baseline.get(key) else "";
+  print(
+    f"\n[memory] ユーザー{result['users']:,}人 債権{result['debts']:,}件 履歴{result['history']:,}件 "
+    f"合計 {result['total_bytes'] / 1024 / 1024:.1f} MB{ratio('total_bytes')}"
+  );
+  print(f"  履歴1件あたり {result['bytes_per_history']:.0f} bytes{ratio('bytes_per_history')}");
+  print(f"  債権1件あたり {result['bytes_per_debt']:.0f} bytes（履歴なしの台帳全体を債権数で割った値）{ratio('bytes_per_debt')}");
+
+def print_result(result: Dict, baseline: Optional[Dict] = None):
+  """
+  1件の結果を表示する（比較対象があればp50の倍率も出す）
+  
+  Args:
+    result: run_caseの結果
+    baseline: 同じ条件の以前の結果
+  """
+  save = f"{result['save_ms']:.1f} ms" if result["save_ms"] is not None else "-";
+  print(
+    f"\n[{result['backend']}] ユーザー{result['users']:,}人 債権{result['debts']:,}件 履歴{result['history']:,}件 "
+    f"読み込み {result['load_ms']:.1f} ms / 保存 {save} / ディスク {result['disk_bytes'] / 1024 / 1024:.1f} MB"
+  );
+  print(f"  {'操作':<26}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)");
+  for name, stats in result["operations"].items():
+    line = f"  {name:<26}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}{stats['max']:>10.3f}";
+    if baseline and name in baseline["operations"] and baseline["operations"][name]["p50"] > 0:
+      line += f"  x{stats['p50'] / baseline['operations'][name]['p50']:.2f}";
+    print(line);
+
+def main():
+  """
+  コマンドライン引数を読んでベンチマークを実行する
+  """
+  parser = argparse.ArgumentParser(description="DebtDatabaseのベンチマーク");
+  parser.add_argument("--backend", nargs="+", default=["json", "journal", "sqlite"], choices=sorted(BACKENDS));
+  parser.add_argument("--users", nargs="+", type=int, default=[100, 1000, 10000]);
+  parser.add_argument("--history", nargs="+", type=int, default=[10000]);
+  parser.add_argument("--repeat", type=int, default=50, help="各操作の実行回数");
+  parser.add_argument("--seed", type=int, default=0);
+  parser.add_argument("--json", help="結果をJSONで書き出すパス");
+  parser.add_argument("--compare", help="比較する以前の結果（--jsonで書き出したもの）");
+  parser.add_argument("--memory", action="store_true", help="操作の時間の代わりに読み込み後のメモリ使用量を測る（jsonバックエンド）");
+  args = parser.parse_args();
+  
+  baselines = {};
+  if args.compare:
+    with open(args.compare, 'r', encoding='utf-8') as f:
+      for result in json.load(f)["results"]:
+        baselines[(result.get("backend", "memory"), result["users"], result["history"])] = result;
+  
+  results = [];
+  if args.memory:
+    for users in args.users:
+      for history in args.history:
+        result = measure_memory(users, history, args.seed);
+        results.append(result);
+        print_memory(result, baselines.get(("memory", users, history)));
+  else:
+    for backend in args.backend:
+      for users in args.users:
+        for history in args.history:
+          result = run_case(backend, users, history, args.repeat, args.seed);
+          results.append(result);
+          print_result(result, baselines.get((backend, users, history)));
+  
+  if args.json:
+    with open(args.json, 'w', encoding='utf-8') as f:
+      json.dump({
+        "meta": {
+          "timestamp": datetime.now().isoformat(),
+          "python": platform.python_version(),
+          "platform": platform.platform(),
+          "args": vars(args)
+        },
+        "results": results
+      }, f, ensure_ascii=False, indent=2);
+    print(f"\n結果を{args.json}に書き出した");
+
+if __name__ == '__main__':
+  main();
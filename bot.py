@@ -5,9 +5,11 @@ fusaikanri - Discord Bot for Managing Debt/Technical Debt
 """
 import os;
 import logging;
+import time;
 import discord;
 from discord.ext import commands;
 from config import Config;
+from utils.command_sync import sync_if_changed;
 
 # 設定の検証
 if not Config.validate():
@@ -28,29 +30,63 @@ intents.message_content = True;
 intents.guilds = True;
 intents.members = True;
 
+# SHARD_COUNTを設定した場合はシャードを分ける（1つのプロセスがSHARD_IDSのシャードを受け持つ）
+BotBase = commands.AutoShardedBot if Config.SHARD_COUNT > 0 else commands.Bot;
+
+class FusaikanriBot(BotBase):
+  """
+  Botクラス
+  Cogの読み込みとコマンドの同期はsetup_hookで接続前に1回だけ行う（on_readyは再接続のたびに呼ばれるため）
+  """
+  
+  async def setup_hook(self):
+    """ログイン後・ゲートウェイ接続前に1回だけ呼ばれる初期化処理"""
+    start = time.perf_counter();
+    
+    # Cogを読み込む
+    try:
+      await self.load_extension('cogs.debt');
+      logger.info('debt Cogを読み込んだ');
+    except Exception as e:
+      logger.error(f'Cog読み込みエラー: {e}', exc_info=True);
+    
+    # スラッシュコマンドを同期（前回の同期から変わっていなければ省く）
+    # コマンドはBot全体で共通なので、複数のプロセスに分けた場合はシャード0を受け持つプロセスだけが同期する
+    if Config.SHARD_IDS and 0 not in Config.SHARD_IDS:
+      logger.info('シャード0を受け持たないのでスラッシュコマンドの同期を省いた');
+    else:
+      await self._sync_commands();
+    
+    logger.info(f'起動準備に {(time.perf_counter() - start) * 1000:.0f}ms かかった');
+  
+  async def _sync_commands(self):
+    """スラッシュコマンドを同期する"""
+    try:
+      synced = await sync_if_changed(self.tree, self.application_id, Config.COMMAND_SYNC_HASH_PATH, Config.FORCE_COMMAND_SYNC);
+      if synced is None:
+        logger.info('スラッシュコマンドに変更がないので同期を省いた');
+      else:
+        logger.info(f'{synced} 個のスラッシュコマンドを同期');
+    except Exception as e:
+      logger.error(f'コマンド同期エラー: {e}', exc_info=True);
+
 # Botインスタンス作成
-bot = commands.Bot(command_prefix=Config.COMMAND_PREFIX, intents=intents);
+if Config.SHARD_COUNT > 0:
+  bot = FusaikanriBot(
+    command_prefix=Config.COMMAND_PREFIX, intents=intents,
+    shard_count=Config.SHARD_COUNT, shard_ids=Config.SHARD_IDS or None
+  );
+else:
+  bot = FusaikanriBot(command_prefix=Config.COMMAND_PREFIX, intents=intents);
 
 
 @bot.event
 async def on_ready():
-  """Botが起動したときのイベントハンドラ"""
+  """Botが接続したときのイベントハンドラ（再接続のたびに呼ばれる）"""
   logger.info(f'{bot.user} が Discord に接続した！');
   logger.info(f'Bot は {len(bot.guilds)} サーバーに参加している');
-  
-  # Cogを読み込む
-  try:
-    await bot.load_extension('cogs.debt');
-    logger.info('debt Cogを読み込んだ');
-  except Exception as e:
-    logger.error(f'Cog読み込みエラー: {e}', exc_info=True);
-  
-  # スラッシュコマンドを同期
-  try:
-    synced = await bot.tree.sync();
-    logger.info(f'{len(synced)} 個のスラッシュコマンドを同期');
-  except Exception as e:
-    logger.error(f'コマンド同期エラー: {e}', exc_info=True);
+  if bot.shard_count:
+    logger.info(f'シャード {bot.shard_ids or "全て"} / {bot.shard_count} を受け持っている');
 
 
 @bot.event
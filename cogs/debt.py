@@ -3,17 +3,76 @@ debt.py - 借金管理コマンドCog
 
 借金の追加、返済、一覧表示、債権譲渡などの機能を提供する
 """
+import csv;
+import io;
+import math;
+import re;
+import tempfile;
+import time;
+import unicodedata;
 import discord;
 from discord import app_commands;
-from discord.ext import commands;
-from typing import Optional;
+from discord.ext import commands, tasks;
+from datetime import datetime, timedelta;
+from typing import Dict, Optional;
 import sys;
 import os;
 
 # プロジェクトルートをパスに追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))));
 
-from utils.database import DebtDatabase;
+from config import Config;
+from utils.csv_io import read_debt_rows;
+from utils.guild_shards import GuildShards;
+from utils.log_sender import LogSender;
+from utils.metrics import (
+  COMMAND_SECONDS, LOG_DELAY_SECONDS, LOG_SEND_SECONDS, LOOP_LAG_SECONDS, MUTATION_GROUP_SIZE, REGISTRY,
+  STORAGE_LOAD_SECONDS, STORAGE_SAVE_BYTES, STORAGE_SAVE_SECONDS, USER_LOOKUPS, MetricsExporter
+);
+from utils.pagination import CursorPaginator;
+from utils.split import split_amount;
+from utils.storage_client import RemoteShards;
+from utils.user_resolver import UserResolver;
+
+# 一覧・履歴の1ページあたりの件数（一覧は貸し・借りそれぞれ）
+LIST_PAGE_SIZE = 15;
+HISTORY_PAGE_SIZE = 10;
+LEADERBOARD_PAGE_SIZE = 20;
+# 取り込むCSVの最大サイズ（添付はまとめてメモリに読むので、読む前に大きさで断る）
+IMPORT_MAX_BYTES = 10 * 1024 * 1024;
+
+def _rjust(text: str, width: int) -> str:
+  """
+  全角文字を2文字分として右寄せする（コードブロックの表の見出し用）
+  
+  Args:
+    text: 文字列
+    width: 幅（半角文字数）
+  
+  Returns:
+    str: 左を空白で埋めた文字列
+  """
+  length = sum(2 if unicodedata.east_asian_width(char) in "WF" else 1 for char in text);
+  return " " * max(0, width - length) + text;
+
+def _parse_when(text: str) -> Optional[datetime]:
+  """
+  日時の指定を読む（日付だけの場合はその日の終わりの時点）
+  
+  Args:
+    text: 日時（2026-03-01 / 2026/03/01 / 2026-03-01 18:00 など）
+  
+  Returns:
+    Optional[datetime]: 日時（読めない場合None）
+  """
+  text = text.strip().replace("/", "-");
+  try:
+    when = datetime.fromisoformat(text);
+  except ValueError:
+    return None;
+  if len(text) <= 10:
+    when += timedelta(days=1) - timedelta(microseconds=1);
+  return when;
 
 class DebtCog(commands.Cog):
   """
@@ -28,7 +87,154 @@ class DebtCog(commands.Cog):
       bot: Botインスタンス
     """
     self.bot = bot;
-    self.db = DebtDatabase();
+    # サーバーごとのデータベース（コマンドはinteraction.guild_idのものを使う）
+    # STORAGE_SOCKETを設定した場合はこのプロセスでは開かず、ストレージサービスに読み書きを頼む
+    self.shards = RemoteShards(Config.STORAGE_SOCKET) if Config.STORAGE_SOCKET else GuildShards();
+    self.users = UserResolver(bot, Config.USER_CACHE_TTL, Config.USER_CACHE_SIZE);
+    self.logs = LogSender(bot, Config.LOG_BATCH_WINDOW, Config.LOG_QUEUE_SIZE);
+    self.metrics = MetricsExporter(REGISTRY, Config.LOOP_LAG_INTERVAL);
+    self._register_metrics();
+  
+  def _register_metrics(self):
+    """
+    ログ送信・バックグラウンド書き込みの統計をメトリクスとして出せるよう登録する
+    """
+    REGISTRY.callback(
+      "fusaikanri_log_messages_total", "counter", "ログ送信の件数（stateごと）",
+      lambda: [({"state": state}, value) for state, value in self.logs.stats().items() if state != "pending"]
+    );
+    REGISTRY.callback(
+      "fusaikanri_log_pending", "gauge", "送信待ちのログの件数",
+      lambda: [({}, self.logs.stats()["pending"])]
+    );
+    REGISTRY.callback(
+      "fusaikanri_writer_batches_total", "counter", "バックグラウンド書き込みの回数",
+      lambda: [({}, self._writer_stats()["batches"])]
+    );
+    REGISTRY.callback(
+      "fusaikanri_writer_mutations_total", "counter", "バックグラウンド書き込みに渡した変更の件数",
+      lambda: [({}, self._writer_stats()["mutations"])]
+    );
+    REGISTRY.callback(
+      "fusaikanri_open_databases", "gauge", "開いているデータベースの数",
+      lambda: [({}, len(self.shards.open_databases()))]
+    );
+    REGISTRY.callback(
+      "fusaikanri_gateway_latency_seconds", "gauge", "ゲートウェイのレイテンシ（秒）",
+      lambda: [({}, self.bot.latency)] if math.isfinite(self.bot.latency) else []
+    );
+  
+  def _writer_stats(self) -> Dict[str, int]:
+    """
+    開いている全データベースのバックグラウンド書き込みの統計を合計する
+    
+    Returns:
+      Dict[str, int]: {"batches", "mutations"}
+    """
+    writers = [db.writer for db in self.shards.open_databases() if getattr(db, "writer", None) is not None];
+    return {
+      "batches": sum(writer.batches for writer in writers),
+      "mutations": sum(writer.mutations for writer in writers)
+    };
+  
+  async def cog_load(self):
+    """
+    Cog読み込み時にバックグラウンドタスクを開始する
+    """
+    await self.metrics.start(Config.METRICS_HOST, Config.METRICS_PORT, Config.METRICS_FILE, Config.METRICS_FILE_INTERVAL);
+    self.shards.start();
+    self.compaction_loop.start();
+    if Config.HISTORY_ARCHIVE_DAYS > 0:
+      self.archive_loop.start();
+  
+  async def cog_unload(self):
+    """
+    Cog終了時にバックグラウンドタスクを止めてデータベースを閉じる
+    """
+    self.compaction_loop.cancel();
+    self.archive_loop.cancel();
+    await self.logs.close();
+    await self.metrics.close();
+    await self.shards.aclose();
+  
+  async def interaction_check(self, interaction: discord.Interaction) -> bool:
+    """
+    コマンドの処理時間を測るため、開始時刻を記録する（コマンドは止めない）
+    
+    Args:
+      interaction: インタラクション
+    
+    Returns:
+      bool: 常にTrue
+    """
+    interaction.extras["started"] = time.perf_counter();
+    return True;
+  
+  def _record_command(self, interaction: discord.Interaction, status: str):
+    """
+    コマンドの処理時間をメトリクスに記録する
+    
+    Args:
+      interaction: インタラクション
+      status: 結果（ok / error）
+    """
+    started = interaction.extras.get("started");
+    if started is None or interaction.command is None:
+      return;
+    COMMAND_SECONDS.observe(time.perf_counter() - started, command=interaction.command.qualified_name, status=status);
+  
+  @commands.Cog.listener()
+  async def on_app_command_completion(self, interaction: discord.Interaction, command):
+    """
+    スラッシュコマンドが正常に終わったときに処理時間を記録する
+    
+    Args:
+      interaction: インタラクション
+      command: 実行されたコマンド
+    """
+    self._record_command(interaction, "ok");
+  
+  async def cog_app_command_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+    """
+    スラッシュコマンドがエラーで終わったときに処理時間を記録する（エラーの処理はCommandTreeに任せる）
+    
+    Args:
+      interaction: インタラクション
+      error: エラー
+    """
+    self._record_command(interaction, "error");
+  
+  async def _wait_durable(self, db) -> bool:
+    """
+    設定で有効な場合、変更がディスクに書かれるまで待つ
+    
+    Args:
+      db: 変更したサーバーのデータベース
+    
+    Returns:
+      bool: 保存成功時True（待たない設定なら常にTrue）
+    """
+    if not Config.WRITE_BEHIND_WAIT_DURABLE:
+      return True;
+    return await db.wait_durable();
+  
+  @tasks.loop(seconds=Config.JOURNAL_COMPACT_INTERVAL)
+  async def compaction_loop(self):
+    """
+    ジャーナルが溜まっていたらバックグラウンドでスナップショットにまとめる
+    """
+    for db in self.shards.open_databases():
+      if db.needs_compaction():
+        await db.compact_async();
+  
+  @tasks.loop(hours=1)
+  async def archive_loop(self):
+    """
+    古くなった履歴を定期的にアーカイブへ移す
+    """
+    for db in self.shards.open_databases():
+      async with db.state_lock:
+        db.archive_history();
   
   debt_group = app_commands.Group(name="debt", description="お金の貸し借りを管理するコマンド");
   
@@ -54,6 +260,8 @@ class DebtCog(commands.Cog):
       amount: 借りた金額
       description: 説明
     """
+    db = self.shards.view(interaction.guild_id);
+    queue = self.shards.queue(interaction.guild_id);
     if amount <= 0:
       await interaction.response.send_message("金額は1円以上を指定してくれ", ephemeral=True);
       return;
@@ -63,11 +271,11 @@ class DebtCog(commands.Cog):
       return;
     
     # 借金を追加（userが債権者、interaction.userが債務者）
-    success = self.db.add_debt(user.id, interaction.user.id, amount, description);
+    success = await queue.add_debt(user.id, interaction.user.id, amount, description) and await self._wait_durable(db);
     
     if success:
       # 現在の総借金額を取得
-      total_debt = self.db.get_debt(user.id, interaction.user.id);
+      total_debt = await db.get_debt(user.id, interaction.user.id);
       
       # ログチャンネルに送信
       await self._send_log(
@@ -106,6 +314,8 @@ class DebtCog(commands.Cog):
       amount: 貸した金額
       description: 説明
     """
+    db = self.shards.view(interaction.guild_id);
+    queue = self.shards.queue(interaction.guild_id);
     if amount <= 0:
       await interaction.response.send_message("金額は1円以上を指定してくれ", ephemeral=True);
       return;
@@ -115,11 +325,11 @@ class DebtCog(commands.Cog):
       return;
     
     # 借金を追加（interaction.userが債権者、userが債務者）
-    success = self.db.add_debt(interaction.user.id, user.id, amount, description);
+    success = await queue.add_debt(interaction.user.id, user.id, amount, description) and await self._wait_durable(db);
     
     if success:
       # 現在の総借金額を取得
-      total_debt = self.db.get_debt(interaction.user.id, user.id);
+      total_debt = await db.get_debt(interaction.user.id, user.id);
       
       # ログチャンネルに送信
       await self._send_log(
@@ -136,6 +346,99 @@ class DebtCog(commands.Cog):
     else:
       await interaction.response.send_message("記録に失敗した", ephemeral=True);
   
+  @debt_group.command(name="split", description="立て替えた金額を参加者で割り勘にする")
+  @app_commands.describe(
+    amount="立て替えた合計金額",
+    participants="割り勘する相手（メンションを並べる。例: @A @B @C）",
+    weights="負担の比率（自分を含める場合は自分を先頭に、参加者と同じ順で。例: 2 1 1）",
+    include_self="自分も負担に含めるか",
+    description="説明（任意）"
+  )
+  async def split(
+    self,
+    interaction: discord.Interaction,
+    amount: int,
+    participants: str,
+    weights: Optional[str] = None,
+    include_self: bool = True,
+    description: Optional[str] = None
+  ):
+    """
+    割り勘を記録するコマンド
+    各参加者の負担額をinteraction.userへの借金として1回の保存でまとめて記録する
+    
+    Args:
+      interaction: インタラクション
+      amount: 合計金額
+      participants: 参加者のメンション
+      weights: 負担の比率
+      include_self: 自分も負担に含めるか
+      description: 説明
+    """
+    db = self.shards.view(interaction.guild_id);
+    queue = self.shards.queue(interaction.guild_id);
+    if amount <= 0:
+      await interaction.response.send_message("金額は1円以上を指定してくれ", ephemeral=True);
+      return;
+    
+    # メンションからユーザーIDを取り出す（重複と自分は除く）
+    payer_id = interaction.user.id;
+    member_ids = [];
+    for match in re.finditer(r"<@!?(\d+)>", participants):
+      user_id = int(match.group(1));
+      if user_id != payer_id and user_id not in member_ids:
+        member_ids.append(user_id);
+    if not member_ids:
+      await interaction.response.send_message("割り勘する相手をメンションで指定してくれ", ephemeral=True);
+      return;
+    
+    # 負担する人の並び（自分を含める場合は先頭）
+    sharer_ids = ([payer_id] if include_self else []) + member_ids;
+    if weights:
+      try:
+        weight_list = [int(weight) for weight in re.split(r"[\s,]+", weights.strip())];
+      except ValueError:
+        weight_list = [];
+      if len(weight_list) != len(sharer_ids) or any(weight < 1 for weight in weight_list):
+        await interaction.response.send_message(
+          f"比率は1以上の整数を{len(sharer_ids)}個（{'自分, ' if include_self else ''}参加者の順）で指定してくれ",
+          ephemeral=True
+        );
+        return;
+    else:
+      weight_list = [1] * len(sharer_ids);
+    
+    # 端数は比率の端数が大きい人、同じなら先頭（自分）から負担する
+    shares = split_amount(amount, weight_list);
+    note = description or "割り勘";
+    entries = [
+      (payer_id, user_id, share, note)
+      for user_id, share in zip(sharer_ids, shares)
+      if user_id != payer_id and share > 0
+    ];
+    if not entries:
+      await interaction.response.send_message("負担額が全員0円になった", ephemeral=True);
+      return;
+    
+    success = await queue.add_debts(entries) and await self._wait_durable(db);
+    if not success:
+      await interaction.response.send_message("記録に失敗した", ephemeral=True);
+      return;
+    
+    lines = [f"<@{debtor_id}>: {share:,}円" for _, debtor_id, share, _ in entries];
+    if include_self:
+      lines.insert(0, f"{interaction.user.mention}: {shares[0]:,}円（自分）");
+    
+    await self._send_log(
+      interaction.guild.id,
+      f"{interaction.user.mention}が{amount:,}円を{len(sharer_ids)}人で割り勘した！（{note}）\n" + "\n".join(lines)
+    );
+    
+    await interaction.response.send_message(
+      f"{amount:,}円を{len(sharer_ids)}人で割り勘にした！\n" + "\n".join(lines),
+      ephemeral=True
+    );
+  
   @debt_group.command(name="pay", description="借りたお金を返済する")
   @app_commands.describe(
     user="返済先（お金を貸してくれた人）",
@@ -155,12 +458,16 @@ class DebtCog(commands.Cog):
       user: 返済先
       amount: 返済額
     """
+    db = self.shards.view(interaction.guild_id);
+    queue = self.shards.queue(interaction.guild_id);
     if amount <= 0:
       await interaction.response.send_message("金額は1円以上を指定してくれ", ephemeral=True);
       return;
     
     # 借金を返済（userが債権者、interaction.userが債務者）
-    success, remaining = self.db.pay_debt(user.id, interaction.user.id, amount);
+    success, remaining = await queue.pay_debt(user.id, interaction.user.id, amount);
+    if success:
+      await self._wait_durable(db);
     
     if not success:
       await interaction.response.send_message(
@@ -213,6 +520,8 @@ class DebtCog(commands.Cog):
       creditor: 債権者
       amount: 返済額
     """
+    db = self.shards.view(interaction.guild_id);
+    queue = self.shards.queue(interaction.guild_id);
     if amount <= 0:
       await interaction.response.send_message("金額は1円以上を指定してくれ", ephemeral=True);
       return;
@@ -233,7 +542,9 @@ class DebtCog(commands.Cog):
     
     # 借金を返済（creditorが債権者、debtorが債務者、interaction.userが代理で返済）
     # NOTE: 権限チェックなし - 身内で使うため誰でも代理返済可能
-    success, remaining = self.db.pay_debt(creditor.id, debtor.id, amount, interaction.user.id);
+    success, remaining = await queue.pay_debt(creditor.id, debtor.id, amount, interaction.user.id);
+    if success:
+      await self._wait_durable(db);
     
     if not success:
       await interaction.response.send_message(
@@ -268,68 +579,82 @@ class DebtCog(commands.Cog):
   async def list_debts(self, interaction: discord.Interaction):
     """
     貸し借り一覧を表示するコマンド
+    金額の大きい順に1ページずつ表示し、続きはボタンで取得する
     
     Args:
       interaction: インタラクション
     """
-    debts = self.db.get_user_debts(interaction.user.id);
-    
-    embed = discord.Embed(
-      title=f"{interaction.user.display_name}の貸し借り一覧",
-      color=discord.Color.blue()
-    );
+    await interaction.response.defer(ephemeral=True, thinking=True);
+    db = self.shards.view(interaction.guild_id);
+    owner_id = interaction.user.id;
+    title = f"{interaction.user.display_name}の貸し借り一覧";
     
-    # 貸している分
-    if debts["creditor"]:
-      creditor_list = [];
-      total_lent = 0;
-      for debtor_id, amount in debts["creditor"]:
-        user = await self.bot.fetch_user(debtor_id);
-        creditor_list.append(f"- {user.mention}に: {amount:,}円");
-        total_lent += amount;
-      embed.add_field(
-        name=f"貸している（合計: {total_lent:,}円）",
-        value="\n".join(creditor_list),
-        inline=False
-      );
-    else:
-      embed.add_field(name="貸している", value="なし", inline=False);
-    
-    # 借りている分
-    if debts["debtor"]:
-      debtor_list = [];
-      total_borrowed = 0;
-      for creditor_id, amount in debts["debtor"]:
-        user = await self.bot.fetch_user(creditor_id);
-        debtor_list.append(f"- {user.mention}から: {amount:,}円");
-        total_borrowed += amount;
-      embed.add_field(
-        name=f"借りている（合計: {total_borrowed:,}円）",
-        value="\n".join(debtor_list),
-        inline=False
-      );
-    else:
-      embed.add_field(name="借りている", value="なし", inline=False);
+    async def render(page: Optional[int]):
+      page = page or 0;
+      debts = await db.get_user_debts_page(owner_id, page * LIST_PAGE_SIZE, LIST_PAGE_SIZE);
+      embed = discord.Embed(title=title, color=discord.Color.blue());
+      
+      # 貸している分（メンションはIDだけで作れるのでユーザー取得は不要）
+      if debts["creditor_count"]:
+        lines = [f"- <@{debtor_id}>に: {amount:,}円" for debtor_id, amount in debts["creditor"]];
+        embed.add_field(
+          name=f"貸している（{debts['creditor_count']:,}人 合計: {debts['lent']:,}円）",
+          value="\n".join(lines) or "（このページにはない）",
+          inline=False
+        );
+      else:
+        embed.add_field(name="貸している", value="なし", inline=False);
+      
+      # 借りている分
+      if debts["debtor_count"]:
+        lines = [f"- <@{creditor_id}>から: {amount:,}円" for creditor_id, amount in debts["debtor"]];
+        embed.add_field(
+          name=f"借りている（{debts['debtor_count']:,}人 合計: {debts['borrowed']:,}円）",
+          value="\n".join(lines) or "（このページにはない）",
+          inline=False
+        );
+      else:
+        embed.add_field(name="借りている", value="なし", inline=False);
+      
+      has_more = (page + 1) * LIST_PAGE_SIZE < max(debts["creditor_count"], debts["debtor_count"]);
+      return embed, page + 1 if has_more else None;
     
-    await interaction.response.send_message(embed=embed, ephemeral=True);
+    await CursorPaginator(owner_id, render).start(interaction);
   
   @debt_group.command(name="status", description="特定のユーザーとの収支を確認する")
-  @app_commands.describe(user="確認相手")
-  async def status(self, interaction: discord.Interaction, user: discord.User):
+  @app_commands.describe(user="確認相手", date="この日時の時点の収支を表示する（例: 2026-03-01 / 2026-03-01 18:00）")
+  async def status(self, interaction: discord.Interaction, user: discord.User, date: Optional[str] = None):
     """
     特定のユーザーとの収支を確認するコマンド
     
     Args:
       interaction: インタラクション
       user: 確認相手
+      date: 日時（指定時はその時点の収支。日付だけならその日の終わり）
     """
-    # 自分が貸している分
-    lending = self.db.get_debt(interaction.user.id, user.id);
-    # 自分が借りている分
-    borrowing = self.db.get_debt(user.id, interaction.user.id);
+    db = self.shards.view(interaction.guild_id);
+    title = f"{interaction.user.display_name} ⇔ {user.display_name}";
+    if date is None:
+      # 自分が貸している分
+      lending = await db.get_debt(interaction.user.id, user.id);
+      # 自分が借りている分
+      borrowing = await db.get_debt(user.id, interaction.user.id);
+    else:
+      when = _parse_when(date);
+      if when is None:
+        await interaction.response.send_message("日時は 2026-03-01 や 2026-03-01 18:00 の形で指定してくれ", ephemeral=True);
+        return;
+      # 最初の照会ではチェックポイントを作るため時間がかかることがあるので、先に応答を保留する
+      await interaction.response.defer(ephemeral=True, thinking=True);
+      lending = await db.get_debt_at(interaction.user.id, user.id, when);
+      borrowing = await db.get_debt_at(user.id, interaction.user.id, when);
+      if lending is None or borrowing is None:
+        await interaction.followup.send("その日時はまだ記録を始める前だぞ", ephemeral=True);
+        return;
+      title += f"（{when:%Y-%m-%d %H:%M}時点）";
     
     embed = discord.Embed(
-      title=f"{interaction.user.display_name} ⇔ {user.display_name}",
+      title=title,
       color=discord.Color.green()
     );
     
@@ -344,44 +669,56 @@ class DebtCog(commands.Cog):
     else:
       embed.add_field(name="収支", value="±0円（イーブン）", inline=False);
     
-    await interaction.response.send_message(embed=embed, ephemeral=True);
+    if interaction.response.is_done():
+      await interaction.followup.send(embed=embed, ephemeral=True);
+    else:
+      await interaction.response.send_message(embed=embed, ephemeral=True);
   
   @debt_group.command(name="history", description="取引履歴を表示する")
-  async def history(self, interaction: discord.Interaction):
+  @app_commands.describe(before="この番号より前の履歴を表示する（途中から見るとき用）")
+  async def history(self, interaction: discord.Interaction, before: Optional[int] = None):
     """
     取引履歴を表示するコマンド
+    新しい順に1ページずつ表示し、続きはボタンで取得する
     
     Args:
       interaction: インタラクション
+      before: この通し番号より前の履歴から表示する
     """
-    history = self.db.get_history(interaction.user.id, limit=10);
+    await interaction.response.defer(ephemeral=True, thinking=True);
+    db = self.shards.view(interaction.guild_id);
+    owner_id = interaction.user.id;
+    title = f"{interaction.user.display_name}の取引履歴";
     
-    if not history:
-      await interaction.response.send_message("履歴がないぞ", ephemeral=True);
-      return;
-    
-    embed = discord.Embed(
-      title=f"{interaction.user.display_name}の取引履歴",
-      color=discord.Color.gold()
-    );
-    
-    for h in reversed(history):
-      action_text = {
-        "add": "借金追加",
-        "pay": "返済",
-        "transfer": "債権譲渡"
-      }.get(h["action"], h["action"]);
-      
-      creditor = await self.bot.fetch_user(int(h["creditor"]));
-      debtor = await self.bot.fetch_user(int(h["debtor"]));
+    async def render(cursor: Optional[int]):
+      history, next_before = await db.get_history_page(owner_id, limit=HISTORY_PAGE_SIZE, before=cursor);
+      embed = discord.Embed(title=title, color=discord.Color.gold());
+      if not history:
+        embed.description = "履歴がないぞ";
+        return embed, None;
       
-      embed.add_field(
-        name=f"{action_text} - {h['timestamp'][:10]}",
-        value=f"{creditor.display_name} → {debtor.display_name}: {h['amount']}円",
-        inline=False
+      # ページ内に出てくるユーザーの表示名をまとめて解決する
+      names = await self.users.resolve_names(
+        int(user_id) for h in history for user_id in (h["creditor"], h["debtor"])
       );
+      
+      for h in reversed(history):
+        action_text = {
+          "add": "借金追加",
+          "pay": "返済",
+          "transfer": "債権譲渡",
+          "settle": "精算",
+          "settle_clear": "精算で消去"
+        }.get(h["action"], h["action"]);
+        
+        embed.add_field(
+          name=f"#{h['id']} {action_text} - {h['timestamp'][:10]}",
+          value=f"{names[int(h['creditor'])]} → {names[int(h['debtor'])]}: {h['amount']}円",
+          inline=False
+        );
+      return embed, next_before;
     
-    await interaction.response.send_message(embed=embed, ephemeral=True);
+    await CursorPaginator(owner_id, render).start(interaction, before);
   
   @debt_group.command(name="summary", description="全体の借金サマリーを表示する")
   async def summary(self, interaction: discord.Interaction):
@@ -391,7 +728,8 @@ class DebtCog(commands.Cog):
     Args:
       interaction: インタラクション
     """
-    summary = self.db.get_summary();
+    db = self.shards.view(interaction.guild_id);
+    summary = await db.get_summary();
     
     embed = discord.Embed(
       title="借金サマリー",
@@ -411,15 +749,17 @@ class DebtCog(commands.Cog):
       inline=True
     );
     
+    # 上位に出てくるユーザーの表示名をまとめて解決する
+    names = await self.users.resolve_names(
+      user_id for user_id, _ in summary["top_creditors"] + summary["top_debtors"]
+    );
+    
     # トップ債権者（貸している人）
     if summary["top_creditors"]:
-      creditor_list = [];
-      for i, (user_id, amount) in enumerate(summary["top_creditors"], 1):
-        try:
-          user = await self.bot.fetch_user(user_id);
-          creditor_list.append(f"{i}. {user.display_name}: {amount:,}円");
-        except (discord.NotFound, discord.HTTPException):
-          creditor_list.append(f"{i}. ユーザー#{user_id}: {amount:,}円");
+      creditor_list = [
+        f"{i}. {names[user_id]}: {amount:,}円"
+        for i, (user_id, amount) in enumerate(summary["top_creditors"], 1)
+      ];
       
       embed.add_field(
         name="トップ債権者（貸してる）",
@@ -429,13 +769,10 @@ class DebtCog(commands.Cog):
     
     # トップ債務者（借りている人）
     if summary["top_debtors"]:
-      debtor_list = [];
-      for i, (user_id, amount) in enumerate(summary["top_debtors"], 1):
-        try:
-          user = await self.bot.fetch_user(user_id);
-          debtor_list.append(f"{i}. {user.display_name}: {amount:,}円");
-        except (discord.NotFound, discord.HTTPException):
-          debtor_list.append(f"{i}. ユーザー#{user_id}: {amount:,}円");
+      debtor_list = [
+        f"{i}. {names[user_id]}: {amount:,}円"
+        for i, (user_id, amount) in enumerate(summary["top_debtors"], 1)
+      ];
       
       embed.add_field(
         name="トップ債務者（借りてる）",
@@ -445,6 +782,111 @@ class DebtCog(commands.Cog):
     
     await interaction.response.send_message(embed=embed, ephemeral=False);
   
+  @debt_group.command(name="rank", description="貸している額・借りている額で何位かを表示する")
+  @app_commands.describe(user="順位を見るユーザー（省略時は自分）")
+  async def rank(self, interaction: discord.Interaction, user: Optional[discord.User] = None):
+    """
+    貸している総額・借りている総額のサーバー内の順位を表示するコマンド
+    
+    Args:
+      interaction: インタラクション
+      user: 順位を見るユーザー
+    """
+    target = user or interaction.user;
+    db = self.shards.view(interaction.guild_id);
+    rank = await db.get_rank(target.id);
+    
+    embed = discord.Embed(
+      title=f"{target.display_name}の順位",
+      color=discord.Color.purple()
+    );
+    for side, label, count_key in (("lent", "貸している額", "creditor_count"), ("borrowed", "借りている額", "debtor_count")):
+      position = rank[f"{side}_rank"];
+      if position is None:
+        value = "なし";
+      else:
+        value = f"{position:,}位 / {rank[count_key]:,}人中（{rank[side]:,}円）";
+      embed.add_field(name=label, value=value, inline=False);
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True);
+  
+  @debt_group.command(name="leaderboard", description="貸している額・借りている額のランキングを表示する")
+  @app_commands.describe(kind="ランキングの種類")
+  @app_commands.choices(kind=[
+    app_commands.Choice(name="貸している額", value="lent"),
+    app_commands.Choice(name="借りている額", value="borrowed")
+  ])
+  async def leaderboard(self, interaction: discord.Interaction, kind: str = "lent"):
+    """
+    全員のランキングを表示するコマンド
+    多い順に1ページずつ表示し、続きはボタンで取得する
+    
+    Args:
+      interaction: インタラクション
+      kind: "lent"（貸している額）または "borrowed"（借りている額）
+    """
+    await interaction.response.defer(thinking=True);
+    db = self.shards.view(interaction.guild_id);
+    owner_id = interaction.user.id;
+    title = "貸している額ランキング" if kind == "lent" else "借りている額ランキング";
+    
+    async def render(page: Optional[int]):
+      page = page or 0;
+      entries, count = await db.get_leaderboard(kind, page * LEADERBOARD_PAGE_SIZE, LEADERBOARD_PAGE_SIZE);
+      embed = discord.Embed(title=title, color=discord.Color.purple());
+      if not entries:
+        embed.description = "まだ誰もいないぞ";
+        return embed, None;
+      
+      # ページ内に出てくるユーザーの表示名をまとめて解決する
+      names = await self.users.resolve_names(user_id for _, user_id, _ in entries);
+      embed.description = "\n".join(f"{rank:,}. {names[user_id]}: {total:,}円" for rank, user_id, total in entries);
+      embed.set_footer(text=f"全{count:,}人");
+      
+      has_more = (page + 1) * LEADERBOARD_PAGE_SIZE < count;
+      return embed, page + 1 if has_more else None;
+    
+    await CursorPaginator(owner_id, render).start(interaction);
+  
+  @debt_group.command(name="trends", description="月ごとの貸し借り・返済の推移を表示する")
+  @app_commands.describe(user="対象のユーザー（省略時はサーバー全体）", months="今月から遡る月数")
+  async def trends(self, interaction: discord.Interaction, user: Optional[discord.User] = None, months: app_commands.Range[int, 1, 24] = 6):
+    """
+    月ごとの貸し借り・返済額と、返済率・返済までの平均日数を表示するコマンド
+    
+    Args:
+      interaction: インタラクション
+      user: 対象のユーザー
+      months: 表示する月数
+    """
+    await interaction.response.defer(ephemeral=True, thinking=True);
+    db = self.shards.view(interaction.guild_id);
+    report = await db.trend_report(user.id if user else None, months);
+    
+    title = f"{user.display_name}の推移" if user else "サーバー全体の推移";
+    embed = discord.Embed(title=title, color=discord.Color.teal());
+    if user:
+      columns = (("貸した", "lent"), ("借りた", "borrowed"), ("回収", "collected"), ("返済", "repaid"));
+    else:
+      columns = (("貸し借り", "lent"), ("返済", "repaid"), ("件数", "count"));
+    header = "月     " + "".join(_rjust(label, 11) for label, _ in columns);
+    lines = [row["month"] + "".join(f"{row[key]:>11,}" for _, key in columns) for row in report["months"]];
+    embed.description = "```\n" + "\n".join([header] + lines) + "\n```";
+    
+    percent = lambda rate: f"{rate * 100:.0f}%" if rate is not None else "-";
+    days = lambda value: f"{value:.1f}日" if value is not None else "-";
+    if user:
+      embed.add_field(name="返済率（返した / 借りた）", value=percent(report["repay_rate"]), inline=True);
+      embed.add_field(name="返すまでの平均", value=days(report["repay_days"]), inline=True);
+      embed.add_field(name="回収率（回収した / 貸した）", value=percent(report["collect_rate"]), inline=True);
+      embed.add_field(name="回収までの平均", value=days(report["collect_days"]), inline=True);
+    else:
+      embed.add_field(name="返済率（返済 / 貸し借り）", value=percent(report["repay_rate"]), inline=True);
+      embed.add_field(name="返すまでの平均", value=days(report["repay_days"]), inline=True);
+    embed.set_footer(text=f"全期間の履歴{report['rows']:,}件から集計（金額は円、返済までの日数は古い借金から返したとみなす）");
+    
+    await interaction.followup.send(embed=embed, ephemeral=True);
+  
   @debt_group.command(name="transfer", description="債権を譲渡する")
   @app_commands.describe(
     debtor="債務者（借りている人）",
@@ -467,6 +909,8 @@ class DebtCog(commands.Cog):
       new_creditor: 新しい債権者
       amount: 譲渡額
     """
+    db = self.shards.view(interaction.guild_id);
+    queue = self.shards.queue(interaction.guild_id);
     if amount <= 0:
       await interaction.response.send_message("金額は1円以上を指定してくれ", ephemeral=True);
       return;
@@ -476,12 +920,14 @@ class DebtCog(commands.Cog):
       return;
     
     # 債権を譲渡
-    success, error_msg, remaining = self.db.transfer_debt(
+    success, error_msg, remaining = await queue.transfer_debt(
       interaction.user.id,
       debtor.id,
       new_creditor.id,
       amount
     );
+    if success:
+      await self._wait_durable(db);
     
     if not success:
       await interaction.response.send_message(f"エラー: {error_msg}", ephemeral=True);
@@ -501,6 +947,234 @@ class DebtCog(commands.Cog):
       ephemeral=True
     );
   
+  @debt_group.command(name="settle", description="全員の貸し借りを最小限の送金にまとめる")
+  @app_commands.describe(apply="trueにすると精算案の通りに貸し借りを書き換える（管理者のみ）")
+  async def settle(self, interaction: discord.Interaction, apply: bool = False):
+    """
+    精算案を表示し、指定された場合は反映するコマンド
+    
+    Args:
+      interaction: インタラクション
+      apply: 精算案を反映するか
+    """
+    db = self.shards.view(interaction.guild_id);
+    queue = self.shards.queue(interaction.guild_id);
+    if apply and not interaction.permissions.administrator:
+      await interaction.response.send_message("精算の反映は管理者しかできないぞ", ephemeral=True);
+      return;
+    
+    # 大人数のサーバーでは反映（書き込みキューの順番待ちと保存）に時間がかかるので、先に応答を保留する
+    await interaction.response.defer(ephemeral=not apply, thinking=True);
+    plan = await db.plan_settlement();
+    if not plan:
+      await interaction.followup.send("精算する貸し借りがないぞ", ephemeral=True);
+      return;
+    
+    if apply:
+      success, error_msg = await queue.apply_settlement(plan);
+      if success and not await self._wait_durable(db):
+        success, error_msg = False, "保存に失敗した";
+      if not success:
+        await interaction.followup.send(f"エラー: {error_msg}", ephemeral=True);
+        return;
+    
+    # 送金の一覧（埋め込みの説明文の上限を超える分は件数だけ出す）
+    lines = [];
+    length = 0;
+    for creditor_id, debtor_id, amount in plan:
+      line = f"<@{debtor_id}> → <@{creditor_id}>: {amount:,}円";
+      if length + len(line) > 3800:
+        lines.append(f"ほか{len(plan) - len(lines)}件");
+        break;
+      lines.append(line);
+      length += len(line) + 1;
+    
+    embed = discord.Embed(
+      title="精算した" if apply else "精算案",
+      description="\n".join(lines),
+      color=discord.Color.teal()
+    );
+    if apply:
+      embed.set_footer(text=f"貸し借りを{len(plan)}件の債権にまとめた");
+    else:
+      embed.set_footer(text=f"送金{len(plan)}回で全員の貸し借りがなくなる。反映は /debt settle apply:True");
+    
+    if apply:
+      await self._send_log(
+        interaction.guild.id,
+        f"{interaction.user.mention}が全員の貸し借りを精算した！（{len(plan)}件にまとめた）"
+      );
+    
+    await interaction.followup.send(embed=embed, ephemeral=not apply);
+  
+  @debt_group.command(name="import", description="CSVファイルから貸し借りをまとめて取り込む（管理者のみ）")
+  @app_commands.describe(file="creditor,debtor,amount,description の列を持つCSVファイル（IDはユーザーID）")
+  async def import_csv(self, interaction: discord.Interaction, file: discord.Attachment):
+    """
+    CSVファイルから貸し借りをまとめて取り込むコマンド
+    全行を検証してから1回の保存で反映する
+    
+    Args:
+      interaction: インタラクション
+      file: CSVファイル
+    """
+    db = self.shards.view(interaction.guild_id);
+    queue = self.shards.queue(interaction.guild_id);
+    if not interaction.permissions.administrator:
+      await interaction.response.send_message("取り込みは管理者しかできないぞ", ephemeral=True);
+      return;
+    
+    if file.size > IMPORT_MAX_BYTES:
+      await interaction.response.send_message(
+        f"ファイルが大きすぎる（{IMPORT_MAX_BYTES // (1024 * 1024)}MBまで）",
+        ephemeral=True
+      );
+      return;
+    
+    await interaction.response.defer(ephemeral=True, thinking=True);
+    # Discordの添付は一括でしか取得できないので全体を読み、検証は1行ずつ行う
+    data = await file.read();
+    try:
+      rows, errors = read_debt_rows(io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline=''));
+    except (UnicodeDecodeError, csv.Error) as e:
+      rows, errors = [], [f"CSVとして読めない: {e}"];
+    
+    if errors:
+      await interaction.followup.send("取り込めなかった（何も反映していない）\n" + "\n".join(errors), ephemeral=True);
+      return;
+    if not rows:
+      await interaction.followup.send("取り込む行がないぞ", ephemeral=True);
+      return;
+    
+    try:
+      success = await queue.add_debts(rows) and await self._wait_durable(db);
+    except Exception as e:
+      # 例外で抜けると保留中の応答が返らないので、失敗として応答する
+      print(f"取り込みエラー: {e}");
+      success = False;
+    
+    if not success:
+      await interaction.followup.send("保存に失敗した", ephemeral=True);
+      return;
+    
+    total = sum(row[2] for row in rows);
+    await self._send_log(
+      interaction.guild.id,
+      f"{interaction.user.mention}がCSVから{len(rows):,}件の貸し借りを取り込んだ！（合計{total:,}円）"
+    );
+    await interaction.followup.send(f"{len(rows):,}件（合計{total:,}円）を取り込んだ！", ephemeral=True);
+  
+  @debt_group.command(name="export", description="貸し借りと履歴をファイルに書き出す（管理者のみ）")
+  async def export(self, interaction: discord.Interaction):
+    """
+    債権をCSV、履歴をNDJSONのファイルにして送るコマンド
+    
+    Args:
+      interaction: インタラクション
+    """
+    db = self.shards.view(interaction.guild_id);
+    if not interaction.permissions.administrator:
+      await interaction.response.send_message("書き出しは管理者しかできないぞ", ephemeral=True);
+      return;
+    
+    await interaction.response.defer(ephemeral=True, thinking=True);
+    # 1件ずつ一時ファイルに書き、出力全体をメモリに持たない（書き出しに失敗しても一時ファイルは閉じる）
+    with tempfile.TemporaryFile() as debts_file, tempfile.TemporaryFile() as history_file:
+      debt_count, history_count = await db.export(debts_file, history_file);
+      
+      limit = interaction.guild.filesize_limit if interaction.guild else 25 * 1024 * 1024;
+      if debts_file.tell() + history_file.tell() > limit:
+        await interaction.followup.send("ファイルが大きすぎて送れない", ephemeral=True);
+        return;
+      
+      debts_file.seek(0);
+      history_file.seek(0);
+      # ここからはdiscord.Fileが一時ファイルを持ち、送信が終わったら閉じる
+      files = [discord.File(debts_file, filename="debts.csv"), discord.File(history_file, filename="history.ndjson")];
+      try:
+        await interaction.followup.send(
+          f"債権{debt_count:,}件・履歴{history_count:,}件を書き出した！",
+          files=files,
+          ephemeral=True
+        );
+      finally:
+        for attachment in files:
+          attachment.close();
+  
+  @debt_group.command(name="stats", description="処理時間などの統計を表示する（管理者のみ）")
+  async def stats(self, interaction: discord.Interaction):
+    """
+    コマンドの処理時間・保存時間・ログ送信などの統計を表示するコマンド
+    
+    Args:
+      interaction: インタラクション
+    """
+    if not interaction.permissions.administrator:
+      await interaction.response.send_message("統計は管理者しか見られないぞ", ephemeral=True);
+      return;
+    
+    ms = lambda seconds: f"{seconds * 1000:.1f}ms";
+    embed = discord.Embed(title="統計", color=discord.Color.dark_grey());
+    
+    # コマンドごとの処理時間（回数の多い順）
+    commands_seen = sorted({labels["command"] for labels in COMMAND_SECONDS.labels()});
+    rows = [];
+    for name in commands_seen:
+      ok = COMMAND_SECONDS.summary(command=name, status="ok");
+      errors = COMMAND_SECONDS.summary(command=name, status="error")["count"];
+      rows.append((ok["count"] + errors, name, ok, errors));
+    rows.sort(key=lambda row: -row[0]);
+    lines = [
+      f"`{name}` {total}回 p50 {ms(ok['p50'])} / p95 {ms(ok['p95'])}" + (f" / エラー{errors}回" if errors else "")
+      for total, name, ok, errors in rows[:15]
+    ];
+    embed.add_field(name="コマンド", value="\n".join(lines) or "まだ記録がない", inline=False);
+    
+    # 保存・読み込み
+    lines = [];
+    for labels in sorted(STORAGE_SAVE_SECONDS.labels(), key=lambda labels: labels["kind"]):
+      kind = labels["kind"];
+      save = STORAGE_SAVE_SECONDS.summary(kind=kind);
+      size = STORAGE_SAVE_BYTES.summary(kind=kind);
+      line = f"保存({kind}) {save['count']}回 平均 {ms(save['mean'])} / p95 {ms(save['p95'])} / 最大 {ms(save['max'])}";
+      if size["count"]:
+        line += f" / 平均 {size['mean'] / 1024:.1f}KB";
+      lines.append(line);
+    for labels in STORAGE_LOAD_SECONDS.labels():
+      load = STORAGE_LOAD_SECONDS.summary(**labels);
+      lines.append(f"読み込み({labels['format']}) {load['count']}回 最大 {ms(load['max'])}");
+    group = MUTATION_GROUP_SIZE.summary();
+    if group["count"]:
+      lines.append(f"書き込みキュー {group['count']}回のコミット（変更{group['sum']:.0f}件、1回の最大{group['max']:.0f}件）");
+    writer = self._writer_stats();
+    if writer["batches"]:
+      lines.append(f"バックグラウンド書き込み {writer['batches']}回（変更{writer['mutations']}件）");
+    embed.add_field(name="ストレージ", value="\n".join(lines) or "まだ記録がない", inline=False);
+    
+    # Discord API
+    send = LOG_SEND_SECONDS.summary();
+    delay = LOG_DELAY_SECONDS.summary();
+    log_stats = self.logs.stats();
+    lines = [
+      f"fetch_user {USER_LOOKUPS.value(source='fetch'):.0f}回（キャッシュ {USER_LOOKUPS.value(source='cache'):.0f}回 / "
+      f"ゲートウェイ {USER_LOOKUPS.value(source='gateway'):.0f}回）",
+      f"ログ送信 {send['count']}回 p50 {ms(send['p50'])} / p95 {ms(send['p95'])} / 積んでから送るまで p95 {ms(delay['p95'])}",
+      f"ログ まとめた{log_stats['merged']}件 / 捨てた{log_stats['dropped']}件 / 429 {log_stats['rate_limited']}回 / 送信待ち{log_stats['pending']}件"
+    ];
+    if math.isfinite(self.bot.latency):
+      lines.append(f"ゲートウェイのレイテンシ {ms(self.bot.latency)}");
+    embed.add_field(name="Discord API", value="\n".join(lines), inline=False);
+    
+    lag = LOOP_LAG_SECONDS.summary();
+    embed.add_field(
+      name="イベントループの遅れ",
+      value=f"p50 {ms(lag['p50'])} / p95 {ms(lag['p95'])} / 最大 {ms(lag['max'])}",
+      inline=False
+    );
+    embed.set_footer(text="p50・p95はヒストグラムからの推定値");
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True);
+  
   @app_commands.command(name="set", description="ログチャンネルを設定する")
   @app_commands.describe(channel="ログを流すチャンネル")
   @app_commands.default_permissions(administrator=True)
@@ -512,7 +1186,9 @@ class DebtCog(commands.Cog):
       interaction: インタラクション
       channel: チャンネル
     """
-    success = self.db.set_log_channel(interaction.guild.id, channel.id);
+    db = self.shards.view(interaction.guild_id);
+    queue = self.shards.queue(interaction.guild_id);
+    success = await queue.set_log_channel(interaction.guild.id, channel.id) and await self._wait_durable(db);
     
     if success:
       await interaction.response.send_message(
@@ -524,17 +1200,15 @@ class DebtCog(commands.Cog):
   
   async def _send_log(self, guild_id: int, message: str):
     """
-    ログチャンネルにメッセージを送信する
+    ログチャンネルへの送信キューにメッセージを積む（送信はバックグラウンドで行う）
     
     Args:
       guild_id: サーバーID
       message: メッセージ
     """
-    channel_id = self.db.get_log_channel(guild_id);
+    channel_id = await self.shards.view(guild_id).get_log_channel(guild_id);
     if channel_id:
-      channel = self.bot.get_channel(channel_id);
-      if channel:
-        await channel.send(message);
+      self.logs.enqueue(channel_id, message);
 
 async def setup(bot: commands.Bot):
   """
@@ -28,6 +28,78 @@ class Config:
   DATA_DIR = os.getenv('DATA_DIR', 'data');
   DB_PATH = os.path.join(DATA_DIR, 'debts.json');
   
+  # 前回同期したスラッシュコマンドのハッシュ（変わっていなければ起動時の同期を省く）
+  COMMAND_SYNC_HASH_PATH = os.path.join(DATA_DIR, 'command_tree.sha256');
+  # trueにすると変わっていなくても起動時に同期する
+  FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', 'false').lower() == 'true';
+  
+  # ストレージバックエンド（json: DebtDatabase / sqlite: SQLiteDebtDatabase）
+  STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json');
+  SQLITE_PATH = os.path.join(DATA_DIR, 'debts.db');
+  
+  # 永続化モード（jsonバックエンドのみ。json: 変更ごとにファイル全体を保存 / journal: 変更を追記し定期的にまとめる）
+  PERSIST_MODE = os.getenv('PERSIST_MODE', 'json');
+  JOURNAL_PATH = os.path.join(DATA_DIR, 'debts.journal');
+  # ジャーナルのレコード数がこの値を超えたらスナップショットにまとめる
+  JOURNAL_COMPACT_THRESHOLD = int(os.getenv('JOURNAL_COMPACT_THRESHOLD', '1000'));
+  # コンパクションが必要かを確認する間隔（秒）
+  JOURNAL_COMPACT_INTERVAL = int(os.getenv('JOURNAL_COMPACT_INTERVAL', '60'));
+  # 追記ごとにfsyncするか（電源断にも耐えたい場合はtrue）
+  JOURNAL_FSYNC = os.getenv('JOURNAL_FSYNC', 'false').lower() == 'true';
+  
+  # 書き込みを後回しにしてバックグラウンドでまとめて保存する（jsonバックエンドのみ）
+  WRITE_BEHIND = os.getenv('WRITE_BEHIND', 'false').lower() == 'true';
+  # 最初の変更から保存までに待つ最大秒数（この間の変更は1回の書き込みにまとめる）
+  WRITE_BEHIND_MAX_DELAY = float(os.getenv('WRITE_BEHIND_MAX_DELAY', '0.5'));
+  # コマンドの応答前に保存完了を待つか
+  WRITE_BEHIND_WAIT_DURABLE = os.getenv('WRITE_BEHIND_WAIT_DURABLE', 'false').lower() == 'true';
+  
+  # この日数より古い履歴を月ごとの圧縮ファイルに移す（0で無効。jsonバックエンドのみ）
+  HISTORY_ARCHIVE_DAYS = int(os.getenv('HISTORY_ARCHIVE_DAYS', '0'));
+  HISTORY_ARCHIVE_DIR = os.path.join(DATA_DIR, 'history');
+  
+  # 履歴がこの件数増えるごとに債権全体をチェックポイントとして保存し、過去の日時の残高照会に使う（0にすると途中のチェックポイントを作らず、照会のたびに最初から再生する）
+  CHECKPOINT_INTERVAL = int(os.getenv('CHECKPOINT_INTERVAL', '1000'));
+  CHECKPOINT_PATH = os.path.join(DATA_DIR, 'checkpoints.jsonl');
+  
+  # 単一書き込みキューで1回のコミットにまとめる最大件数
+  MUTATION_BATCH_SIZE = int(os.getenv('MUTATION_BATCH_SIZE', '100'));
+  
+  # サーバーごとにデータを分ける（data/guilds/<サーバーID>/ にサーバー単位で保存する）
+  SHARD_BY_GUILD = os.getenv('SHARD_BY_GUILD', 'false').lower() == 'true';
+  # 分ける前のデータ（DATA_DIR直下）をそのまま使うサーバーのID（未設定ならどのサーバーも新しく始める）
+  LEGACY_GUILD_ID = int(os.getenv('LEGACY_GUILD_ID') or '0');
+  GUILD_SHARD_DIR = os.path.join(DATA_DIR, 'guilds');
+  
+  # ストレージサービスのUnixソケット（設定するとBotはデータベースを開かず、python -m utils.storage_service で起動したサービスに読み書きを頼む）
+  STORAGE_SOCKET = os.getenv('STORAGE_SOCKET', '');
+  # シャードの総数（0ならシャードを分けない）と、このプロセスが受け持つシャードID（カンマ区切り。空なら全て）
+  SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'));
+  SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id.strip()];
+  # データディレクトリを1つのプロセスだけが開くためのロックファイル
+  DATA_LOCK_PATH = os.path.join(DATA_DIR, 'debts.lock');
+  
+  # スナップショットの形式（jsonバックエンドのみ。json: debts.json / binary: 起動時に履歴を読まないdebts.snap）
+  SNAPSHOT_FORMAT = os.getenv('SNAPSHOT_FORMAT', 'json');
+  SNAPSHOT_PATH = os.path.join(DATA_DIR, 'debts.snap');
+  
+  # ログチャンネルへの送信（この秒数の間に積まれたログは1通にまとめる / チャンネルごとに溜める最大件数）
+  LOG_BATCH_WINDOW = float(os.getenv('LOG_BATCH_WINDOW', '1.0'));
+  LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '100'));
+  
+  # メトリクス（Prometheusのテキスト形式）をHTTPで公開するアドレスとポート（0で公開しない）
+  METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1');
+  METRICS_PORT = int(os.getenv('METRICS_PORT', '0'));
+  # メトリクスを定期的に書き出すファイル（空なら書き出さない）と間隔（秒）
+  METRICS_FILE = os.getenv('METRICS_FILE', '');
+  METRICS_FILE_INTERVAL = float(os.getenv('METRICS_FILE_INTERVAL', '15'));
+  # イベントループの遅れを測る間隔（秒）
+  LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.5'));
+  
+  # ユーザー表示名のキャッシュ（秒 / 最大件数）
+  USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '600'));
+  USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'));
+  
   @classmethod
   def validate(cls) -> bool:
     """
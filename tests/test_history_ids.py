@@ -0,0 +1,55 @@
+"""
+test_history_ids.py - 履歴の通し番号のテスト
+
+使い方:
+  python -m unittest discover tests
+"""
+import os;
+import shutil;
+import sys;
+import tempfile;
+import unittest;
+from unittest import mock;
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))));
+
+from config import Config;
+from utils.database import DebtDatabase;
+from utils.sqlite_database import SQLiteDebtDatabase;
+
+class HistoryIdTest(unittest.TestCase):
+  """
+  JSON版とSQLite版で履歴の通し番号とページ送りのbeforeが同じ意味になることを確かめる
+  """
+  
+  def setUp(self):
+    patcher = mock.patch.multiple(Config, PERSIST_MODE='json', WRITE_BEHIND=False, HISTORY_ARCHIVE_DAYS=0);
+    patcher.start();
+    self.addCleanup(patcher.stop);
+  
+  def _pages(self, cls, user_id) -> list:
+    data_dir = tempfile.mkdtemp();
+    self.addCleanup(shutil.rmtree, data_dir, True);
+    db = cls(data_dir);
+    self.addCleanup(db.close);
+    for i in range(25):
+      db.add_debt(1 + i % 3, 9, 10 + i);
+    pages = [];
+    before = None;
+    while True:
+      entries, before = db.get_history_page(user_id, 4, before);
+      pages.append([(entry["id"], entry["amount"]) for entry in entries]);
+      if before is None:
+        return pages;
+  
+  def test_same_ids_and_cursors(self):
+    for user_id in (None, 1):
+      with self.subTest(user_id=user_id):
+        pages = self._pages(DebtDatabase, user_id);
+        self.assertEqual(pages, self._pages(SQLiteDebtDatabase, user_id));
+        # 通し番号は0から始まる
+        self.assertEqual(pages[-1][0][0], 0);
+
+if __name__ == '__main__':
+  unittest.main();
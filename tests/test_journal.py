@@ -0,0 +1,97 @@
+"""
+test_journal.py - ジャーナルの復旧のテスト
+
+使い方:
+  python -m unittest discover tests
+"""
+import os;
+import shutil;
+import sys;
+import tempfile;
+import unittest;
+from unittest import mock;
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))));
+
+from config import Config;
+from utils.database import DebtDatabase;
+
+class JournalRecoveryTest(unittest.TestCase):
+  """
+  書き込み途中で落ちたジャーナルからの再起動を確かめる
+  """
+  
+  def setUp(self):
+    self.data_dir = tempfile.mkdtemp();
+    patcher = mock.patch.multiple(Config, PERSIST_MODE='journal', WRITE_BEHIND=False, HISTORY_ARCHIVE_DAYS=0);
+    patcher.start();
+    self.addCleanup(patcher.stop);
+    self.addCleanup(shutil.rmtree, self.data_dir, True);
+  
+  def _open(self) -> DebtDatabase:
+    db = DebtDatabase(self.data_dir);
+    self.addCleanup(db.close);
+    return db;
+  
+  def _cut_journal(self, size: int):
+    db_journal = os.path.join(self.data_dir, os.path.basename(Config.JOURNAL_PATH));
+    with open(db_journal, 'r+b') as f:
+      f.truncate(os.path.getsize(db_journal) - size);
+  
+  def test_write_after_torn_tail_survives_restart(self):
+    db = self._open();
+    self.assertTrue(db.add_debt(1, 2, 100));
+    self.assertTrue(db.add_debt(3, 4, 50));
+    db.close();
+    # 2件目の書き込み途中で落ちたことにする
+    self._cut_journal(20);
+    
+    db = self._open();
+    self.assertEqual(db.get_debt(1, 2), 100);
+    self.assertEqual(db.get_debt(3, 4), 0);
+    self.assertTrue(db.add_debt(5, 6, 777));
+    db.close();
+    
+    db = self._open();
+    self.assertEqual(db.get_debt(1, 2), 100);
+    self.assertEqual(db.get_debt(5, 6), 777);
+  
+  def test_line_without_newline_is_discarded(self):
+    db = self._open();
+    self.assertTrue(db.add_debt(1, 2, 100));
+    self.assertTrue(db.add_debt(3, 4, 50));
+    db.close();
+    # 改行だけが書けなかった行も書き込み途中とみなす
+    self._cut_journal(1);
+    
+    db = self._open();
+    self.assertEqual(db.get_debt(3, 4), 0);
+    self.assertTrue(db.add_debt(5, 6, 777));
+    db.close();
+    
+    db = self._open();
+    self.assertEqual(db.get_debt(5, 6), 777);
+  
+  def test_compaction_after_torn_rotated_file(self):
+    db = self._open();
+    self.assertTrue(db.add_debt(1, 2, 100));
+    db.journal.rotate();
+    self.assertTrue(db.add_debt(3, 4, 50));
+    db.close();
+    # 退避ファイルの末尾が壊れた状態で、もう一度退避してつなげる
+    with open(db.journal.rotated_path, 'ab') as f:
+      f.write(b'{"seq":99,"op');
+    
+    db = self._open();
+    self.assertEqual(db.get_debt(1, 2), 100);
+    self.assertEqual(db.get_debt(3, 4), 50);
+    db.journal.rotate();
+    self.assertTrue(db.add_debt(5, 6, 777));
+    db.close();
+    
+    db = self._open();
+    self.assertEqual((db.get_debt(1, 2), db.get_debt(3, 4), db.get_debt(5, 6)), (100, 50, 777));
+
+if __name__ == '__main__':
+  unittest.main();
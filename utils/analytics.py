@@ -0,0 +1,389 @@
+"""
+analytics.py - 履歴の集計モジュール
+
+履歴を列（日時・月・アクション・債権者・債務者・金額）ごとの配列に持ち、
+月ごとの貸し借り・返済額、返済率、返済までの平均日数を求める
+列は前回から増えた履歴だけを追記するので、集計のたびに履歴を読み直すことはない
+
+numpyは任意の依存。インストールされていれば列をnumpyの配列として一括で集計し、
+なければ同じ集計を純Pythonで行う（結果は同じだが、履歴が多いと遅い）
+"""
+import functools;
+from array import array;
+from datetime import datetime, timedelta;
+from typing import Dict, List, Optional, Tuple;
+from utils.records import HistoryRecord, action_code;
+
+try:
+  import numpy as np;
+except ImportError:
+  np = None;
+
+ADD = action_code("add");
+PAY = action_code("pay");
+
+@functools.lru_cache(maxsize=4096)
+def _month_of_day(day: int) -> int:
+  """
+  基準日からの日数を月の番号にする
+  
+  Args:
+    day: 1970-01-01からの日数
+  
+  Returns:
+    int: 年 * 12 + (月 - 1)
+  """
+  date = datetime(1970, 1, 1) + timedelta(days=day);
+  return date.year * 12 + date.month - 1;
+
+def month_index(timestamp: float) -> int:
+  """
+  日時（to_epochの秒数）を月の番号にする
+  
+  Args:
+    timestamp: 日時
+  
+  Returns:
+    int: 年 * 12 + (月 - 1)
+  """
+  return _month_of_day(int(timestamp // 86400));
+
+def month_label(index: int) -> str:
+  """
+  月の番号を表示用の文字列にする
+  
+  Args:
+    index: 月の番号
+  
+  Returns:
+    str: "YYYY-MM"
+  """
+  return f"{index // 12:04d}-{index % 12 + 1:02d}";
+
+class HistoryFrame:
+  """
+  集計用に複製した列
+  複製なので、集計をスレッドで行っている間に元の列へ追記されても影響しない
+  """
+  
+  def __init__(self, timestamps, months, actions, creditors, debtors, amounts):
+    """
+    列をまとめる（numpyがあればnumpyの配列、なければarray）
+    
+    Args:
+      timestamps: 日時（to_epochの秒数）
+      months: 月の番号
+      actions: アクションのコード
+      creditors: 債権者ID
+      debtors: 債務者ID
+      amounts: 金額
+    """
+    self.timestamps = timestamps;
+    self.months = months;
+    self.actions = actions;
+    self.creditors = creditors;
+    self.debtors = debtors;
+    self.amounts = amounts;
+  
+  def __len__(self) -> int:
+    """
+    行数を返す
+    
+    Returns:
+      int: 行数
+    """
+    return len(self.amounts);
+
+class HistoryColumns:
+  """
+  列形式の履歴クラス（追記のみ）
+  各列はarrayで持つので、1行あたり37バイトで済む
+  positionはデータベースが次に取り込む履歴の通し番号を覚えておくのに使う
+  """
+  
+  # (属性名, arrayの型コード, numpyの型)
+  COLUMNS = (
+    ("timestamps", "d", "float64"),
+    ("months", "i", "int32"),
+    ("actions", "B", "uint8"),
+    ("creditors", "q", "int64"),
+    ("debtors", "q", "int64"),
+    ("amounts", "q", "int64")
+  );
+  
+  def __init__(self):
+    """
+    空の列を作る
+    """
+    for name, typecode, _ in self.COLUMNS:
+      setattr(self, name, array(typecode));
+    self.position = 0;
+  
+  def __len__(self) -> int:
+    """
+    行数を返す
+    
+    Returns:
+      int: 行数
+    """
+    return len(self.amounts);
+  
+  def extend(self, records: List[HistoryRecord], position: int):
+    """
+    履歴を末尾に追加する（列ごとにまとめて追加する）
+    
+    Args:
+      records: 古い順の履歴
+      position: 追加後に次に取り込む通し番号
+    """
+    self.timestamps.extend(record.timestamp for record in records);
+    self.months.extend(month_index(record.timestamp) for record in records);
+    self.actions.extend(record.action for record in records);
+    self.creditors.extend(record.creditor for record in records);
+    self.debtors.extend(record.debtor for record in records);
+    self.amounts.extend(record.amount for record in records);
+    self.position = position;
+  
+  def frame(self) -> HistoryFrame:
+    """
+    集計用に列を複製する
+    
+    Returns:
+      HistoryFrame: 複製した列
+    """
+    if np is not None:
+      columns = [np.frombuffer(getattr(self, name), dtype=dtype).copy() for name, _, dtype in self.COLUMNS];
+    else:
+      columns = [array(typecode, getattr(self, name)) for name, typecode, _ in self.COLUMNS];
+    return HistoryFrame(*columns);
+
+def _empty_report(first: int, count: int) -> Dict:
+  """
+  集計結果の入れ物を作る
+  
+  Args:
+    first: 最初の月の番号
+    count: 月数
+  
+  Returns:
+    Dict: 全て0の集計結果
+  """
+  return {
+    "months": [
+      {"month": month_label(first + i), "lent": 0, "borrowed": 0, "collected": 0, "repaid": 0, "count": 0}
+      for i in range(count)
+    ],
+    "lent": 0,
+    "borrowed": 0,
+    "collected": 0,
+    "repaid": 0
+  };
+
+def _numpy_repayment(frame: HistoryFrame, scope) -> Tuple[int, float]:
+  """
+  組（債権者, 債務者）ごとに、返済を古い借金から順に充てたときの返済額と待ち時間の合計を求める（numpy版）
+  組ごとに、借りた額と返した額の小さい方だけを対象にする（譲渡や精算で組が変わった分は数えない）
+  
+  Args:
+    frame: 列
+    scope: 対象の行のマスク
+  
+  Returns:
+    Tuple[int, float]: (対象の返済額, 返済額 × 借りてから返すまでの秒数 の合計)
+  """
+  rows = scope & ((frame.actions == ADD) | (frame.actions == PAY));
+  if not rows.any():
+    return 0, 0.0;
+  is_pay = frame.actions[rows] == PAY;
+  amounts = frame.amounts[rows].astype(np.float64);
+  times = frame.timestamps[rows] - frame.timestamps[rows][0];
+  # IDは64ビットいっぱいまで使うので、列ごとに番号へ直してから組の番号にする（axis=0のuniqueより速い）
+  creditors = np.unique(frame.creditors[rows], return_inverse=True)[1].reshape(-1).astype(np.int64);
+  debtors, debtor_codes = np.unique(frame.debtors[rows], return_inverse=True);
+  group = np.unique(creditors * len(debtors) + debtor_codes.reshape(-1), return_inverse=True)[1].reshape(-1);
+  size = int(group.max()) + 1;
+  cap = np.minimum(
+    np.bincount(group[~is_pay], weights=amounts[~is_pay], minlength=size),
+    np.bincount(group[is_pay], weights=amounts[is_pay], minlength=size)
+  );
+  
+  def weighted_time(side) -> float:
+    # 組ごとの累計のうち、先頭からcapまでに入る分だけ時刻を掛けて足す
+    g = group[side];
+    if len(g) == 0:
+      return 0.0;
+    order = np.argsort(g, kind="stable");
+    g = g[order];
+    amount = amounts[side][order];
+    time = times[side][order];
+    end = np.cumsum(amount);
+    starts = np.flatnonzero(np.r_[True, g[1:] != g[:-1]]);
+    end -= np.repeat(end[starts] - amount[starts], np.diff(np.r_[starts, len(g)]));
+    taken = np.clip(np.minimum(end, cap[g]) - (end - amount), 0, None);
+    return float(np.dot(taken, time));
+  
+  return int(cap.sum()), weighted_time(is_pay) - weighted_time(~is_pay);
+
+def _numpy_report(frame: HistoryFrame, user_id: Optional[int], first: int, count: int) -> Dict:
+  """
+  集計する（numpy版）
+  
+  Args:
+    frame: 列
+    user_id: ユーザーID（Noneならサーバー全体）
+    first: 最初の月の番号
+    count: 月数
+  
+  Returns:
+    Dict: 集計結果（trend_reportを参照）
+  """
+  report = _empty_report(first, count);
+  if user_id is None:
+    as_creditor = as_debtor = np.ones(len(frame), dtype=bool);
+  else:
+    as_creditor = frame.creditors == user_id;
+    as_debtor = frame.debtors == user_id;
+  adds = frame.actions == ADD;
+  pays = frame.actions == PAY;
+  in_window = (frame.months >= first) & (frame.months < first + count);
+  index = frame.months - first;
+  
+  series = {
+    "lent": adds & as_creditor,
+    "borrowed": adds & as_debtor,
+    "collected": pays & as_creditor,
+    "repaid": pays & as_debtor
+  };
+  for key, mask in series.items():
+    report[key] = int(frame.amounts[mask].sum());
+    selected = mask & in_window;
+    sums = np.bincount(index[selected], weights=frame.amounts[selected], minlength=count);
+    for row, value in zip(report["months"], sums):
+      row[key] = int(round(value));
+  counts = np.bincount(index[in_window & (as_creditor | as_debtor)], minlength=count);
+  for row, value in zip(report["months"], counts):
+    row["count"] = int(value);
+  
+  report["repayment"] = _numpy_repayment(frame, as_debtor);
+  # サーバー全体では回収と返済は同じ
+  report["collection"] = report["repayment"] if user_id is None else _numpy_repayment(frame, as_creditor);
+  return report;
+
+def _python_repayment(frame: HistoryFrame, in_scope) -> Tuple[int, float]:
+  """
+  _numpy_repaymentと同じ値を純Pythonで求める
+  
+  Args:
+    frame: 列
+    in_scope: 行が対象か判定する関数 (債権者, 債務者) -> bool
+  
+  Returns:
+    Tuple[int, float]: (対象の返済額, 返済額 × 借りてから返すまでの秒数 の合計)
+  """
+  rows = [
+    (action == PAY, (creditor, debtor), amount, timestamp)
+    for action, creditor, debtor, amount, timestamp in zip(frame.actions, frame.creditors, frame.debtors, frame.amounts, frame.timestamps)
+    if (action == ADD or action == PAY) and in_scope(creditor, debtor)
+  ];
+  if not rows:
+    return 0, 0.0;
+  totals = ({}, {});  # (借りた額, 返した額) {組: 合計}
+  for is_pay, pair, amount, _ in rows:
+    totals[is_pay][pair] = totals[is_pay].get(pair, 0) + amount;
+  cap = {pair: min(amount, totals[True].get(pair, 0)) for pair, amount in totals[False].items()};
+  running = ({}, {});
+  start = rows[0][3];
+  seconds = 0.0;
+  for is_pay, pair, amount, timestamp in rows:
+    begin = running[is_pay].get(pair, 0);
+    end = begin + amount;
+    running[is_pay][pair] = end;
+    taken = min(end, cap.get(pair, 0)) - begin;
+    if taken > 0:
+      seconds += taken * (timestamp - start) * (1 if is_pay else -1);
+  return sum(cap.values()), seconds;
+
+def _python_report(frame: HistoryFrame, user_id: Optional[int], first: int, count: int) -> Dict:
+  """
+  集計する（純Python版）
+  
+  Args:
+    frame: 列
+    user_id: ユーザーID（Noneならサーバー全体）
+    first: 最初の月の番号
+    count: 月数
+  
+  Returns:
+    Dict: 集計結果（trend_reportを参照）
+  """
+  report = _empty_report(first, count);
+  months = report["months"];
+  for month, action, creditor, debtor, amount in zip(frame.months, frame.actions, frame.creditors, frame.debtors, frame.amounts):
+    as_creditor = user_id is None or creditor == user_id;
+    as_debtor = user_id is None or debtor == user_id;
+    if not (as_creditor or as_debtor):
+      continue;
+    row = months[month - first] if first <= month < first + count else None;
+    if row is not None:
+      row["count"] += 1;
+    if action == ADD:
+      keys = (("lent", as_creditor), ("borrowed", as_debtor));
+    elif action == PAY:
+      keys = (("collected", as_creditor), ("repaid", as_debtor));
+    else:
+      continue;
+    for key, involved in keys:
+      if not involved:
+        continue;
+      report[key] += amount;
+      if row is not None:
+        row[key] += amount;
+  
+  if user_id is None:
+    everyone = lambda creditor, debtor: True;
+    report["repayment"] = report["collection"] = _python_repayment(frame, everyone);
+  else:
+    report["repayment"] = _python_repayment(frame, lambda creditor, debtor: debtor == user_id);
+    report["collection"] = _python_repayment(frame, lambda creditor, debtor: creditor == user_id);
+  return report;
+
+def trend_report(frame: HistoryFrame, user_id: Optional[int] = None, months: int = 6, now: Optional[datetime] = None) -> Dict:
+  """
+  月ごとの推移と返済の傾向を集計する（時間がかかる場合があるのでスレッドで呼んでよい）
+  
+  Args:
+    frame: HistoryColumns.frame()で複製した列
+    user_id: ユーザーID（Noneならサーバー全体）
+    months: 今月から遡る月数
+    now: 基準の日時（省略時は現在）
+  
+  Returns:
+    Dict: {
+      "months": [{"month": "YYYY-MM", "lent", "borrowed", "collected", "repaid", "count"}]（古い順）,
+      "lent", "borrowed", "collected", "repaid": 全期間の合計,
+      "repay_rate": 返した額 / 借りた額（借りていなければNone）,
+      "collect_rate": 回収した額 / 貸した額（貸していなければNone）,
+      "repay_days": 借りてから返すまでの平均日数（返済がなければNone）,
+      "collect_days": 貸してから回収するまでの平均日数（回収がなければNone）,
+      "rows": 集計した履歴の件数,
+      "engine": "numpy" または "python"
+    }
+    サーバー全体では貸した額と借りた額、回収と返済はそれぞれ同じ値になる
+  """
+  now = now or datetime.now();
+  last = now.year * 12 + now.month - 1;
+  first = last - months + 1;
+  if np is not None:
+    report = _numpy_report(frame, user_id, first, months);
+  else:
+    report = _python_report(frame, user_id, first, months);
+  
+  ratio = lambda part, whole: part / whole if whole else None;
+  days = lambda result: result[1] / result[0] / 86400 if result[0] else None;
+  report["repay_rate"] = ratio(report["repaid"], report["borrowed"]);
+  report["collect_rate"] = ratio(report["collected"], report["lent"]);
+  report["repay_days"] = days(report.pop("repayment"));
+  report["collect_days"] = days(report.pop("collection"));
+  report["rows"] = len(frame);
+  report["engine"] = "numpy" if np is not None else "python";
+  return report;
@@ -0,0 +1,373 @@
+"""
+checkpoints.py - 残高チェックポイントモジュール
+
+一定件数の履歴ごとにチェックポイントを作り、過去の日時の債権額を
+「直前のチェックポイントの時点の債権額 + そこから先の履歴の再生」で求める
+チェックポイントには前のチェックポイントから変わった組の債権額だけを記録するので、
+作る手間は間隔の件数に比例し、債権全体の件数にはよらない
+再生する履歴も間隔に収まるので、照会の手間は履歴全体の長さによらない
+"""
+import bisect;
+import json;
+import os;
+from array import array;
+from typing import Dict, Iterable, List, Optional, Tuple;
+from utils.records import HistoryRecord;
+
+# 債権額を増やすアクションと減らすアクション（transferは両方なので別に扱う）
+_SIGNS = {"add": 1, "settle": 1, "pay": -1, "settle_clear": -1};
+
+def transfer_target(record: HistoryRecord) -> Optional[int]:
+  """
+  譲渡の履歴から新しい債権者のIDを取り出す（説明に "to:<ID>" として記録されている）
+  
+  Args:
+    record: 譲渡の履歴
+  
+  Returns:
+    Optional[int]: 新しい債権者のID（読み取れない場合None）
+  """
+  if not record.description.startswith("to:"):
+    return None;
+  try:
+    return int(record.description[3:]);
+  except ValueError:
+    return None;
+
+def touched_pairs(record: HistoryRecord) -> List[Tuple[int, int]]:
+  """
+  履歴1件で債権額が変わる組を求める
+  
+  Args:
+    record: 履歴
+  
+  Returns:
+    List[Tuple[int, int]]: [(債権者ID, 債務者ID)]
+  """
+  pairs = [(record.creditor, record.debtor)];
+  if record.action_name == "transfer":
+    target = transfer_target(record);
+    if target is not None:
+      pairs.append((target, record.debtor));
+  return pairs;
+
+def _add(debts: Dict[int, Dict[int, int]], creditor_id: int, debtor_id: int, delta: int):
+  """
+  債権額を増減する（0になった債権は消す）
+  
+  Args:
+    debts: {債権者ID: {債務者ID: 金額}}
+    creditor_id: 債権者ID
+    debtor_id: 債務者ID
+    delta: 増減
+  """
+  debtors = debts.setdefault(creditor_id, {});
+  amount = debtors.get(debtor_id, 0) + delta;
+  if amount:
+    debtors[debtor_id] = amount;
+  else:
+    debtors.pop(debtor_id, None);
+    if not debtors:
+      del debts[creditor_id];
+
+def apply_record(debts: Dict[int, Dict[int, int]], record: HistoryRecord):
+  """
+  履歴1件を債権に適用する
+  
+  Args:
+    debts: {債権者ID: {債務者ID: 金額}}（書き換える）
+    record: 履歴
+  """
+  action = record.action_name;
+  if action == "transfer":
+    _add(debts, record.creditor, record.debtor, -record.amount);
+    target = transfer_target(record);
+    if target is not None:
+      _add(debts, target, record.debtor, record.amount);
+    return;
+  sign = _SIGNS.get(action);
+  if sign is not None:
+    _add(debts, record.creditor, record.debtor, sign * record.amount);
+
+def pair_delta(record: HistoryRecord, creditor_id: int, debtor_id: int) -> int:
+  """
+  履歴1件で、指定した債権者から債務者への債権額がいくら増減するかを求める
+  
+  Args:
+    record: 履歴
+    creditor_id: 債権者ID
+    debtor_id: 債務者ID
+  
+  Returns:
+    int: 増減（関係ない履歴なら0）
+  """
+  if record.debtor != debtor_id:
+    return 0;
+  action = record.action_name;
+  if action == "transfer":
+    delta = -record.amount if record.creditor == creditor_id else 0;
+    if transfer_target(record) == creditor_id:
+      delta += record.amount;
+    return delta;
+  if record.creditor != creditor_id:
+    return 0;
+  return _SIGNS.get(action, 0) * record.amount;
+
+class BalanceCheckpoints:
+  """
+  チェックポイントの保存先クラス（JSON版のデータベース用）
+  1行目は {"origin": bool}、以降はチェックポイントごとに1行
+  {"seq": 適用済みの履歴の件数, "timestamp": 最後に適用した履歴の日時, "debts": [[債権者, 債務者, 債権額]]} を追記する
+  originがTrueなら最初のチェックポイントより前も空の状態から再生して求められる
+  （履歴を記録する前からの債権がある場合はFalseで、最初のチェックポイントに債権全体を記録する）
+  メモリ上では組ごとにチェックポイントの通し番号と債権額を交互に並べ、ある時点の債権額を二分探索で引く
+  """
+  
+  def __init__(self, path: str, ids: Optional[Dict[int, int]] = None):
+    """
+    チェックポイントの保存先を初期化する（読み込みはloadで行う）
+    
+    Args:
+      path: チェックポイントのファイル
+      ids: ID辞書（指定時はIDの整数オブジェクトをデータベースと共有する）
+    """
+    self.path = path;
+    self._ids = ids if ids is not None else {};
+    # 読み込みを試したか / 作成済みのチェックポイントを使えるか
+    self.loaded = False;
+    self.ready = False;
+    self.origin = False;
+    # チェックポイントの通し番号・日時と、各行の末尾のファイル上の位置
+    self.seqs = [];
+    self.timestamps = [];
+    self._offsets = [];
+    self._header_end = 0;
+    # {債権者ID: {債務者ID: array([通し番号, 債権額, 通し番号, 債権額, ...])}}
+    self._pairs = {};
+  
+  @property
+  def exists(self) -> bool:
+    """
+    チェックポイントを作成済みか
+    
+    Returns:
+      bool: ファイルがある場合True
+    """
+    return os.path.exists(self.path);
+  
+  @property
+  def last_seq(self) -> int:
+    """
+    最後のチェックポイントの通し番号
+    
+    Returns:
+      int: 通し番号（チェックポイントがなければ0）
+    """
+    return self.seqs[-1] if self.seqs else 0;
+  
+  def _reset_memory(self):
+    """
+    メモリ上のチェックポイントを空にする
+    """
+    self.seqs = [];
+    self.timestamps = [];
+    self._offsets = [];
+    self._pairs = {};
+  
+  def _index(self, seq: int, timestamp: float, changes: Iterable[Tuple[int, int, int]], offset: int):
+    """
+    チェックポイントをメモリ上の一覧と組ごとの並びに加える
+    
+    Args:
+      seq: 通し番号
+      timestamp: 日時
+      changes: [(債権者ID, 債務者ID, 債権額)]
+      offset: ファイル上の行末の位置
+    """
+    self.seqs.append(seq);
+    self.timestamps.append(timestamp);
+    self._offsets.append(offset);
+    ids = self._ids;
+    for creditor_id, debtor_id, amount in changes:
+      creditor_id = ids.setdefault(creditor_id, creditor_id);
+      debtor_id = ids.setdefault(debtor_id, debtor_id);
+      debtors = self._pairs.get(creditor_id);
+      if debtors is None:
+        debtors = self._pairs[creditor_id] = {};
+      values = debtors.get(debtor_id);
+      if values is None:
+        values = debtors[debtor_id] = array('q');
+      values.append(seq);
+      values.append(amount);
+  
+  @staticmethod
+  def _line(seq: int, timestamp: float, changes: Iterable[Tuple[int, int, int]]) -> bytes:
+    """
+    チェックポイントを1行にする
+    
+    Args:
+      seq: 通し番号
+      timestamp: 日時
+      changes: [(債権者ID, 債務者ID, 債権額)]
+    
+    Returns:
+      bytes: 改行付きの行
+    """
+    line = json.dumps({"seq": seq, "timestamp": timestamp, "debts": [list(change) for change in changes]}, separators=(',', ':'));
+    return (line + '\n').encode('utf-8');
+  
+  def load(self):
+    """
+    ファイルからチェックポイントを読み込む（書き込み途中で落ちた末尾の行は捨てる）
+    """
+    self._reset_memory();
+    self.loaded = True;
+    self.ready = False;
+    if not self.exists:
+      return;
+    with open(self.path, 'rb') as f:
+      header = f.readline();
+      try:
+        self.origin = json.loads(header)["origin"];
+      except (ValueError, KeyError):
+        # 作り直させる
+        print(f"チェックポイントの先頭行を読めない: {self.path}");
+        return;
+      self._header_end = offset = len(header);
+      for line in f:
+        offset += len(line);
+        try:
+          checkpoint = json.loads(line);
+        except ValueError:
+          print(f"チェックポイントの壊れた行をスキップ: {self.path}");
+          break;
+        self._index(checkpoint["seq"], checkpoint["timestamp"], checkpoint["debts"], offset);
+    self.ready = True;
+    # 壊れた行の後ろに追記しないよう、読めた所までに切り詰める
+    self.truncate(len(self.seqs));
+  
+  def rewrite(self, origin: bool, checkpoints: List[Tuple[int, float, List[Tuple[int, int, int]]]]) -> bool:
+    """
+    チェックポイントを全て書き直す（一時ファイルに書いてから置き換える）
+    
+    Args:
+      origin: 最初のチェックポイントより前も空の状態から再生して求められるか
+      checkpoints: [(通し番号, 日時, [(債権者ID, 債務者ID, 債権額)])]
+    
+    Returns:
+      bool: 保存成功時True
+    """
+    self._reset_memory();
+    self.loaded = True;
+    self.ready = False;
+    self.origin = origin;
+    header = (json.dumps({"origin": origin}) + '\n').encode('utf-8');
+    self._header_end = offset = len(header);
+    try:
+      directory = os.path.dirname(self.path);
+      if directory:
+        os.makedirs(directory, exist_ok=True);
+      tmp_path = self.path + '.tmp';
+      with open(tmp_path, 'wb') as f:
+        f.write(header);
+        for seq, timestamp, changes in checkpoints:
+          line = self._line(seq, timestamp, changes);
+          f.write(line);
+          offset += len(line);
+          self._index(seq, timestamp, changes, offset);
+      os.replace(tmp_path, self.path);
+    except Exception as e:
+      print(f"チェックポイント書き込みエラー: {e}");
+      self._reset_memory();
+      return False;
+    self.ready = True;
+    return True;
+  
+  def append(self, seq: int, timestamp: float, changes: List[Tuple[int, int, int]]) -> bool:
+    """
+    チェックポイントを1つ追記する
+    
+    Args:
+      seq: 適用済みの履歴の件数（次の履歴の通し番号）
+      timestamp: 最後に適用した履歴の日時（to_epochの秒数）
+      changes: 前のチェックポイントから変わった組の今の債権額 [(債権者ID, 債務者ID, 債権額)]（0も含む）
+    
+    Returns:
+      bool: 追記成功時True
+    """
+    line = self._line(seq, timestamp, changes);
+    try:
+      with open(self.path, 'ab') as f:
+        f.write(line);
+        offset = f.tell();
+    except Exception as e:
+      print(f"チェックポイント書き込みエラー: {e}");
+      return False;
+    self._index(seq, timestamp, changes, offset);
+    return True;
+  
+  def truncate(self, count: int):
+    """
+    先頭からcount個を残して、後ろのチェックポイントを消す
+    
+    Args:
+      count: 残す数
+    """
+    end = self._offsets[count - 1] if count > 0 else self._header_end;
+    if os.path.getsize(self.path) > end:
+      os.truncate(self.path, end);
+    if count == len(self.seqs):
+      return;
+    last = self.seqs[count - 1] if count > 0 else -1;
+    del self.seqs[count:];
+    del self.timestamps[count:];
+    del self._offsets[count:];
+    # 組ごとの並びは通し番号順なので、末尾から外す
+    for creditor_id, debtors in list(self._pairs.items()):
+      for debtor_id, values in list(debtors.items()):
+        while values and values[-2] > last:
+          del values[-2:];
+        if not values:
+          del debtors[debtor_id];
+      if not debtors:
+        del self._pairs[creditor_id];
+  
+  def find(self, timestamp: float) -> Optional[int]:
+    """
+    指定した日時より前で最後のチェックポイントを探す
+    
+    Args:
+      timestamp: 日時（to_epochの秒数）
+    
+    Returns:
+      Optional[int]: チェックポイントの通し番号（空の状態から再生する場合は0、求められない日時ならNone）
+    """
+    index = bisect.bisect_right(self.timestamps, timestamp);
+    if index > 0:
+      return self.seqs[index - 1];
+    return 0 if self.origin else None;
+  
+  def amount_at(self, creditor_id: int, debtor_id: int, seq: int) -> int:
+    """
+    チェックポイントの時点の債権額を求める（その組が最後に記録されたチェックポイントの値）
+    
+    Args:
+      creditor_id: 債権者ID
+      debtor_id: 債務者ID
+      seq: findで見つけたチェックポイントの通し番号
+    
+    Returns:
+      int: 債権額
+    """
+    values = self._pairs.get(creditor_id, {}).get(debtor_id);
+    if values is None:
+      return 0;
+    # 通し番号がseq以下の最後の記録を二分探索する（偶数番目が通し番号）
+    low, high = 0, len(values) // 2;
+    while low < high:
+      middle = (low + high) // 2;
+      if values[middle * 2] <= seq:
+        low = middle + 1;
+      else:
+        high = middle;
+    return values[low * 2 - 1] if low > 0 else 0;
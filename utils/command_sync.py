@@ -0,0 +1,86 @@
+"""
+command_sync.py - スラッシュコマンド同期モジュール
+
+コマンドツリーの内容からハッシュを求めて保存しておき、
+前回の同期から変わっていない場合はDiscordへの同期（レート制限のあるREST呼び出し）を省く
+"""
+import hashlib;
+import json;
+import os;
+from typing import Optional;
+from discord import app_commands;
+
+def command_tree_hash(tree: app_commands.CommandTree, application_id: Optional[int]) -> str:
+  """
+  コマンドツリーのハッシュを求める
+  Discordに送る内容と同じ形に直列化するので、名前・説明・引数・権限のどれが変わってもハッシュが変わる
+  
+  Args:
+    tree: コマンドツリー
+    application_id: アプリケーションID（別のBotのトークンで起動した場合も同期し直すため）
+  
+  Returns:
+    str: SHA-256の16進文字列
+  """
+  payload = sorted(
+    (command.to_dict(tree) for command in tree.get_commands()),
+    key=lambda command: (command.get("type", 1), command["name"])
+  );
+  serialized = json.dumps(
+    {"application_id": application_id, "commands": payload},
+    ensure_ascii=False, sort_keys=True, separators=(',', ':')
+  );
+  return hashlib.sha256(serialized.encode('utf-8')).hexdigest();
+
+def read_synced_hash(path: str) -> Optional[str]:
+  """
+  前回同期したときのハッシュを読み込む
+  
+  Args:
+    path: ハッシュを保存したファイル
+  
+  Returns:
+    Optional[str]: ハッシュ（ファイルがない・読めない場合None）
+  """
+  try:
+    with open(path, 'r', encoding='utf-8') as f:
+      return f.read().strip() or None;
+  except OSError:
+    return None;
+
+def write_synced_hash(path: str, digest: str):
+  """
+  同期したときのハッシュを保存する（一時ファイルに書いてから置き換える）
+  
+  Args:
+    path: 保存先
+    digest: ハッシュ
+  """
+  directory = os.path.dirname(path);
+  if directory:
+    os.makedirs(directory, exist_ok=True);
+  tmp_path = path + '.tmp';
+  with open(tmp_path, 'w', encoding='utf-8') as f:
+    f.write(digest + '\n');
+  os.replace(tmp_path, path);
+
+async def sync_if_changed(tree: app_commands.CommandTree, application_id: Optional[int], path: str, force: bool = False) -> Optional[int]:
+  """
+  コマンドツリーが前回の同期から変わっていれば同期する
+  
+  Args:
+    tree: コマンドツリー
+    application_id: アプリケーションID
+    path: ハッシュを保存するファイル
+    force: 変わっていなくても同期する
+  
+  Returns:
+    Optional[int]: 同期したコマンドの数（変わっておらず同期を省いた場合None）
+  """
+  digest = command_tree_hash(tree, application_id);
+  if not force and read_synced_hash(path) == digest:
+    return None;
+  synced = await tree.sync();
+  # 同期に成功してから保存する（失敗したら次回の起動でもう一度同期する）
+  write_synced_hash(path, digest);
+  return len(synced);
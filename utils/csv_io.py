@@ -0,0 +1,104 @@
+"""
+csv_io.py - CSV取り込み・書き出しモジュール
+
+貸し借りのCSVを1行ずつ読んで検証し、
+債権・履歴をファイルに1件ずつ書き出す（全体をメモリ上に組み立てない）
+"""
+import csv;
+import io;
+import json;
+from typing import BinaryIO, Dict, Iterable, List, TextIO, Tuple;
+
+# 取り込むCSVの列（descriptionは省略可）
+IMPORT_COLUMNS = ("creditor", "debtor", "amount", "description");
+# エラーがこの件数に達したら読むのをやめる
+MAX_ERRORS = 10;
+# 1行で取り込める金額の上限（保存先の整数の範囲を超えないように抑える）
+MAX_AMOUNT = 10 ** 12;
+
+def read_debt_rows(stream: TextIO) -> Tuple[List[Tuple[int, int, int, str]], List[str]]:
+  """
+  貸し借りのCSVを1行ずつ読んで検証する
+  
+  Args:
+    stream: CSVのテキストストリーム（1行目は列名）
+  
+  Returns:
+    Tuple[List[Tuple[int, int, int, str]], List[str]]: ([(債権者ID, 債務者ID, 金額, 説明)], エラーの一覧)
+  """
+  reader = csv.reader(stream);
+  header = next(reader, None);
+  if header is None:
+    return [], ["ファイルが空だぞ"];
+  header = [column.strip().lower() for column in header];
+  missing = [column for column in IMPORT_COLUMNS[:3] if column not in header];
+  if missing:
+    return [], [f"列が足りない: {', '.join(missing)}"];
+  index = {column: header.index(column) for column in IMPORT_COLUMNS if column in header};
+  
+  rows = [];
+  errors = [];
+  for line_number, row in enumerate(reader, 2):
+    if not any(cell.strip() for cell in row):
+      continue;
+    try:
+      creditor_id = int(row[index["creditor"]]);
+      debtor_id = int(row[index["debtor"]]);
+      amount = int(row[index["amount"]]);
+    except (ValueError, IndexError):
+      errors.append(f"{line_number}行目: creditor・debtor・amountが整数として読めない");
+    else:
+      if amount <= 0:
+        errors.append(f"{line_number}行目: 金額は1円以上にしてくれ");
+      elif amount > MAX_AMOUNT:
+        errors.append(f"{line_number}行目: 金額は{MAX_AMOUNT:,}円以下にしてくれ");
+      elif creditor_id == debtor_id:
+        errors.append(f"{line_number}行目: 債権者と債務者が同じだぞ");
+      else:
+        description = "";
+        if "description" in index and index["description"] < len(row):
+          description = row[index["description"]].strip();
+        rows.append((creditor_id, debtor_id, amount, description));
+    if len(errors) >= MAX_ERRORS:
+      break;
+  return rows, errors;
+
+def write_debts_csv(debts: Iterable[Tuple[int, int, int]], fp: BinaryIO) -> int:
+  """
+  債権をCSVとして書き出す（取り込みと同じ列名、表計算ソフト向けにBOM付き）
+  
+  Args:
+    debts: (債権者ID, 債務者ID, 金額) を順に返すもの
+    fp: 書き込み先のバイナリファイル
+  
+  Returns:
+    int: 書き出した件数
+  """
+  text = io.TextIOWrapper(fp, encoding='utf-8-sig', newline='');
+  writer = csv.writer(text);
+  writer.writerow(IMPORT_COLUMNS[:3]);
+  count = 0;
+  for row in debts:
+    writer.writerow(row);
+    count += 1;
+  text.flush();
+  # 書き込み先のファイルは閉じずに呼び出し元へ返す
+  text.detach();
+  return count;
+
+def write_history_ndjson(entries: Iterable[Dict], fp: BinaryIO) -> int:
+  """
+  履歴を1行1件のJSON（NDJSON）として書き出す
+  
+  Args:
+    entries: 履歴を順に返すもの
+    fp: 書き込み先のバイナリファイル
+  
+  Returns:
+    int: 書き出した件数
+  """
+  count = 0;
+  for entry in entries:
+    fp.write((json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8'));
+    count += 1;
+  return count;
@@ -3,24 +3,112 @@ database.py - データベース操作モジュール
 
 借金データの永続化と操作を行う
 """
+import asyncio;
+import bisect;
+import atexit;
 import json;
 import os;
-from typing import Dict, List, Optional, Tuple;
-from datetime import datetime;
+import threading;
+import time;
+from contextlib import contextmanager;
+from typing import Dict, Iterator, List, Optional, Tuple;
+from datetime import datetime, timedelta;
 from config import Config;
+from utils.checkpoints import BalanceCheckpoints, apply_record, pair_delta, touched_pairs;
+from utils.history_archive import HistoryArchive;
+from utils.journal import DebtJournal;
+from utils.ledger_version import CowMap, LedgerVersion, net_positions;
+from utils.metrics import STORAGE_LOAD_SECONDS, STORAGE_SAVE_BYTES, STORAGE_SAVE_SECONDS;
+from utils.ranking import RankedTotals;
+from utils.records import HistoryRecord, action_code, decode_debts, decode_history, encode_debts, encode_history, to_epoch;
+from utils.settlement import plan_transfers, transfers_net;
+from utils.snapshot import SnapshotReader, write_snapshot;
+from utils.writer import GroupCommitWriter;
+
+class BatchResult:
+  """
+  batch()の結果
+  ブロックを抜けた後にokで保存の成否が分かる
+  """
+  
+  def __init__(self):
+    """
+    結果を初期化する（保存前はFalse）
+    """
+    self.ok = False;
 
 class DebtDatabase:
   """
   借金データベースクラス
   JSONファイルでデータを管理する
+  メモリ上では債権を整数IDのキーで、履歴をHistoryRecordで持ち、ファイルとの読み書きのときだけ変換する
+  読み取りは変更を確定するたびに公開する版（LedgerVersion）から行い、batch()の途中の状態は見せない
   """
   
-  def __init__(self):
+  # 読み取りが公開中の版だけを見るか（変更の適用中でも待たずに読める）
+  READS_FROM_VERSIONS = True;
+  
+  def __init__(self, data_dir: Optional[str] = None):
     """
     データベースを初期化する
+    
+    Args:
+      data_dir: データを置くディレクトリ（省略時はConfig.DATA_DIR、サーバーごとに分ける場合はシャードのディレクトリ）
     """
-    self.db_path = Config.DB_PATH;
-    self.data = self._load_data();
+    self.data_dir = data_dir or Config.DATA_DIR;
+    # シャードごとのディレクトリに同じファイル名で置く
+    self.db_path = os.path.join(self.data_dir, os.path.basename(Config.DB_PATH));
+    self.snapshot_path = os.path.join(self.data_dir, os.path.basename(Config.SNAPSHOT_PATH));
+    # スナップショットの書き込みはスレッドからも呼ばれるので排他する
+    self._snapshot_lock = threading.Lock();
+    # 変更の適用とメモリ上のデータを直接触る処理を重ねないためのロック（state_lockで初めて使うときに作る）
+    self._state_lock = None;
+    # バイナリスナップショットの履歴セクションを後から読むためのリーダー（読み込み済みならNone）
+    self._history_reader = None;
+    with STORAGE_LOAD_SECONDS.time(format=Config.SNAPSHOT_FORMAT):
+      data = self._load_data();
+      # 同じユーザーIDの整数オブジェクトを債権・履歴・インデックスで共有するためのID辞書 {id: id}
+      self._ids = {};
+      # 債権 {creditor_id: {debtor_id: amount}}（整数キー）と履歴（HistoryRecordのリスト）
+      self._debts = decode_debts(data.pop("debts"), self._ids);
+      self._history = decode_history(data.pop("history"), self._ids);
+      # 残り（history_base, journal_seq, user_settings, log_channels）はファイルと同じ形のまま持つ
+      self.data = data;
+    # 公開中の版（変更を確定するたびに作り直す）
+    self._version = None;
+    self.archive = HistoryArchive(os.path.join(self.data_dir, os.path.basename(Config.HISTORY_ARCHIVE_DIR)));
+    self._build_indexes();
+    # 集計用の列形式の履歴（history_frameで初めて使うときに作る。スレッドから更新するのでロックで守る）
+    self._columns = None;
+    self._columns_lock = threading.Lock();
+    # ジャーナルに書き出す前の操作 [["debt", 債権者, 債務者, 金額], ["history", HistoryRecord], ...]
+    self._pending_ops = [];
+    # batch()の入れ子の深さと、ブロック内の債権変更を取り消すための記録 [(債権者, 債務者, 変更前の額)]
+    self._batch_depth = 0;
+    self._undo_log = [];
+    self.journal = None;
+    if Config.PERSIST_MODE == 'journal':
+      self.journal = DebtJournal(os.path.join(self.data_dir, os.path.basename(Config.JOURNAL_PATH)), Config.JOURNAL_FSYNC);
+      self._replay_journal();
+      self.journal.open();
+    # 残高のチェックポイント（読み込みは初めて使うとき。まだなければ最初の時点指定の照会でそれまでの履歴から作る）
+    self.checkpoints = BalanceCheckpoints(os.path.join(self.data_dir, os.path.basename(Config.CHECKPOINT_PATH)), self._ids);
+    # ジャーナルへの書き込みに失敗したら、次のコンパクションでスナップショットに含める
+    self._journal_write_failed = False;
+    # 書き込みを後回しにするモード（start_writerで開始）
+    self.writer = None;
+    if Config.WRITE_BEHIND:
+      if self.journal is not None:
+        self._journal_buffer = [];
+        self.writer = GroupCommitWriter(
+          self._take_journal_buffer, self._write_journal_records, Config.WRITE_BEHIND_MAX_DELAY, lambda: self.state_lock
+        );
+      else:
+        self.writer = GroupCommitWriter(self._copy_data, self._write_snapshot, Config.WRITE_BEHIND_MAX_DELAY, lambda: self.state_lock);
+    # 履歴を後から読む場合は、起動後のアーカイブループに任せる
+    self._publish();
+    if Config.HISTORY_ARCHIVE_DAYS > 0 and self._history_reader is None:
+      self.archive_history();
   
   def _load_data(self) -> Dict:
     """
@@ -28,14 +116,31 @@ class DebtDatabase:
     
     Returns:
       Dict: 読み込んだデータ
+    
+    Raises:
+      RuntimeError: ファイルが壊れていて読み込めない場合
+        （空のデータで起動すると次の保存で元のファイルを上書きしてしまうため）
     """
+    if Config.SNAPSHOT_FORMAT == 'binary' and os.path.exists(self.snapshot_path):
+      try:
+        reader = SnapshotReader(self.snapshot_path);
+        data = reader.read_state();
+      except Exception as e:
+        print(f"データ読み込みエラー: {e}");
+        raise RuntimeError(f"{self.snapshot_path}を読み込めない。バックアップから戻してくれ") from e;
+      # 履歴は必要になるまで読まない
+      data["history"] = [];
+      self._history_reader = reader;
+      return data;
+    
+    # バイナリ形式に切り替えた直後はdebts.jsonから読み、次の保存でスナップショットを作る
     if os.path.exists(self.db_path):
       try:
         with open(self.db_path, 'r', encoding='utf-8') as f:
           return json.load(f);
       except Exception as e:
         print(f"データ読み込みエラー: {e}");
-        return self._create_empty_data();
+        raise RuntimeError(f"{self.db_path}を読み込めない。バックアップから戻してくれ") from e;
     return self._create_empty_data();
   
   def _create_empty_data(self) -> Dict:
@@ -52,6 +157,186 @@ class DebtDatabase:
       "log_channels": {}  # {guild_id: channel_id}
     };
   
+  def _build_indexes(self):
+    """
+    読み込んだデータから検索用のインデックスを作り直す
+    """
+    # 逆引きインデックス {debtor_id: {creditor_id: amount}}
+    debtor_index = {};
+    lent = {};
+    borrowed = {};
+    for creditor_id, debtors in self._debts.items():
+      for debtor_id, amount in debtors.items():
+        debtor_index.setdefault(debtor_id, {})[creditor_id] = amount;
+        lent[creditor_id] = lent.get(creditor_id, 0) + amount;
+        borrowed[debtor_id] = borrowed.get(debtor_id, 0) + amount;
+    # 版を切り出せるように、債権と逆引きはCowMapで持つ
+    self._debts = CowMap(self._debts);
+    self._debtor_index = CowMap(debtor_index);
+    # サマリー用の集計（以降は変更のたびに差分で更新する）
+    self._lent_totals = RankedTotals.from_totals(lent);
+    self._borrowed_totals = RankedTotals.from_totals(borrowed);
+    self._total_amount = sum(lent.values());
+    self._participants = len(lent.keys() | borrowed.keys());
+    self._user_history = {};
+    if self._history_reader is None:
+      self._build_history_index();
+  
+  def _build_history_index(self):
+    """
+    履歴のインデックスを作り直す
+    """
+    # アーカイブ済みなのにスナップショットに残っている履歴を落とす
+    # （アーカイブ後、スナップショット保存前に落ちた場合）
+    base = self.data.get("history_base", 0);
+    archived = self.archive.next_seq - base;
+    if archived > 0:
+      self._history = self._history[archived:];
+      self.data["history_base"] = base = self.archive.next_seq;
+    # ユーザーごとの履歴の通し番号 {user_id: [seq]}
+    # 通し番号はアーカイブ分も含めた全履歴での位置（メモリ上の位置 + history_base）
+    self._user_history = {};
+    for offset, record in enumerate(self._history):
+      self._index_history(base + offset, record);
+  
+  def _ensure_history(self):
+    """
+    履歴セクションをまだ読んでいなければ読み込む
+    """
+    if self._history_reader is not None:
+      self._merge_history(self._history_reader, self._read_history(self._history_reader));
+  
+  def _read_history(self, reader: SnapshotReader) -> List[HistoryRecord]:
+    """
+    スナップショットの履歴セクションを読み、レコードに変換する
+    
+    Args:
+      reader: リーダー
+    
+    Returns:
+      List[HistoryRecord]: 履歴
+    """
+    return decode_history(reader.read_history(), self._ids);
+  
+  def _merge_history(self, reader: SnapshotReader, loaded: List[HistoryRecord]):
+    """
+    読み込んだ履歴を、未読の間に追加された履歴の前につなげる
+    
+    Args:
+      reader: 履歴を読んだリーダー
+      loaded: スナップショットの履歴
+    """
+    if self._history_reader is not reader:
+      return;
+    self._history_reader = None;
+    self._history = loaded + self._history;
+    self._build_history_index();
+    # 公開中の版に履歴を付ける（batch()の途中でも、版の範囲より後の履歴は見えない）
+    self._version = self._version.with_history(self._history, self.data.get("history_base", 0), self._user_history);
+  
+  @property
+  def state_lock(self) -> asyncio.Lock:
+    """
+    変更の適用中にメモリ上のデータを触らないためのロック
+    MutationQueueは変更をスレッドで適用する間これを持つので、イベントループ上で版ではなく
+    メモリ上のデータを読み書きする処理（時点指定の照会・アーカイブ・書き出す内容の取り出しなど）はこれを取ってから行う
+    
+    Returns:
+      asyncio.Lock: ロック（イベントループ上で初めて使うときに作る）
+    """
+    if self._state_lock is None:
+      self._state_lock = asyncio.Lock();
+    return self._state_lock;
+  
+  async def preload_history(self):
+    """
+    履歴セクションをスレッドで読み込む（起動後にバックグラウンドで呼ぶ）
+    """
+    reader = self._history_reader;
+    if reader is None:
+      return;
+    loaded = await asyncio.to_thread(self._read_history, reader);
+    async with self.state_lock:
+      self._merge_history(reader, loaded);
+  
+  def _index_history(self, seq: int, record: HistoryRecord):
+    """
+    履歴をユーザーごとのインデックスに登録する
+    
+    Args:
+      seq: 履歴の通し番号
+      record: 履歴
+    """
+    self._user_history.setdefault(record.creditor, []).append(seq);
+    if record.debtor != record.creditor:
+      self._user_history.setdefault(record.debtor, []).append(seq);
+  
+  def _append_history(self, record: HistoryRecord):
+    """
+    履歴をリストの末尾に追加し、インデックスに登録する
+    
+    Args:
+      record: 履歴
+    """
+    history = self._history;
+    history.append(record);
+    if self._history_reader is not None:
+      # 未読の履歴の後ろに付く。インデックスは読み込み時にまとめて作る
+      return;
+    self._index_history(self.data.get("history_base", 0) + len(history) - 1, record);
+  
+  def _publish(self):
+    """
+    今の状態を新しい版として公開する
+    債権・集計は変わった部分だけを複製し、履歴は共有して範囲だけを記録する
+    """
+    number = self._version.number + 1 if self._version is not None else 1;
+    history = self._history if self._history_reader is None else None;
+    self._version = LedgerVersion(
+      number, self._debts.freeze(), self._debtor_index.freeze(), self._lent_totals.freeze(), self._borrowed_totals.freeze(),
+      self._total_amount, self._participants,
+      history, self.data.get("history_base", 0), self._history_top(), self._user_history, self.data["log_channels"], self.archive
+    );
+  
+  def current_version(self) -> LedgerVersion:
+    """
+    公開中の版を取得する（履歴をまだ読んでいなければ読み込む）
+    版は変更されないので、スレッドからロックなしで読んでよい
+    
+    Returns:
+      LedgerVersion: 版
+    """
+    self._ensure_history();
+    return self._version;
+  
+  def _is_participant(self, user_id: int) -> bool:
+    """
+    貸し借りのどちらかがあるユーザーか判定する
+    
+    Args:
+      user_id: ユーザーID
+    
+    Returns:
+      bool: 関係者の場合True
+    """
+    return user_id in self._lent_totals or user_id in self._borrowed_totals;
+  
+  def _update_totals(self, creditor_id: int, debtor_id: int, delta: int):
+    """
+    債権額の増減をサマリー用の集計に反映する
+    
+    Args:
+      creditor_id: 債権者ID
+      debtor_id: 債務者ID
+      delta: 債権額の増減
+    """
+    before = self._is_participant(creditor_id) + self._is_participant(debtor_id);
+    self._lent_totals.add(creditor_id, delta);
+    self._borrowed_totals.add(debtor_id, delta);
+    after = self._is_participant(creditor_id) + self._is_participant(debtor_id);
+    self._participants += after - before;
+    self._total_amount += delta;
+  
   def _save_data(self) -> bool:
     """
     データをファイルに保存する
@@ -59,15 +344,358 @@ class DebtDatabase:
     Returns:
       bool: 保存成功時True
     """
+    self._ensure_history();
+    return self._write_snapshot(dict(self.data, debts=self._debts, history=self._history));
+  
+  def _write_snapshot(self, state: Dict) -> bool:
+    """
+    データを保存形式に変換し、一時ファイルに書き出してから置き換える
+    書き込み途中で落ちても元のファイルが壊れないようにする
+    
+    Args:
+      state: 保存するデータ（debtsは整数キー、historyはHistoryRecordのリスト）
+    
+    Returns:
+      bool: 保存成功時True
+    """
+    start = time.perf_counter();
     try:
-      os.makedirs(os.path.dirname(self.db_path), exist_ok=True);
-      with open(self.db_path, 'w', encoding='utf-8') as f:
-        json.dump(self.data, f, ensure_ascii=False, indent=2);
+      data = dict(state, debts=encode_debts(state["debts"]), history=encode_history(state["history"]));
+      with self._snapshot_lock:
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True);
+        if Config.SNAPSHOT_FORMAT == 'binary':
+          write_snapshot(self.snapshot_path, data);
+          path = self.snapshot_path;
+        else:
+          tmp_path = self.db_path + '.tmp';
+          with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2);
+          os.replace(tmp_path, self.db_path);
+          path = self.db_path;
+        STORAGE_SAVE_BYTES.observe(os.path.getsize(path), kind="snapshot");
+      STORAGE_SAVE_SECONDS.observe(time.perf_counter() - start, kind="snapshot");
       return True;
     except Exception as e:
       print(f"データ保存エラー: {e}");
       return False;
   
+  def _commit(self) -> bool:
+    """
+    積まれた操作を永続化する
+    ジャーナルモードでは1レコードの追記のみ、それ以外はファイル全体を保存する
+    
+    Returns:
+      bool: 永続化成功時True（batch()の中では常にTrue）
+    """
+    if self._batch_depth:
+      # batch()の中では、ブロックを抜けるときにまとめて永続化する
+      return True;
+    self._publish();
+    self._checkpoint_if_due();
+    ops = self._pending_ops;
+    self._pending_ops = [];
+    write_behind = self.writer is not None and self.writer.running;
+    if self.journal is None:
+      if write_behind:
+        self.writer.notify();
+        return True;
+      return self._save_data();
+    if not ops:
+      return True;
+    seq = self.data.get("journal_seq", 0) + 1;
+    self.data["journal_seq"] = seq;
+    record = {"seq": seq, "ops": [self._encode_op(op) for op in ops]};
+    if write_behind:
+      self._journal_buffer.append(record);
+      self.writer.notify();
+      return True;
+    return self.journal.append(record);
+  
+  @staticmethod
+  def _encode_op(op: List) -> List:
+    """
+    操作をジャーナルに書ける形にする（履歴のレコードを辞書に戻す）
+    
+    Args:
+      op: 操作
+    
+    Returns:
+      List: JSONにできる操作
+    """
+    if op[0] == "history":
+      return ["history", op[1].to_dict()];
+    return op;
+  
+  def _take_journal_buffer(self) -> List[Dict]:
+    """
+    書き込み待ちのジャーナルレコードを取り出す（書き込み器から呼ばれる）
+    
+    Returns:
+      List[Dict]: レコード
+    """
+    records = self._journal_buffer;
+    self._journal_buffer = [];
+    return records;
+  
+  def _write_journal_records(self, records: List[Dict]) -> bool:
+    """
+    ジャーナルレコードをまとめて追記する（書き込み器のスレッドから呼ばれる）
+    失敗したレコードはメモリには反映済みなので、次のコンパクションで保存する
+    
+    Args:
+      records: レコード
+    
+    Returns:
+      bool: 追記成功時True
+    """
+    if self.journal.append_many(records):
+      return True;
+    self._journal_write_failed = True;
+    return False;
+  
+  def start_writer(self):
+    """
+    書き込みを後回しにするバックグラウンドタスクを開始する（イベントループ上で呼ぶ）
+    """
+    if self.writer is None:
+      return;
+    self.writer.start();
+    # ループが止まった後に残った変更も書き出す
+    atexit.register(self.writer.flush_sync);
+  
+  async def wait_durable(self) -> bool:
+    """
+    ここまでの変更がディスクに書かれるまで待つ
+    
+    Returns:
+      bool: 書き込み成功時True
+    """
+    if self.writer is None or not self.writer.running:
+      return True;
+    return await self.writer.durable();
+  
+  def _replay_journal(self):
+    """
+    スナップショット以降のジャーナルを再生してメモリ上のデータを復元する
+    """
+    count = 0;
+    for record in self.journal.replay(self.data.get("journal_seq", 0)):
+      for op in record["ops"]:
+        self._apply_op(op);
+      self.data["journal_seq"] = record["seq"];
+      count += 1;
+    self._pending_ops = [];
+    if count:
+      print(f"ジャーナルから{count}件の変更を復元した");
+  
+  def _apply_op(self, op: List):
+    """
+    ジャーナルの操作を1件適用する
+    
+    Args:
+      op: 操作 ["debt", 債権者, 債務者, 金額] / ["history", 履歴] / ["log_channel", サーバー, チャンネル]
+        （以前のジャーナルでは債権者・債務者が文字列）
+    """
+    kind = op[0];
+    if kind == "debt":
+      self._set_debt(int(op[1]), int(op[2]), op[3]);
+    elif kind == "history":
+      self._append_history(HistoryRecord.from_dict(op[1], self._ids));
+    elif kind == "log_channel":
+      self.data["log_channels"] = dict(self.data["log_channels"], **{op[1]: op[2]});
+  
+  def _set_debt(self, creditor_id: int, debtor_id: int, amount: int):
+    """
+    債権額を設定する（0の場合は削除する）
+    債権の変更は全てここを通し、ジャーナル用の操作も積む
+    
+    Args:
+      creditor_id: 債権者ID
+      debtor_id: 債務者ID
+      amount: 設定後の債権額
+    """
+    debts = self._debts;
+    creditor_id = self._ids.setdefault(creditor_id, creditor_id);
+    debtor_id = self._ids.setdefault(debtor_id, debtor_id);
+    old_amount = debts.get(creditor_id, {}).get(debtor_id, 0);
+    self._update_totals(creditor_id, debtor_id, amount - old_amount);
+    # 公開中の版と共有している部分は、CowMapが変更前に複製する
+    if amount == 0:
+      debts.delete_in(creditor_id, debtor_id);
+      self._debtor_index.delete_in(debtor_id, creditor_id);
+    else:
+      debts.set_in(creditor_id, debtor_id, amount);
+      self._debtor_index.set_in(debtor_id, creditor_id, amount);
+    self._pending_ops.append(["debt", creditor_id, debtor_id, amount]);
+    if self._batch_depth:
+      self._undo_log.append((creditor_id, debtor_id, old_amount));
+  
+  def needs_compaction(self) -> bool:
+    """
+    ジャーナルをスナップショットにまとめるべきか判定する
+    
+    Returns:
+      bool: コンパクションが必要な場合True
+    """
+    if self.journal is None:
+      return False;
+    return self._journal_write_failed or self.journal.record_count >= Config.JOURNAL_COMPACT_THRESHOLD;
+  
+  def _copy_data(self) -> Dict:
+    """
+    スナップショット用にデータを複製する
+    債権は公開中の版をそのまま使う（変更されないので複製しない）
+    履歴の各レコードは追加後に変更されないので、版の範囲の浅いコピーで十分
+    保存形式への変換は書き出し時（_write_snapshot、書き込み器ではスレッド）に行う
+    
+    Returns:
+      Dict: 複製したデータ
+    """
+    version = self.current_version();
+    snapshot = dict(self.data);
+    snapshot["debts"] = version.debts;
+    snapshot["history"] = version.history[:version.history_top - version.history_base];
+    snapshot["user_settings"] = {user: dict(settings) for user, settings in self.data["user_settings"].items()};
+    snapshot["log_channels"] = version.log_channels;
+    return snapshot;
+  
+  def _prepare_compaction(self) -> Dict:
+    """
+    コンパクション用にデータを複製し、ジャーナルを退避する
+    
+    Returns:
+      Dict: スナップショットとして書き出すデータ
+    """
+    snapshot = self._copy_data();
+    self._journal_write_failed = False;
+    self.journal.rotate();
+    return snapshot;
+  
+  def compact(self) -> bool:
+    """
+    ジャーナルをスナップショットにまとめる（同期版）
+    
+    Returns:
+      bool: コンパクション成功時True
+    """
+    if self.journal is None:
+      return False;
+    snapshot = self._prepare_compaction();
+    if not self._write_snapshot(snapshot):
+      self._journal_write_failed = True;
+      return False;
+    self.journal.discard_rotated();
+    return True;
+  
+  async def compact_async(self) -> bool:
+    """
+    ジャーナルをスナップショットにまとめる
+    ファイルへの書き出しはスレッドで行い、イベントループを止めない
+    
+    Returns:
+      bool: コンパクション成功時True
+    """
+    if self.journal is None:
+      return False;
+    async with self.state_lock:
+      snapshot = self._prepare_compaction();
+    if not await asyncio.to_thread(self._write_snapshot, snapshot):
+      self._journal_write_failed = True;
+      return False;
+    self.journal.discard_rotated();
+    return True;
+  
+  async def aclose(self):
+    """
+    残っている変更を書き込んでからデータベースを閉じる
+    """
+    if self.writer is not None:
+      await self.writer.close();
+    self.close();
+  
+  def close(self):
+    """
+    データベースを閉じる
+    """
+    if self.journal is not None:
+      self.journal.close();
+  
+  def _history_count(self) -> int:
+    """
+    メモリ上の履歴の件数（未読のスナップショット分を含む）
+    
+    Returns:
+      int: 件数
+    """
+    unloaded = self._history_reader.history_count if self._history_reader is not None else 0;
+    return unloaded + len(self._history);
+  
+  def _history_top(self) -> int:
+    """
+    次に追加される履歴の通し番号（アーカイブ分も含めた履歴の件数）
+    
+    Returns:
+      int: 通し番号
+    """
+    return self.data.get("history_base", 0) + self._history_count();
+  
+  @contextmanager
+  def batch(self) -> Iterator[BatchResult]:
+    """
+    ブロック内の変更を1回の保存（ジャーナルでは1レコード）にまとめる
+    ブロック内で例外が出た場合はブロック内の変更を取り消して例外を投げ直す
+    入れ子にした場合、内側の例外では内側の変更だけを取り消す（セーブポイント）
+    
+    Yields:
+      BatchResult: 一番外側のブロックを抜けた後、okに保存の成否が入る
+    """
+    result = BatchResult();
+    undo_mark = len(self._undo_log);
+    ops_mark = len(self._pending_ops);
+    history_mark = self._history_count();
+    self._batch_depth += 1;
+    try:
+      yield result;
+    except Exception:
+      self._rollback(undo_mark, ops_mark, history_mark);
+      raise;
+    finally:
+      self._batch_depth -= 1;
+    if self._batch_depth == 0:
+      self._undo_log = [];
+      result.ok = self._commit();
+    else:
+      result.ok = True;
+  
+  def _rollback(self, undo_mark: int, ops_mark: int, history_mark: int):
+    """
+    batch()の中の変更を記録した位置まで取り消す
+    
+    Args:
+      undo_mark: 取り消し記録の位置
+      ops_mark: 積まれた操作の位置
+      history_mark: 履歴の件数
+    """
+    for creditor_id, debtor_id, old_amount in reversed(self._undo_log[undo_mark:]):
+      self._set_debt(creditor_id, debtor_id, old_amount);
+    # 取り消しで積まれた分も含めて捨てる
+    del self._undo_log[undo_mark:];
+    del self._pending_ops[ops_mark:];
+    
+    count = self._history_count() - history_mark;
+    if count > 0:
+      history = self._history;
+      removed = history[-count:];
+      del history[-count:];
+      if self._history_reader is None:
+        # 新しい順に外すと、各ユーザーの索引の末尾から外すだけで済む
+        for record in reversed(removed):
+          for user_id in {record.creditor, record.debtor}:
+            seqs = self._user_history[user_id];
+            seqs.pop();
+            if not seqs:
+              del self._user_history[user_id];
+  
   def add_debt(self, creditor_id: int, debtor_id: int, amount: int, description: str = "") -> bool:
     """
     借金を追加する
@@ -81,19 +709,28 @@ class DebtDatabase:
     Returns:
       bool: 追加成功時True
     """
-    creditor_str = str(creditor_id);
-    debtor_str = str(debtor_id);
-    
-    if creditor_str not in self.data["debts"]:
-      self.data["debts"][creditor_str] = {};
-    
-    current_amount = self.data["debts"][creditor_str].get(debtor_str, 0);
-    self.data["debts"][creditor_str][debtor_str] = current_amount + amount;
+    current_amount = self._live_debt(creditor_id, debtor_id);
+    self._set_debt(creditor_id, debtor_id, current_amount + amount);
     
     # 履歴を追加
     self._add_history("add", creditor_id, debtor_id, amount, description);
     
-    return self._save_data();
+    return self._commit();
+  
+  def add_debts(self, entries: List[Tuple[int, int, int, str]]) -> bool:
+    """
+    複数の借金をまとめて追加する（1回の保存で全件反映、失敗時は1件も反映しない）
+    
+    Args:
+      entries: [(債権者ID, 債務者ID, 金額, 説明)]
+    
+    Returns:
+      bool: 追加成功時True
+    """
+    with self.batch() as result:
+      for creditor_id, debtor_id, amount, description in entries:
+        self.add_debt(creditor_id, debtor_id, amount, description);
+    return result.ok;
   
   def pay_debt(self, creditor_id: int, debtor_id: int, amount: int, payer_id: Optional[int] = None) -> Tuple[bool, int]:
     """
@@ -108,39 +745,30 @@ class DebtDatabase:
     Returns:
       Tuple[bool, int]: (成功フラグ, 残りの借金額)
     """
-    creditor_str = str(creditor_id);
-    debtor_str = str(debtor_id);
-    
-    if creditor_str not in self.data["debts"]:
+    if creditor_id not in self._debts:
       return False, 0;
     
-    if debtor_str not in self.data["debts"][creditor_str]:
+    if debtor_id not in self._debts[creditor_id]:
       return False, 0;
     
-    current_amount = self.data["debts"][creditor_str][debtor_str];
+    current_amount = self._debts[creditor_id][debtor_id];
     
     if amount > current_amount:
       return False, current_amount;
     
     new_amount = current_amount - amount;
-    
-    if new_amount == 0:
-      del self.data["debts"][creditor_str][debtor_str];
-      if not self.data["debts"][creditor_str]:
-        del self.data["debts"][creditor_str];
-    else:
-      self.data["debts"][creditor_str][debtor_str] = new_amount;
+    self._set_debt(creditor_id, debtor_id, new_amount);
     
     # 履歴を追加（代理返済の場合はpayer_idを記録）
     description = f"paid_by:{payer_id}" if payer_id and payer_id != debtor_id else "";
     self._add_history("pay", creditor_id, debtor_id, amount, description);
     
-    self._save_data();
+    self._commit();
     return True, new_amount;
   
-  def get_debt(self, creditor_id: int, debtor_id: int) -> int:
+  def _live_debt(self, creditor_id: int, debtor_id: int) -> int:
     """
-    特定の債権額を取得する
+    batch()の途中の変更も含めた今の債権額を取得する（変更処理の中で使う）
     
     Args:
       creditor_id: 債権者のID
@@ -149,37 +777,20 @@ class DebtDatabase:
     Returns:
       int: 債権額
     """
-    creditor_str = str(creditor_id);
-    debtor_str = str(debtor_id);
-    
-    if creditor_str in self.data["debts"]:
-      return self.data["debts"][creditor_str].get(debtor_str, 0);
-    return 0;
+    debtors = self._debts.get(creditor_id);
+    return debtors.get(debtor_id, 0) if debtors else 0;
+  
+  def get_debt(self, creditor_id: int, debtor_id: int) -> int:
+    """公開中の版の債権額を取得する"""
+    return self._version.get_debt(creditor_id, debtor_id);
   
   def get_user_debts(self, user_id: int) -> Dict[str, List[Tuple[int, int]]]:
-    """
-    ユーザーの借金一覧を取得する
-    
-    Args:
-      user_id: ユーザーID
-    
-    Returns:
-      Dict: {"creditor": [(debtor_id, amount)], "debtor": [(creditor_id, amount)]}
-    """
-    user_str = str(user_id);
-    result = {"creditor": [], "debtor": []};
-    
-    # 自分が貸している分
-    if user_str in self.data["debts"]:
-      for debtor_id, amount in self.data["debts"][user_str].items():
-        result["creditor"].append((int(debtor_id), amount));
-    
-    # 自分が借りている分
-    for creditor_id, debtors in self.data["debts"].items():
-      if user_str in debtors:
-        result["debtor"].append((int(creditor_id), debtors[user_str]));
-    
-    return result;
+    """公開中の版からユーザーの借金一覧を取得する"""
+    return self._version.get_user_debts(user_id);
+  
+  def get_user_debts_page(self, user_id: int, offset: int = 0, limit: int = 15) -> Dict:
+    """公開中の版からユーザーの貸し借り一覧を1ページ分取得する"""
+    return self._version.get_user_debts_page(user_id, offset, limit);
   
   def transfer_debt(self, creditor_id: int, debtor_id: int, new_creditor_id: int, amount: int) -> Tuple[bool, str, int]:
     """
@@ -195,7 +806,7 @@ class DebtDatabase:
       Tuple[bool, str, int]: (成功フラグ, エラーメッセージ, 残りの債権額)
     """
     # 債権の存在チェック
-    current_debt = self.get_debt(creditor_id, debtor_id);
+    current_debt = self._live_debt(creditor_id, debtor_id);
     if current_debt == 0:
       return False, f"債権がないぞ！", 0;
     
@@ -207,69 +818,314 @@ class DebtDatabase:
       return False, "金額は1円以上を指定してくれ", current_debt;
     
     # 元の債権者から債権を減らす
-    creditor_str = str(creditor_id);
-    debtor_str = str(debtor_id);
-    new_creditor_str = str(new_creditor_id);
-    
-    self.data["debts"][creditor_str][debtor_str] -= amount;
-    remaining = self.data["debts"][creditor_str][debtor_str];
-    
-    if self.data["debts"][creditor_str][debtor_str] == 0:
-      del self.data["debts"][creditor_str][debtor_str];
-      if not self.data["debts"][creditor_str]:
-        del self.data["debts"][creditor_str];
+    remaining = current_debt - amount;
+    self._set_debt(creditor_id, debtor_id, remaining);
     
     # 新しい債権者に債権を追加
-    if new_creditor_str not in self.data["debts"]:
-      self.data["debts"][new_creditor_str] = {};
-    
-    current_new_debt = self.data["debts"][new_creditor_str].get(debtor_str, 0);
-    self.data["debts"][new_creditor_str][debtor_str] = current_new_debt + amount;
+    current_new_debt = self._live_debt(new_creditor_id, debtor_id);
+    self._set_debt(new_creditor_id, debtor_id, current_new_debt + amount);
     
     # 履歴を追加
     self._add_history("transfer", creditor_id, debtor_id, amount, f"to:{new_creditor_id}");
     
-    self._save_data();
+    self._commit();
     return True, "", remaining;
   
-  def get_history(self, user_id: Optional[int] = None, limit: int = 10) -> List[Dict]:
+  def plan_settlement(self) -> List[Tuple[int, int, int]]:
+    """
+    全員の貸し借りを最小限の送金にまとめた精算案を求める（データは変更しない）
+    
+    Returns:
+      List[Tuple[int, int, int]]: [(債権者ID, 債務者ID, 金額)]
+    """
+    return plan_transfers(self._version.net_positions());
+  
+  def apply_settlement(self, plan: List[Tuple[int, int, int]]) -> Tuple[bool, str]:
+    """
+    精算案の通りに貸し借りを書き換える（1回の保存でまとめて反映する）
+    
+    Args:
+      plan: plan_settlementで求めた精算案
+    
+    Returns:
+      Tuple[bool, str]: (成功フラグ, エラーメッセージ)
+    """
+    if any(amount <= 0 or creditor == debtor for creditor, debtor, amount in plan):
+      return False, "精算案が正しくない";
+    
+    # 精算案を出した後に貸し借りが変わっていたら反映しない
+    if transfers_net(plan) != net_positions(self._lent_totals.totals(), self._borrowed_totals.totals()):
+      return False, "精算案を出した後に貸し借りが変わった。もう一度確認してくれ";
+    
+    new_debts = {};
+    for creditor, debtor, amount in plan:
+      key = (creditor, debtor);
+      new_debts[key] = new_debts.get(key, 0) + amount;
+    
+    # 精算案にそのまま残る債権以外を消してから、新しい債権を設定する
+    for creditor_id, debtors in list(self._debts.items()):
+      for debtor_id, amount in list(debtors.items()):
+        if new_debts.get((creditor_id, debtor_id)) == amount:
+          del new_debts[(creditor_id, debtor_id)];
+          continue;
+        self._set_debt(creditor_id, debtor_id, 0);
+        self._add_history("settle_clear", creditor_id, debtor_id, amount, "精算");
+    for (creditor_id, debtor_id), amount in new_debts.items():
+      self._set_debt(creditor_id, debtor_id, amount);
+      self._add_history("settle", creditor_id, debtor_id, amount, "精算");
+    
+    if not self._commit():
+      return False, "保存に失敗した";
+    return True, "";
+  
+  def iter_debts(self) -> Iterator[Tuple[int, int, int]]:
+    """公開中の版の債権を順に返す（書き出し用）"""
+    return self._version.iter_debts();
+  
+  def iter_history(self) -> Iterator[Dict]:
+    """公開中の版の履歴を古い順に返す（書き出し用、アーカイブ分も含む）"""
+    return self.current_version().iter_history();
+  
+  def get_history(self, user_id: Optional[int] = None, limit: int = 10, before: Optional[int] = None) -> List[Dict]:
     """
     履歴を取得する
     
     Args:
       user_id: ユーザーID（指定時はそのユーザーの履歴のみ）
       limit: 取得件数
+      before: この通し番号より前の履歴を取得する（指定なしで最新から）
+    
+    Returns:
+      List[Dict]: 履歴のリスト（古い順、各履歴に通し番号 "id" を付ける）
+    """
+    return self.get_history_page(user_id, limit, before)[0];
+  
+  def get_history_page(self, user_id: Optional[int] = None, limit: int = 10, before: Optional[int] = None) -> Tuple[List[Dict], Optional[int]]:
+    """公開中の版から履歴を1ページ分取得する"""
+    return self.current_version().get_history_page(user_id, limit, before);
+  
+  def history_frame(self, version: LedgerVersion):
+    """
+    集計用の列形式の履歴を版の時点まで更新し、複製を返す（アーカイブ分も含む）
+    前回から増えた履歴だけを列に追加する。版だけを読むので、スレッドから呼んでよい
+    
+    Args:
+      version: current_versionで取得した版
+    
+    Returns:
+      HistoryFrame: 列の複製
+    """
+    # 集計を使うときだけインポートする（numpyがあれば読み込まれるため）
+    from utils.analytics import HistoryColumns;
+    base = version.history_base;
+    top = version.history_top;
+    with self._columns_lock:
+      if self._columns is None or self._columns.position > top:
+        # 初回（読み直しなどで前回より古い版を渡された場合も作り直す）
+        self._columns = HistoryColumns();
+      columns = self._columns;
+      if columns.position < base:
+        # 前回から今回までにアーカイブへ移った分（初回はアーカイブ全体）はアーカイブから読む
+        records = [];
+        for entry in version.archive.iter_entries():
+          if entry["id"] >= base:
+            break;
+          if entry["id"] >= columns.position:
+            records.append(HistoryRecord.from_dict(entry, self._ids));
+        columns.extend(records, base);
+      columns.extend(version.history[columns.position - base:top - base], top);
+      return columns.frame();
+  
+  def _checkpoints_ready(self) -> bool:
+    """
+    作成済みのチェックポイントを初回だけ読み込む
+    保存前に落ちて失われた履歴の後に作ったチェックポイントは、通し番号が別の履歴に使い回されるので捨てる
+    
+    Returns:
+      bool: チェックポイントを使える場合True
+    """
+    checkpoints = self.checkpoints;
+    if checkpoints.loaded:
+      return checkpoints.ready;
+    checkpoints.load();
+    if not checkpoints.ready:
+      return False;
+    self._ensure_history();
+    base = self.data.get("history_base", 0);
+    keep = len(checkpoints.seqs);
+    while keep > 0:
+      seq = checkpoints.seqs[keep - 1];
+      # アーカイブ済みの履歴までのチェックポイントと、最後に適用した履歴の日時が一致するものは残す
+      if seq <= base:
+        break;
+      if seq - base <= len(self._history) and self._history[seq - base - 1].timestamp == checkpoints.timestamps[keep - 1]:
+        break;
+      keep -= 1;
+    checkpoints.truncate(keep);
+    if keep == 0 and not checkpoints.origin:
+      # 債権全体を記録した最初のチェックポイントがなくなったので作り直させる
+      checkpoints.ready = False;
+    return checkpoints.ready;
+  
+  def _checkpoint_if_due(self):
+    """
+    前のチェックポイントから履歴がCHECKPOINT_INTERVAL件以上増えていれば、
+    その間に変わった組の今の債権額をチェックポイントとして追記する
+    チェックポイントをまだ作っていない場合は、最初の時点指定の照会でまとめて作るので何もしない
+    """
+    if Config.CHECKPOINT_INTERVAL <= 0 or self._history_reader is not None or not self._history:
+      return;
+    if not self._checkpoints_ready():
+      return;
+    top = self._history_top();
+    last = self.checkpoints.last_seq;
+    if top - last < Config.CHECKPOINT_INTERVAL:
+      return;
+    pairs = set();
+    for record in self._iter_records_from(last):
+      pairs.update(touched_pairs(record));
+    changes = [(creditor_id, debtor_id, self._live_debt(creditor_id, debtor_id)) for creditor_id, debtor_id in sorted(pairs)];
+    self.checkpoints.append(top, self._history[-1].timestamp, changes);
+  
+  def _build_checkpoints(self):
+    """
+    全履歴（アーカイブ分を含む）を空の状態から再生し、CHECKPOINT_INTERVAL件ごとにチェックポイントを作る
+    再生した結果が今の債権と一致しない場合（履歴を記録する前からの債権がある場合）は、
+    今の債権全体を最初のチェックポイントにし、それより前の日時は求められないものとする
+    """
+    self._ensure_history();
+    interval = Config.CHECKPOINT_INTERVAL;
+    debts = {};
+    pairs = set();
+    checkpoints = [];
+    seq = 0;
+    timestamp = None;
+    for record in self._iter_records_from(0):
+      apply_record(debts, record);
+      pairs.update(touched_pairs(record));
+      seq += 1;
+      timestamp = record.timestamp;
+      if interval > 0 and seq % interval == 0:
+        checkpoints.append((seq, timestamp, [(creditor_id, debtor_id, debts.get(creditor_id, {}).get(debtor_id, 0)) for creditor_id, debtor_id in sorted(pairs)]));
+        pairs = set();
+    
+    if debts == dict(self._debts.items()):
+      self.checkpoints.rewrite(True, checkpoints);
+      return;
+    print("履歴から今の債権を再現できないため、今の時点からチェックポイントを作る");
+    if timestamp is None:
+      timestamp = to_epoch(datetime.now());
+    self.checkpoints.rewrite(False, [(seq, timestamp, list(self.iter_debts()))]);
+  
+  def _iter_records_from(self, seq: int) -> Iterator[HistoryRecord]:
+    """
+    指定した通し番号以降の履歴を古い順に返す（アーカイブ分も含む）
+    
+    Args:
+      seq: 最初の通し番号
+    
+    Yields:
+      HistoryRecord: 履歴
+    """
+    base = self.data.get("history_base", 0);
+    if seq < base:
+      for entry in self.archive.iter_from(seq):
+        yield HistoryRecord.from_dict(entry);
+    history = self._history;
+    for index in range(max(seq - base, 0), len(history)):
+      yield history[index];
+  
+  def get_debt_at(self, creditor_id: int, debtor_id: int, when: datetime) -> Optional[int]:
+    """
+    指定した日時の時点の債権額を求める
+    直前のチェックポイントから、その日時までの履歴を再生する（再生する件数はチェックポイントの間隔まで）
+    
+    Args:
+      creditor_id: 債権者のID
+      debtor_id: 債務者のID
+      when: 日時（タイムゾーンなしの場合は現地時刻）
+    
+    Returns:
+      Optional[int]: 債権額（記録を始める前の日時で求められない場合None）
+    """
+    self._ensure_history();
+    if not self._checkpoints_ready():
+      self._build_checkpoints();
+    at = to_epoch(when);
+    seq = self.checkpoints.find(at);
+    if seq is None:
+      return None;
+    amount = self.checkpoints.amount_at(creditor_id, debtor_id, seq);
+    for record in self._iter_records_from(seq):
+      if record.timestamp > at:
+        break;
+      amount += pair_delta(record, creditor_id, debtor_id);
+    return amount;
+  
+  def archive_history(self) -> int:
+    """
+    HISTORY_ARCHIVE_DAYSより古い履歴をアーカイブに移し、メモリから外す
     
     Returns:
-      List[Dict]: 履歴のリスト
+      int: アーカイブした件数
     """
-    history = self.data["history"];
+    if Config.HISTORY_ARCHIVE_DAYS <= 0:
+      return 0;
+    self._ensure_history();
+    cutoff = to_epoch(datetime.now() - timedelta(days=Config.HISTORY_ARCHIVE_DAYS));
+    history = self._history;
+    count = 0;
+    while count < len(history) and history[count].timestamp < cutoff:
+      count += 1;
+    if count == 0:
+      return 0;
     
-    if user_id:
-      user_str = str(user_id);
-      history = [h for h in history if h["creditor"] == user_str or h["debtor"] == user_str];
+    base = self.data.get("history_base", 0);
+    archived = history[:count];
+    if not self.archive.append(base, encode_history(archived)):
+      return 0;
     
-    return history[-limit:];
+    # 先頭を削るのではなく新しいリストにする（コンパクション中のコピーに影響させない）
+    self._history = history[count:];
+    new_base = base + count;
+    self.data["history_base"] = new_base;
+    # 公開済みの版が索引を使っているので、削る索引は複製してから差し替える
+    user_history = dict(self._user_history);
+    users = {r.creditor for r in archived} | {r.debtor for r in archived};
+    for user in users:
+      seqs = user_history[user];
+      seqs = seqs[bisect.bisect_left(seqs, new_base):];
+      if seqs:
+        user_history[user] = seqs;
+      else:
+        del user_history[user];
+    self._user_history = user_history;
+    self._publish();
+    
+    # 履歴の位置が変わったのでスナップショットを書き直す
+    if self.journal is not None:
+      self.compact();
+    else:
+      self._commit();
+    print(f"{count}件の履歴をアーカイブした");
+    return count;
   
   def _add_history(self, action: str, creditor_id: int, debtor_id: int, amount: int, description: str):
     """
     履歴を追加する
     
     Args:
-      action: アクション種別（add, pay, transfer）
+      action: アクション種別（add, pay, transfer, settle, settle_clear）
       creditor_id: 債権者ID
       debtor_id: 債務者ID
       amount: 金額
       description: 説明
     """
-    self.data["history"].append({
-      "action": action,
-      "creditor": str(creditor_id),
-      "debtor": str(debtor_id),
-      "amount": amount,
-      "description": description,
-      "timestamp": datetime.now().isoformat()
-    });
+    creditor_id = self._ids.setdefault(creditor_id, creditor_id);
+    debtor_id = self._ids.setdefault(debtor_id, debtor_id);
+    record = HistoryRecord(action_code(action), creditor_id, debtor_id, amount, description, to_epoch(datetime.now()));
+    self._append_history(record);
+    self._pending_ops.append(["history", record]);
   
   def set_log_channel(self, guild_id: int, channel_id: int) -> bool:
     """
@@ -282,74 +1138,40 @@ class DebtDatabase:
     Returns:
       bool: 設定成功時True
     """
-    self.data["log_channels"][str(guild_id)] = channel_id;
-    return self._save_data();
+    # 公開中の版と共有しているので、複製して差し替える
+    self.data["log_channels"] = dict(self.data["log_channels"], **{str(guild_id): channel_id});
+    self._pending_ops.append(["log_channel", str(guild_id), channel_id]);
+    return self._commit();
   
   def get_log_channel(self, guild_id: int) -> Optional[int]:
-    """
-    ログチャンネルを取得する
-    
-    Args:
-      guild_id: サーバーID
-    
-    Returns:
-      Optional[int]: チャンネルID
-    """
-    return self.data["log_channels"].get(str(guild_id));
+    """公開中の版のログチャンネルを取得する"""
+    return self._version.get_log_channel(guild_id);
   
   def get_summary(self) -> Dict:
-    """
-    全体の借金サマリーを取得する
-    
-    Returns:
-      Dict: サマリー情報 {
-        "total_debts": 総借金額,
-        "total_users": 関係者数,
-        "top_creditors": [(user_id, 貸している総額)],
-        "top_debtors": [(user_id, 借りている総額)]
-      }
-    """
-    creditor_totals = {};  # {user_id: 貸している総額}
-    debtor_totals = {};    # {user_id: 借りている総額}
-    total_amount = 0;
-    
-    # 全ての借金を集計
-    for creditor_id, debtors in self.data["debts"].items():
-      creditor_total = 0;
-      for debtor_id, amount in debtors.items():
-        creditor_total += amount;
-        total_amount += amount;
-            
-            # 債務者の総額を更新
-        if debtor_id not in debtor_totals:
-          debtor_totals[debtor_id] = 0;
-        debtor_totals[debtor_id] += amount;
-      
-      # 債権者の総額を更新
-      creditor_totals[creditor_id] = creditor_total;
-    
-    # 関係者数を計算（債権者と債務者の和集合）
-    all_users = set(creditor_totals.keys()) | set(debtor_totals.keys());
-    
-    # トップ債権者をソート（貸している額が多い順）
-    # 注: user_idを整数に変換。Discord APIでは整数のユーザーIDが必要なため
-    top_creditors = sorted(
-      [(int(uid), amt) for uid, amt in creditor_totals.items()],
-      key=lambda x: x[1],
-      reverse=True
-    )[:5];
-    
-    # トップ債務者をソート（借りている額が多い順）
-    # 注: user_idを整数に変換。Discord APIでは整数のユーザーIDが必要なため
-    top_debtors = sorted(
-      [(int(uid), amt) for uid, amt in debtor_totals.items()],
-      key=lambda x: x[1],
-      reverse=True
-    )[:5];
-    
-    return {
-      "total_debts": total_amount,
-      "total_users": len(all_users),
-      "top_creditors": top_creditors,
-      "top_debtors": top_debtors
-    };
+    """公開中の版から全体の借金サマリーを取得する"""
+    return self._version.get_summary();
+  
+  def get_rank(self, user_id: int) -> Dict:
+    """公開中の版からユーザーの順位を求める"""
+    return self._version.get_rank(user_id);
+  
+  def get_leaderboard(self, side: str, offset: int = 0, limit: int = 20) -> Tuple[List[Tuple[int, int, int]], int]:
+    """公開中の版からランキングを1ページ分取得する"""
+    return self._version.get_leaderboard(side, offset, limit);
+
+
+def create_database(data_dir: Optional[str] = None):
+  """
+  設定に応じたデータベースを作成する
+  
+  Args:
+    data_dir: データを置くディレクトリ（省略時はConfig.DATA_DIR）
+  
+  Returns:
+    DebtDatabase または SQLiteDebtDatabase
+  """
+  if Config.STORAGE_BACKEND == 'sqlite':
+    # jsonバックエンドでは不要なので使うときだけインポートする
+    from utils.sqlite_database import SQLiteDebtDatabase;
+    return SQLiteDebtDatabase(data_dir);
+  return DebtDatabase(data_dir);
@@ -0,0 +1,329 @@
+"""
+guild_shards.py - サーバー別データベース管理モジュール
+
+サーバー（ギルド）ごとに別々のデータベースを持ち、
+書き込みやサマリーの集計がそのサーバーのデータだけで済むようにする
+"""
+import asyncio;
+import os;
+from datetime import datetime;
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple;
+from config import Config;
+from utils.analytics import trend_report;
+from utils.csv_io import write_debts_csv, write_history_ndjson;
+from utils.database import create_database;
+from utils.mutation_queue import MutationQueue;
+
+try:
+  import fcntl;
+except ImportError:
+  fcntl = None;
+
+class DatabaseView:
+  """
+  コマンドから使う読み取りの窓口クラス
+  同じプロセスのデータベースをそのまま呼ぶ（ストレージサービスを使う場合はRemoteDatabaseが同じメソッドを持つ）
+  どちらでも同じ書き方になるよう全てコルーチンにしてある
+  変更はMutationQueueがスレッドで適用するので、公開中の版を読まないものは適用が終わるまで待ってから読む
+  """
+  
+  def __init__(self, db):
+    """
+    窓口を初期化する
+    
+    Args:
+      db: DebtDatabase または SQLiteDebtDatabase
+    """
+    self.db = db;
+  
+  async def _read(self, read: Callable[..., Any], *args) -> Any:
+    """
+    読み取りを呼ぶ（公開中の版から読まないデータベースでは、変更の適用中なら終わるまで待つ）
+    
+    Args:
+      read: データベースの読み取りメソッド
+      *args: 引数
+    
+    Returns:
+      Any: 読み取りの戻り値
+    """
+    if self.db.READS_FROM_VERSIONS:
+      return read(*args);
+    async with self.db.state_lock:
+      return read(*args);
+  
+  async def get_debt(self, creditor_id: int, debtor_id: int) -> int:
+    """債権額を取得する（DebtDatabase.get_debtと同じ）"""
+    return await self._read(self.db.get_debt, creditor_id, debtor_id);
+  
+  async def get_debt_at(self, creditor_id: int, debtor_id: int, when: datetime) -> Optional[int]:
+    """ある時点の債権額を取得する（DebtDatabase.get_debt_atと同じ。メモリ上の履歴を読むので常に適用の終わりを待つ）"""
+    async with self.db.state_lock:
+      return self.db.get_debt_at(creditor_id, debtor_id, when);
+  
+  async def get_user_debts_page(self, user_id: int, offset: int = 0, limit: int = 15) -> Dict:
+    """貸し借り一覧を1ページ分取得する（DebtDatabase.get_user_debts_pageと同じ）"""
+    return await self._read(self.db.get_user_debts_page, user_id, offset, limit);
+  
+  async def get_history_page(self, user_id: Optional[int] = None, limit: int = 10, before: Optional[int] = None) -> Tuple[List[Dict], Optional[int]]:
+    """履歴を1ページ分取得する（DebtDatabase.get_history_pageと同じ。履歴をまだ読んでいなければ読み込むので常に適用の終わりを待つ）"""
+    async with self.db.state_lock:
+      return self.db.get_history_page(user_id, limit, before);
+  
+  async def get_summary(self) -> Dict:
+    """サマリーを取得する（DebtDatabase.get_summaryと同じ）"""
+    return await self._read(self.db.get_summary);
+  
+  async def get_rank(self, user_id: int) -> Dict:
+    """ユーザーの順位を求める（DebtDatabase.get_rankと同じ）"""
+    return await self._read(self.db.get_rank, user_id);
+  
+  async def get_leaderboard(self, side: str, offset: int = 0, limit: int = 20) -> Tuple[List[Tuple[int, int, int]], int]:
+    """ランキングを1ページ分取得する（DebtDatabase.get_leaderboardと同じ）"""
+    return await self._read(self.db.get_leaderboard, side, offset, limit);
+  
+  async def plan_settlement(self) -> List[Tuple[int, int, int]]:
+    """精算案を求める（DebtDatabase.plan_settlementと同じ）"""
+    return await self._read(self.db.plan_settlement);
+  
+  async def get_log_channel(self, guild_id: int) -> Optional[int]:
+    """ログチャンネルを取得する（DebtDatabase.get_log_channelと同じ）"""
+    return await self._read(self.db.get_log_channel, guild_id);
+  
+  async def wait_durable(self) -> bool:
+    """変更がディスクに書かれるまで待つ（DebtDatabase.wait_durableと同じ）"""
+    return await self.db.wait_durable();
+  
+  async def trend_report(self, user_id: Optional[int], months: int) -> Dict:
+    """
+    月ごとの推移を集計する
+    公開中の版を読むので、列の更新（初回はアーカイブ全体の読み込み）も集計もスレッドで行う
+    
+    Args:
+      user_id: 対象のユーザーID（Noneならサーバー全体）
+      months: 今月から遡る月数
+    
+    Returns:
+      Dict: analytics.trend_reportの結果
+    """
+    # 履歴をまだ読んでいなければ読み込むので、変更の適用とは重ねない
+    async with self.db.state_lock:
+      version = self.db.current_version();
+    
+    def report() -> Dict:
+      try:
+        frame = self.db.history_frame(version);
+      finally:
+        version.close();
+      return trend_report(frame, user_id, months);
+    
+    return await asyncio.to_thread(report);
+  
+  async def export(self, debts_file: BinaryIO, history_file: BinaryIO) -> Tuple[int, int]:
+    """
+    債権をCSV、履歴をNDJSONとしてファイルに書き出す
+    公開中の版を読むので、書き出しはスレッドで行い、その間も変更を止めない
+    
+    Args:
+      debts_file: 債権の書き込み先
+      history_file: 履歴の書き込み先
+    
+    Returns:
+      Tuple[int, int]: (債権の件数, 履歴の件数)
+    """
+    async with self.db.state_lock:
+      version = self.db.current_version();
+    
+    def write() -> Tuple[int, int]:
+      try:
+        return write_debts_csv(version.iter_debts(), debts_file), write_history_ndjson(version.iter_history(), history_file);
+      finally:
+        version.close();
+    
+    return await asyncio.to_thread(write);
+
+def _lock_data_dir(path: str):
+  """
+  データディレクトリを開くプロセスを1つに限る（ロックはファイルを閉じるかプロセスが終わると外れる）
+  fcntlがない環境（Windows）では何もしない
+  
+  Args:
+    path: ロックファイルのパス
+  
+  Returns:
+    ロックを持っているファイル（fcntlがない場合None）
+  
+  Raises:
+    RuntimeError: 別のプロセスがロックを持っている場合
+  """
+  if fcntl is None:
+    return None;
+  directory = os.path.dirname(path);
+  if directory:
+    os.makedirs(directory, exist_ok=True);
+  fp = open(path, 'a');
+  try:
+    fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB);
+  except OSError:
+    fp.close();
+    raise RuntimeError(
+      f"{Config.DATA_DIR}は別のプロセスが使っている。"
+      "複数のBotプロセスから使う場合はSTORAGE_SOCKETを設定し、ストレージサービスを通してくれ"
+    );
+  return fp;
+
+class GuildShards:
+  """
+  サーバー別データベース管理クラス
+  各サーバーのデータベースは最初に使われたときに開く
+  変更はサーバーごとの単一書き込みキュー（queue）を通して行う
+  SHARD_BY_GUILDが無効の場合は全サーバーで1つのデータベースを共有する
+  同じデータディレクトリを開けるのは1つのプロセスだけ（複数のBotプロセスはストレージサービスを通す）
+  """
+  
+  def __init__(self):
+    """
+    管理クラスを初期化する（データベースはまだ開かない）
+    
+    Raises:
+      RuntimeError: 別のプロセスが同じデータディレクトリを使っている場合
+    """
+    self._lock = _lock_data_dir(Config.DATA_LOCK_PATH);
+    self._shards = {};  # {シャードのキー: データベース}
+    self._queues = {};  # {シャードのキー: MutationQueue}
+    self._views = {};  # {シャードのキー: DatabaseView}
+    self._started = False;
+    self._preload_tasks = set();
+    if not Config.SHARD_BY_GUILD:
+      # 共有のデータベースは起動時に開いておく（読み込みエラーにすぐ気付けるように）
+      self.get(None);
+  
+  def _shard_key(self, guild_id: Optional[int]) -> Optional[int]:
+    """
+    サーバーIDからシャードのキーを求める
+    
+    Args:
+      guild_id: サーバーID（DMなどサーバー外ならNone）
+    
+    Returns:
+      Optional[int]: シャードのキー（DATA_DIR直下を使う場合None）
+    """
+    if not Config.SHARD_BY_GUILD or guild_id is None or guild_id == Config.LEGACY_GUILD_ID:
+      return None;
+    return guild_id;
+  
+  def _shard_dir(self, key: Optional[int]) -> str:
+    """
+    シャードのデータを置くディレクトリを求める
+    
+    Args:
+      key: シャードのキー
+    
+    Returns:
+      str: ディレクトリのパス
+    """
+    if key is None:
+      return Config.DATA_DIR;
+    return os.path.join(Config.GUILD_SHARD_DIR, str(key));
+  
+  def get(self, guild_id: Optional[int]):
+    """
+    サーバーのデータベースを取得する（まだ開いていなければ開く）
+    
+    Args:
+      guild_id: サーバーID
+    
+    Returns:
+      DebtDatabase または SQLiteDebtDatabase
+    """
+    key = self._shard_key(guild_id);
+    db = self._shards.get(key);
+    if db is None:
+      db = create_database(self._shard_dir(key));
+      self._shards[key] = db;
+      self._queues[key] = MutationQueue(db, Config.MUTATION_BATCH_SIZE);
+      self._views[key] = DatabaseView(db);
+      if self._started:
+        self._start(db);
+    return db;
+  
+  def queue(self, guild_id: Optional[int]) -> MutationQueue:
+    """
+    サーバーのデータベースへの変更を積む単一書き込みキューを取得する
+    
+    Args:
+      guild_id: サーバーID
+    
+    Returns:
+      MutationQueue: 書き込みキュー
+    """
+    self.get(guild_id);
+    return self._queues[self._shard_key(guild_id)];
+  
+  def view(self, guild_id: Optional[int]) -> DatabaseView:
+    """
+    サーバーのデータベースの読み取りの窓口を取得する
+    
+    Args:
+      guild_id: サーバーID
+    
+    Returns:
+      DatabaseView: 読み取りの窓口
+    """
+    self.get(guild_id);
+    return self._views[self._shard_key(guild_id)];
+  
+  def open_queues(self) -> List[MutationQueue]:
+    """
+    開いているデータベースの書き込みキューの一覧を取得する
+    
+    Returns:
+      List[MutationQueue]: 書き込みキューのリスト
+    """
+    return list(self._queues.values());
+  
+  def open_databases(self) -> List:
+    """
+    開いているデータベースの一覧を取得する
+    
+    Returns:
+      List: データベースのリスト
+    """
+    return list(self._shards.values());
+  
+  def _start(self, db):
+    """
+    データベースのバックグラウンド処理を開始する
+    
+    Args:
+      db: データベース
+    """
+    db.start_writer();
+    # バイナリスナップショットの履歴を裏で読んでおく
+    task = asyncio.create_task(db.preload_history());
+    self._preload_tasks.add(task);
+    task.add_done_callback(self._preload_tasks.discard);
+  
+  def start(self):
+    """
+    開いている（とこれから開く）データベースのバックグラウンド処理を開始する（イベントループ上で呼ぶ）
+    """
+    self._started = True;
+    for db in self.open_databases():
+      self._start(db);
+  
+  async def aclose(self):
+    """
+    積まれている変更を適用してから、全てのデータベースを閉じる
+    """
+    self._started = False;
+    for queue in self.open_queues():
+      await queue.close();
+    for db in self.open_databases():
+      await db.aclose();
+    self._shards = {};
+    self._queues = {};
+    self._views = {};
+    if self._lock is not None:
+      self._lock.close();
+      self._lock = None;
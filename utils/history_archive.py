@@ -0,0 +1,259 @@
+"""
+history_archive.py - 履歴アーカイブモジュール
+
+古い履歴を月ごとのgzip圧縮セグメントに移し、必要になったときだけ読み込む
+"""
+import gzip;
+import json;
+import os;
+from collections import OrderedDict;
+from typing import Dict, Iterator, List, Optional, Tuple;
+
+class HistoryArchive:
+  """
+  履歴アーカイブクラス
+  セグメントの一覧（通し番号の範囲と登場ユーザー）はmanifest.jsonで管理する
+  """
+  
+  def __init__(self, directory: str, cache_size: int = 4):
+    """
+    アーカイブを初期化する
+    
+    Args:
+      directory: セグメントを保存するディレクトリ
+      cache_size: メモリに残しておくセグメント数
+    """
+    self.directory = directory;
+    self.manifest_path = os.path.join(directory, 'manifest.json');
+    self.cache_size = cache_size;
+    self.segments = self._load_manifest();
+    # 読み込み済みセグメント {file: {"entries": [履歴], "users": {user: [位置]}}}
+    self._cache = OrderedDict();
+  
+  def _load_manifest(self) -> List[Dict]:
+    """
+    セグメント一覧を読み込む
+    
+    Returns:
+      List[Dict]: [{"month", "file", "first_seq", "last_seq", "count", "users"}]
+    """
+    if not os.path.exists(self.manifest_path):
+      return [];
+    try:
+      with open(self.manifest_path, 'r', encoding='utf-8') as f:
+        segments = json.load(f)["segments"];
+    except Exception as e:
+      print(f"アーカイブ一覧の読み込みエラー: {e}");
+      return [];
+    # 登場ユーザーの判定を速くするためメモリ上ではsetで持つ
+    for segment in segments:
+      segment["users"] = set(segment["users"]);
+    return segments;
+  
+  def _save_manifest(self):
+    """
+    セグメント一覧を一時ファイル経由で保存する
+    """
+    tmp_path = self.manifest_path + '.tmp';
+    segments = [dict(segment, users=sorted(segment["users"])) for segment in self.segments];
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+      json.dump({"segments": segments}, f, ensure_ascii=False);
+    os.replace(tmp_path, self.manifest_path);
+  
+  @property
+  def next_seq(self) -> int:
+    """
+    次にアーカイブされるべき履歴の通し番号
+    
+    Returns:
+      int: 通し番号（アーカイブが空なら0）
+    """
+    return self.segments[-1]["last_seq"] + 1 if self.segments else 0;
+  
+  def append(self, first_seq: int, entries: List[Dict]) -> bool:
+    """
+    履歴をアーカイブに追加する
+    同じ月が続く間は最後のセグメントにgzipメンバーとして追記する
+    
+    Args:
+      first_seq: entries[0]の通し番号（next_seqと一致している必要がある）
+      entries: 古い順の履歴
+    
+    Returns:
+      bool: 追加成功時True
+    """
+    if first_seq != self.next_seq:
+      print(f"アーカイブの通し番号が連続していない: {first_seq} != {self.next_seq}");
+      return False;
+    try:
+      os.makedirs(self.directory, exist_ok=True);
+      # 同じ月が連続する区間ごとにまとめて書く
+      runs = [];
+      for offset, entry in enumerate(entries):
+        month = entry["timestamp"][:7];
+        if not runs or runs[-1][0] != month:
+          runs.append((month, []));
+        runs[-1][1].append(dict(entry, seq=first_seq + offset));
+      
+      for month, run in runs:
+        segment = self.segments[-1] if self.segments and self.segments[-1]["month"] == month else None;
+        if segment is None:
+          file_name = f"{month}.jsonl.gz";
+          if os.path.exists(os.path.join(self.directory, file_name)):
+            file_name = f"{month}_{run[0]['seq']}.jsonl.gz";
+          segment = {
+            "month": month,
+            "file": file_name,
+            "first_seq": run[0]["seq"],
+            "last_seq": run[0]["seq"] - 1,
+            "count": 0,
+            "users": set()
+          };
+          self.segments.append(segment);
+        
+        lines = "".join(json.dumps(e, ensure_ascii=False, separators=(',', ':')) + '\n' for e in run);
+        with gzip.open(os.path.join(self.directory, segment["file"]), 'ab') as f:
+          f.write(lines.encode('utf-8'));
+        
+        for e in run:
+          segment["users"].add(e["creditor"]);
+          segment["users"].add(e["debtor"]);
+        segment["last_seq"] = run[-1]["seq"];
+        segment["count"] += len(run);
+        self._cache.pop(segment["file"], None);
+      
+      self._save_manifest();
+      return True;
+    except Exception as e:
+      print(f"アーカイブ書き込みエラー: {e}");
+      return False;
+  
+  def _load_segment(self, segment: Dict) -> Dict:
+    """
+    セグメントを読み込む（最近使ったものはキャッシュから返す）
+    
+    Args:
+      segment: セグメント情報
+    
+    Returns:
+      Dict: {"entries": [履歴], "users": {user: [entries内の位置]}}
+    """
+    file_name = segment["file"];
+    if file_name in self._cache:
+      self._cache.move_to_end(file_name);
+      return self._cache[file_name];
+    
+    entries = [];
+    users = {};
+    seen = set();
+    with gzip.open(os.path.join(self.directory, file_name), 'rt', encoding='utf-8') as f:
+      for line in f:
+        entry = json.loads(line);
+        seq = entry["seq"];
+        # 一覧への反映前に落ちて二重に書かれた行は無視する
+        if seq > segment["last_seq"] or seq in seen:
+          continue;
+        seen.add(seq);
+        users.setdefault(entry["creditor"], []).append(len(entries));
+        if entry["debtor"] != entry["creditor"]:
+          users.setdefault(entry["debtor"], []).append(len(entries));
+        entries.append(entry);
+    
+    loaded = {"entries": entries, "users": users};
+    self._cache[file_name] = loaded;
+    while len(self._cache) > self.cache_size:
+      self._cache.popitem(last=False);
+    return loaded;
+  
+  def iter_entries(self) -> Iterator[Dict]:
+    """
+    アーカイブの全履歴を古い順に返す（セグメントを1行ずつ読み、キャッシュには載せない）
+    
+    Yields:
+      Dict: 履歴（通し番号 "id" 付き）
+    """
+    for segment in list(self.segments):
+      last_seq = segment["first_seq"] - 1;
+      with gzip.open(os.path.join(self.directory, segment["file"]), 'rt', encoding='utf-8') as f:
+        for line in f:
+          entry = json.loads(line);
+          seq = entry["seq"];
+          # 一覧への反映前に落ちて二重に書かれた行は無視する
+          if seq <= last_seq or seq > segment["last_seq"]:
+            continue;
+          last_seq = seq;
+          entry["id"] = entry.pop("seq");
+          yield entry;
+  
+  def iter_from(self, first_seq: int) -> Iterator[Dict]:
+    """
+    指定した通し番号以降のアーカイブの履歴を古い順に返す（それより前のセグメントは読み込まない）
+    
+    Args:
+      first_seq: 最初の通し番号
+    
+    Yields:
+      Dict: 履歴（"seq"付き。キャッシュと共有するので書き換えないこと）
+    """
+    for segment in list(self.segments):
+      if segment["last_seq"] < first_seq:
+        continue;
+      for entry in self._load_segment(segment)["entries"]:
+        if entry["seq"] >= first_seq:
+          yield entry;
+  
+  def has_entries(self, user_str: Optional[str], before: int) -> bool:
+    """
+    指定した通し番号より前にユーザーの履歴があるか、セグメント一覧だけで判定する
+    
+    Args:
+      user_str: ユーザーID（Noneなら全員）
+      before: この通し番号より前を調べる
+    
+    Returns:
+      bool: 履歴がある場合True
+    """
+    return any(
+      segment["first_seq"] < before and (user_str is None or user_str in segment["users"])
+      for segment in self.segments
+    );
+  
+  def page(self, user_str: Optional[str], limit: int, before: int) -> Tuple[List[Dict], bool]:
+    """
+    アーカイブから履歴を新しい順にたどって1ページ分取得する
+    ユーザーが登場しないセグメントは読み込まない
+    
+    Args:
+      user_str: ユーザーID（Noneなら全員）
+      limit: 取得件数
+      before: この通し番号より前の履歴を取得する
+    
+    Returns:
+      Tuple[List[Dict], bool]: (履歴のリスト（古い順、"id"付き）, さらに古い履歴があるか)
+    """
+    collected = [];
+    for segment in reversed(self.segments):
+      if segment["first_seq"] >= before:
+        continue;
+      if user_str is not None and user_str not in segment["users"]:
+        continue;
+      if len(collected) > limit:
+        break;
+      loaded = self._load_segment(segment);
+      entries = loaded["entries"];
+      positions = loaded["users"].get(user_str, []) if user_str is not None else range(len(entries));
+      for position in reversed(positions):
+        entry = entries[position];
+        if entry["seq"] >= before:
+          continue;
+        collected.append(entry);
+        if len(collected) > limit:
+          break;
+    
+    has_more = len(collected) > limit;
+    page = [];
+    for entry in reversed(collected[:limit]):
+      record = dict(entry);
+      record["id"] = record.pop("seq");
+      page.append(record);
+    return page, has_more;
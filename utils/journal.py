@@ -0,0 +1,178 @@
+"""
+journal.py - ジャーナル（追記ログ）モジュール
+
+DebtDatabaseの変更を1件ずつ追記して記録する
+全体の書き直しは定期的なコンパクション時にのみ行う
+"""
+import json;
+import os;
+import shutil;
+import threading;
+import time;
+from typing import Dict, Iterator, List;
+from utils.metrics import STORAGE_SAVE_BYTES, STORAGE_SAVE_SECONDS;
+
+class DebtJournal:
+  """
+  ジャーナルファイルクラス
+  1行1レコードのJSON Lines形式で変更を追記する
+  """
+  
+  def __init__(self, path: str, fsync: bool = False):
+    """
+    ジャーナルを初期化する
+    
+    Args:
+      path: ジャーナルファイルのパス
+      fsync: 追記ごとにfsyncするかどうか
+    """
+    self.path = path;
+    self.rotated_path = path + '.compacting';
+    self.fsync = fsync;
+    self.record_count = 0;
+    self._file = None;
+    # バックグラウンドの書き込みスレッドとコンパクションが同時にファイルを触らないようにする
+    self._lock = threading.Lock();
+  
+  def replay(self, after_seq: int) -> Iterator[Dict]:
+    """
+    ジャーナルのレコードを古い順に読み出す
+    コンパクション途中のファイルが残っていればそちらから読む
+    
+    Args:
+      after_seq: この番号以下のレコードはスナップショットに反映済みなので飛ばす
+    
+    Yields:
+      Dict: レコード {"seq": 通し番号, "ops": [操作]}
+    """
+    for path in (self.rotated_path, self.path):
+      if not os.path.exists(path):
+        continue;
+      for record in self._read_records(path):
+        if path == self.path:
+          self.record_count += 1;
+        if record["seq"] > after_seq:
+          yield record;
+  
+  @staticmethod
+  def _read_records(path: str) -> Iterator[Dict]:
+    """
+    ファイルのレコードを壊れた行の手前まで読み、ファイルをそこまでに切り詰める
+    書き込み途中で落ちた行の後ろに追記すると、次のレコードがその行とつながって読めなくなるため
+    
+    Args:
+      path: ジャーナルファイルのパス
+    
+    Yields:
+      Dict: レコード
+    """
+    end = 0;
+    with open(path, 'rb') as f:
+      for line in f:
+        if line.strip():
+          try:
+            # 改行まで書けていない行も書き込み途中とみなす
+            if not line.endswith(b'\n'):
+              raise ValueError("改行がない");
+            record = json.loads(line);
+          except ValueError:
+            print(f"ジャーナルの壊れた行から後ろを捨てる: {path}");
+            break;
+          yield record;
+        end += len(line);
+    if end < os.path.getsize(path):
+      with open(path, 'r+b') as f:
+        f.truncate(end);
+  
+  def open(self):
+    """
+    ジャーナルを追記モードで開く
+    """
+    directory = os.path.dirname(self.path);
+    if directory:
+      os.makedirs(directory, exist_ok=True);
+    self._file = open(self.path, 'a', encoding='utf-8');
+  
+  def append(self, record: Dict) -> bool:
+    """
+    レコードを1件追記する
+    
+    Args:
+      record: 追記するレコード
+    
+    Returns:
+      bool: 追記成功時True
+    """
+    return self.append_many([record]);
+  
+  def append_many(self, records: List[Dict]) -> bool:
+    """
+    複数のレコードを1回の書き込みでまとめて追記する
+    
+    Args:
+      records: 追記するレコード
+    
+    Returns:
+      bool: 追記成功時True
+    """
+    if not records:
+      return True;
+    lines = "".join(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n' for record in records);
+    start = time.perf_counter();
+    with self._lock:
+      try:
+        if self._file is None:
+          self.open();
+        self._file.write(lines);
+        self._file.flush();
+        if self.fsync:
+          os.fsync(self._file.fileno());
+        self.record_count += len(records);
+        STORAGE_SAVE_SECONDS.observe(time.perf_counter() - start, kind="journal");
+        STORAGE_SAVE_BYTES.observe(len(lines.encode('utf-8')), kind="journal");
+        return True;
+      except Exception as e:
+        print(f"ジャーナル書き込みエラー: {e}");
+        return False;
+  
+  def rotate(self):
+    """
+    現在のジャーナルをコンパクション用に退避し、新しいジャーナルを開く
+    前回のコンパクションが失敗して退避ファイルが残っている場合は後ろに連結する
+    """
+    with self._lock:
+      self._close_file();
+      if os.path.exists(self.path):
+        if os.path.exists(self.rotated_path):
+          # 退避ファイルの末尾が壊れていれば、つなげる前に切り詰める
+          for _ in self._read_records(self.rotated_path):
+            pass;
+          with open(self.rotated_path, 'ab') as dst, open(self.path, 'rb') as src:
+            shutil.copyfileobj(src, dst);
+          os.remove(self.path);
+        else:
+          os.replace(self.path, self.rotated_path);
+      self.record_count = 0;
+      self.open();
+  
+  def discard_rotated(self):
+    """
+    スナップショットに反映済みの退避ファイルを削除する
+    """
+    if os.path.exists(self.rotated_path):
+      os.remove(self.rotated_path);
+  
+  def close(self):
+    """
+    ジャーナルファイルを閉じる
+    """
+    with self._lock:
+      self._close_file();
+  
+  def _close_file(self):
+    """
+    ロックを取った状態でファイルを閉じる
+    """
+    if self._file is not None:
+      self._file.close();
+      self._file = None;
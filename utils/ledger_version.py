@@ -0,0 +1,550 @@
+"""
+ledger_version.py - 台帳の版モジュール
+
+変更を確定するたびに、その時点の債権・集計・履歴の範囲を読み取り専用の版として公開する
+読み取りは公開済みの版を使うので、書き込みの途中の状態を見ることがなく、
+スレッドからロックなしで読んでいる間に次の変更が行われても内容は変わらない
+
+版の債権はCowMap、集計はRankedTotalsの版で持ち、前の版から変わった部分だけを複製する（変わっていない債権者や順位の塊は共有する）
+履歴は追加のみのリストを共有し、版ごとに見てよい範囲（通し番号の上限）だけを持つ
+"""
+from typing import Any, Dict, Iterator, List, Optional, Tuple;
+import bisect;
+import heapq;
+
+# ランキングの種類（貸している総額・借りている総額）
+LEADERBOARD_SIDES = ("lent", "borrowed");
+
+class CowMap:
+  """
+  版を切り出せる辞書クラス
+  キーをハッシュでバケットに分けて持ち、freeze()で切り出した版と共有しているバケットや値の辞書は、変更する前に複製する
+  切り出した版は読み取り専用で、元の辞書をその後に変更しても内容は変わらない
+  """
+  
+  __slots__ = ("_buckets", "_mask", "_len", "_owned", "_owned_values", "_frozen", "_last_frozen");
+  
+  # バケット数の最小値と、1バケットあたりの目安の件数（超えたらバケット数を倍にする）
+  MIN_BUCKETS = 8;
+  LOAD = 64;
+  
+  def __init__(self, items: Optional[Dict] = None):
+    """
+    辞書を作る
+    
+    Args:
+      items: 最初の内容（値の辞書は複製せずに持つ）
+    """
+    items = items or {};
+    count = self.MIN_BUCKETS;
+    while count * self.LOAD < len(items):
+      count *= 2;
+    self._mask = count - 1;
+    self._buckets = [{} for _ in range(count)];
+    for key, value in items.items():
+      self._buckets[self._index(key)][key] = value;
+    self._len = len(items);
+    # 最後に版を切り出してから複製した（この辞書だけが持っている）バケットの位置と、値の辞書のキー
+    self._owned = set(range(count));
+    self._owned_values = set();
+    self._frozen = False;
+    self._last_frozen = None;
+  
+  def _index(self, key: Any) -> int:
+    """
+    キーのバケットの位置を求める
+    DiscordのIDは下位ビットが偏るので、上位ビット（作成時刻）と混ぜる
+    
+    Args:
+      key: キー
+    
+    Returns:
+      int: バケットの位置
+    """
+    value = hash(key);
+    return (value ^ (value >> 22)) & self._mask;
+  
+  def get(self, key: Any, default: Any = None) -> Any:
+    """
+    値を取得する
+    
+    Args:
+      key: キー
+      default: キーがない場合の値
+    
+    Returns:
+      Any: 値
+    """
+    return self._buckets[self._index(key)].get(key, default);
+  
+  def __getitem__(self, key: Any) -> Any:
+    return self._buckets[self._index(key)][key];
+  
+  def __contains__(self, key: Any) -> bool:
+    return key in self._buckets[self._index(key)];
+  
+  def __len__(self) -> int:
+    return self._len;
+  
+  def __iter__(self) -> Iterator:
+    for bucket in self._buckets:
+      yield from bucket;
+  
+  def keys(self) -> Iterator:
+    """
+    キーを順に返す（順序はバケット順）
+    
+    Yields:
+      Any: キー
+    """
+    return iter(self);
+  
+  def values(self) -> Iterator:
+    """
+    値を順に返す
+    
+    Yields:
+      Any: 値
+    """
+    for bucket in self._buckets:
+      yield from bucket.values();
+  
+  def items(self) -> Iterator[Tuple[Any, Any]]:
+    """
+    キーと値の組を順に返す
+    
+    Yields:
+      Tuple[Any, Any]: (キー, 値)
+    """
+    for bucket in self._buckets:
+      yield from bucket.items();
+  
+  def _own_bucket(self, key: Any) -> Dict:
+    """
+    キーのバケットを変更用に取得する（版と共有していれば複製する）
+    
+    Args:
+      key: キー
+    
+    Returns:
+      Dict: バケット
+    
+    Raises:
+      TypeError: 切り出した版を変更しようとした場合
+    """
+    if self._frozen:
+      raise TypeError("切り出した版は変更できない");
+    index = self._index(key);
+    if index not in self._owned:
+      self._buckets[index] = dict(self._buckets[index]);
+      self._owned.add(index);
+    self._last_frozen = None;
+    return self._buckets[index];
+  
+  def __setitem__(self, key: Any, value: Any):
+    bucket = self._own_bucket(key);
+    if key not in bucket:
+      self._len += 1;
+    bucket[key] = value;
+    self._owned_values.discard(key);
+    self._grow_if_needed();
+  
+  def __delitem__(self, key: Any):
+    bucket = self._own_bucket(key);
+    del bucket[key];
+    self._len -= 1;
+    self._owned_values.discard(key);
+  
+  def set_in(self, key: Any, subkey: Any, value: Any):
+    """
+    値の辞書の1件を設定する（値の辞書がなければ作り、版と共有していれば複製する）
+    
+    Args:
+      key: キー
+      subkey: 値の辞書のキー
+      value: 設定する値
+    """
+    bucket = self._own_bucket(key);
+    inner = bucket.get(key);
+    if inner is None:
+      inner = bucket[key] = {};
+      self._len += 1;
+      self._owned_values.add(key);
+    elif key not in self._owned_values:
+      inner = bucket[key] = dict(inner);
+      self._owned_values.add(key);
+    inner[subkey] = value;
+    self._grow_if_needed();
+  
+  def delete_in(self, key: Any, subkey: Any):
+    """
+    値の辞書の1件を消す（空になった値の辞書はキーごと消す）
+    
+    Args:
+      key: キー
+      subkey: 値の辞書のキー
+    """
+    inner = self.get(key);
+    if inner is None or subkey not in inner:
+      return;
+    if len(inner) == 1:
+      del self[key];
+      return;
+    bucket = self._own_bucket(key);
+    if key not in self._owned_values:
+      inner = bucket[key] = dict(inner);
+      self._owned_values.add(key);
+    del inner[subkey];
+  
+  def _grow_if_needed(self):
+    """
+    件数が増えたらバケット数を倍にして振り分け直す（新しいバケットは全てこの辞書のもの）
+    """
+    if self._len <= len(self._buckets) * self.LOAD:
+      return;
+    count = len(self._buckets) * 2;
+    buckets = [{} for _ in range(count)];
+    self._mask = count - 1;
+    for bucket in self._buckets:
+      for key, value in bucket.items():
+        buckets[self._index(key)][key] = value;
+    self._buckets = buckets;
+    self._owned = set(range(count));
+  
+  def freeze(self) -> "CowMap":
+    """
+    今の内容を読み取り専用の版として切り出す
+    バケットの一覧を写すだけで、中身は共有する（以降の変更は共有しているものを複製してから行う）
+    
+    Returns:
+      CowMap: 読み取り専用の版（前回から変更がなければ前回と同じもの）
+    """
+    if self._frozen:
+      return self;
+    if self._last_frozen is not None:
+      return self._last_frozen;
+    frozen = CowMap.__new__(CowMap);
+    frozen._buckets = tuple(self._buckets);
+    frozen._mask = self._mask;
+    frozen._len = self._len;
+    frozen._owned = frozenset();
+    frozen._owned_values = frozenset();
+    frozen._frozen = True;
+    frozen._last_frozen = None;
+    self._owned = set();
+    self._owned_values = set();
+    self._last_frozen = frozen;
+    return frozen;
+
+def net_positions(lent: CowMap, borrowed: CowMap) -> Dict[int, int]:
+  """
+  各ユーザーの純額（貸している総額 - 借りている総額）を求める
+  
+  Args:
+    lent: {user_id: 貸している総額}
+    borrowed: {user_id: 借りている総額}
+  
+  Returns:
+    Dict[int, int]: {user_id: 純額}（0のユーザーは含めない）
+  """
+  net = {user: total for user, total in lent.items()};
+  for user, total in borrowed.items():
+    net[user] = net.get(user, 0) - total;
+  return {user: amount for user, amount in net.items() if amount};
+
+class LedgerVersion:
+  """
+  台帳の版クラス
+  作った後は変更しない（債権・集計は切り出したCowMap、履歴は共有のリストのうちhistory_topより前だけを見る）
+  """
+  
+  __slots__ = (
+    "number", "debts", "debtors", "lent", "borrowed", "total_amount", "participants",
+    "history", "history_base", "history_top", "user_history", "log_channels", "archive"
+  );
+  
+  def __init__(self, number: int, debts: CowMap, debtors: CowMap, lent, borrowed, total_amount: int, participants: int,
+               history: Optional[List], history_base: int, history_top: int, user_history: Dict[int, List[int]],
+               log_channels: Dict[str, int], archive):
+    """
+    版を作る
+    
+    Args:
+      number: 版の番号（公開するたびに1増える）
+      debts: {債権者ID: {債務者ID: 金額}}
+      debtors: {債務者ID: {債権者ID: 金額}}
+      lent: 貸している総額のランキング（RankedTotalsの版）
+      borrowed: 借りている総額のランキング（RankedTotalsの版）
+      total_amount: 債権の総額
+      participants: 貸し借りのあるユーザー数
+      history: メモリ上の履歴（HistoryRecordのリスト。まだ読んでいなければNone）
+      history_base: historyの先頭の通し番号
+      history_top: この版に含まれる次の通し番号（これ以降の履歴は見ない）
+      user_history: {user_id: [通し番号]}（history_topより前だけを見る）
+      log_channels: {サーバーID: チャンネルID}
+      archive: HistoryArchive
+    """
+    self.number = number;
+    self.debts = debts;
+    self.debtors = debtors;
+    self.lent = lent;
+    self.borrowed = borrowed;
+    self.total_amount = total_amount;
+    self.participants = participants;
+    self.history = history;
+    self.history_base = history_base;
+    self.history_top = history_top;
+    self.user_history = user_history;
+    self.log_channels = log_channels;
+    self.archive = archive;
+  
+  def with_history(self, history: List, history_base: int, user_history: Dict[int, List[int]]) -> "LedgerVersion":
+    """
+    後から読み込んだ履歴を付けた版を作る（内容は同じで番号も変えない）
+    
+    Args:
+      history: 読み込んだ履歴を含むリスト
+      history_base: historyの先頭の通し番号
+      user_history: 作り直したユーザーごとのインデックス
+    
+    Returns:
+      LedgerVersion: 版
+    """
+    return LedgerVersion(
+      self.number, self.debts, self.debtors, self.lent, self.borrowed, self.total_amount, self.participants,
+      history, history_base, self.history_top, user_history, self.log_channels, self.archive
+    );
+  
+  def close(self):
+    """
+    版を使い終わったことを知らせる（共有しているだけなので何もしない。SQLiteの版と同じ使い方にするため）
+    """
+  
+  def get_debt(self, creditor_id: int, debtor_id: int) -> int:
+    """
+    特定の債権額を取得する
+    
+    Args:
+      creditor_id: 債権者のID
+      debtor_id: 債務者のID
+    
+    Returns:
+      int: 債権額
+    """
+    debtors = self.debts.get(creditor_id);
+    return debtors.get(debtor_id, 0) if debtors else 0;
+  
+  def get_user_debts(self, user_id: int) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    ユーザーの借金一覧を取得する
+    
+    Args:
+      user_id: ユーザーID
+    
+    Returns:
+      Dict: {"creditor": [(debtor_id, amount)], "debtor": [(creditor_id, amount)]}
+    """
+    return {
+      # 自分が貸している分
+      "creditor": list(self.debts.get(user_id, {}).items()),
+      # 自分が借りている分（逆引きインデックスを使う）
+      "debtor": list(self.debtors.get(user_id, {}).items())
+    };
+  
+  def get_user_debts_page(self, user_id: int, offset: int = 0, limit: int = 15) -> Dict:
+    """
+    ユーザーの貸し借り一覧を1ページ分取得する（金額の大きい順、同額なら相手のIDの小さい順）
+    合計はサマリー用の集計から取るので、全件を並べ替えることはない
+    
+    Args:
+      user_id: ユーザーID
+      offset: 先頭から飛ばす件数（貸し・借りそれぞれ）
+      limit: 取得件数（貸し・借りそれぞれ）
+    
+    Returns:
+      Dict: {"creditor": [(debtor_id, amount)], "debtor": [(creditor_id, amount)],
+        "creditor_count": 貸している相手の数, "debtor_count": 借りている相手の数,
+        "lent": 貸している合計, "borrowed": 借りている合計}
+    """
+    lent = self.debts.get(user_id, {});
+    borrowed = self.debtors.get(user_id, {});
+    
+    def page(debts: Dict[int, int]) -> List[Tuple[int, int]]:
+      return heapq.nlargest(offset + limit, debts.items(), key=lambda item: (item[1], -item[0]))[offset:];
+    
+    return {
+      "creditor": page(lent),
+      "debtor": page(borrowed),
+      "creditor_count": len(lent),
+      "debtor_count": len(borrowed),
+      "lent": self.lent.get(user_id),
+      "borrowed": self.borrowed.get(user_id)
+    };
+  
+  def get_summary(self) -> Dict:
+    """
+    全体の借金サマリーを取得する（集計は変更のたびに更新済みなので、上位5件を取り出すだけ）
+    
+    Returns:
+      Dict: サマリー情報 {
+        "total_debts": 総借金額,
+        "total_users": 関係者数,
+        "top_creditors": [(user_id, 貸している総額)],
+        "top_debtors": [(user_id, 借りている総額)]
+      }
+    """
+    return {
+      "total_debts": self.total_amount,
+      "total_users": self.participants,
+      "top_creditors": self.lent.top(5),
+      "top_debtors": self.borrowed.top(5)
+    };
+  
+  def get_rank(self, user_id: int) -> Dict:
+    """
+    ユーザーの貸している総額・借りている総額の順位を求める（同額は同順位）
+    
+    Args:
+      user_id: ユーザーID
+    
+    Returns:
+      Dict: {"lent": 貸している総額, "lent_rank": 順位（貸していなければNone）, "creditor_count": 貸している人数,
+        "borrowed": 借りている総額, "borrowed_rank": 順位（借りていなければNone）, "debtor_count": 借りている人数}
+    """
+    return {
+      "lent": self.lent.get(user_id),
+      "lent_rank": self.lent.rank(user_id),
+      "creditor_count": len(self.lent),
+      "borrowed": self.borrowed.get(user_id),
+      "borrowed_rank": self.borrowed.rank(user_id),
+      "debtor_count": len(self.borrowed)
+    };
+  
+  def get_leaderboard(self, side: str, offset: int = 0, limit: int = 20) -> Tuple[List[Tuple[int, int, int]], int]:
+    """
+    総額の多い順のランキングを1ページ分取得する
+    
+    Args:
+      side: "lent"（貸している総額）または "borrowed"（借りている総額）
+      offset: 先頭から飛ばす件数
+      limit: 取得件数
+    
+    Returns:
+      Tuple[List[Tuple[int, int, int]], int]: ([(順位, user_id, 総額)], ランキングの人数)
+    
+    Raises:
+      ValueError: sideが正しくない場合
+    """
+    if side not in LEADERBOARD_SIDES:
+      raise ValueError(f"ランキングの種類が正しくない: {side}");
+    ranking = self.lent if side == "lent" else self.borrowed;
+    return ranking.page(offset, limit), len(ranking);
+  
+  def net_positions(self) -> Dict[int, int]:
+    """
+    各ユーザーの純額を求める
+    
+    Returns:
+      Dict[int, int]: {user_id: 純額}（0のユーザーは含めない）
+    """
+    return net_positions(self.lent.totals(), self.borrowed.totals());
+  
+  def get_log_channel(self, guild_id: int) -> Optional[int]:
+    """
+    ログチャンネルを取得する
+    
+    Args:
+      guild_id: サーバーID
+    
+    Returns:
+      Optional[int]: チャンネルID
+    """
+    return self.log_channels.get(str(guild_id));
+  
+  def iter_debts(self) -> Iterator[Tuple[int, int, int]]:
+    """
+    全ての債権を順に返す（書き出し用）
+    
+    Yields:
+      Tuple[int, int, int]: (債権者ID, 債務者ID, 金額)
+    """
+    for creditor_id, debtors in self.debts.items():
+      for debtor_id, amount in debtors.items():
+        yield creditor_id, debtor_id, amount;
+  
+  def _require_history(self) -> List:
+    """
+    メモリ上の履歴を取得する
+    
+    Returns:
+      List: 履歴のリスト
+    
+    Raises:
+      RuntimeError: 履歴をまだ読み込んでいない版の場合
+    """
+    if self.history is None:
+      raise RuntimeError("履歴を読み込む前の版では履歴を読めない");
+    return self.history;
+  
+  def iter_history(self) -> Iterator[Dict]:
+    """
+    全ての履歴を古い順に返す（書き出し用、アーカイブ分も含む）
+    
+    Yields:
+      Dict: 履歴（通し番号 "id" 付き）
+    """
+    history = self._require_history();
+    base = self.history_base;
+    for entry in self.archive.iter_entries():
+      if entry["id"] >= base:
+        break;
+      yield entry;
+    for seq in range(base, self.history_top):
+      yield history[seq - base].to_dict(seq);
+  
+  def get_history_page(self, user_id: Optional[int] = None, limit: int = 10, before: Optional[int] = None) -> Tuple[List[Dict], Optional[int]]:
+    """
+    履歴を1ページ分取得する
+    ユーザーごとのインデックスを二分探索するので、全履歴の走査は発生しない
+    
+    Args:
+      user_id: ユーザーID（指定時はそのユーザーの履歴のみ）
+      limit: 取得件数
+      before: この通し番号より前の履歴を取得する（指定なしで最新から）
+    
+    Returns:
+      Tuple[List[Dict], Optional[int]]: (履歴のリスト（古い順）, 次のページのbefore。これより古い履歴がなければNone)
+    """
+    history = self._require_history();
+    base = self.history_base;
+    top = self.history_top;
+    
+    if user_id:
+      # アーカイブの索引は保存形式（文字列のID）
+      user_str = str(user_id);
+      seqs = self.user_history.get(user_id, []);
+      # この版より後に追加された通し番号は見ない
+      end = bisect.bisect_left(seqs, top if before is None else min(before, top));
+      start = max(0, end - limit);
+      page_seqs = seqs[start:end];
+      has_more = start > 0;
+    else:
+      user_str = None;
+      end = top if before is None else max(base, min(before, top));
+      start = max(base, end - limit);
+      page_seqs = range(start, end);
+      has_more = start > base;
+    
+    entries = [history[seq - base].to_dict(seq) for seq in page_seqs];
+    
+    if not has_more and base > 0:
+      # メモリ上の範囲を使い切ったので、続きはアーカイブから読む
+      cold_before = entries[0]["id"] if entries else (base if before is None else min(before, base));
+      if len(entries) < limit:
+        cold, has_more = self.archive.page(user_str, limit - len(entries), cold_before);
+        entries = cold + entries;
+      else:
+        has_more = self.archive.has_entries(user_str, cold_before);
+    
+    next_before = entries[0]["id"] if has_more and entries else None;
+    return entries, next_before;
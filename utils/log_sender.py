@@ -0,0 +1,166 @@
+"""
+log_sender.py - ログ送信モジュール
+
+ログチャンネルへの送信をチャンネルごとのキューに積み、バックグラウンドで送る
+短時間に積まれたメッセージは1通にまとめ、レート制限（429）の場合は待ってから送り直す
+"""
+import asyncio;
+import time;
+from collections import deque;
+from typing import Dict, List, Optional, Tuple;
+import discord;
+from discord.ext import commands;
+from utils.metrics import LOG_DELAY_SECONDS, LOG_SEND_SECONDS;
+
+# Discordのメッセージの最大文字数
+MAX_LENGTH = 2000;
+
+class LogSender:
+  """
+  ログ送信クラス
+  enqueueはすぐに戻るので、コマンドの応答がログ送信を待つことはない
+  """
+  
+  def __init__(self, bot: commands.Bot, window: float = 1.0, max_queue: int = 100):
+    """
+    送信器を初期化する
+    
+    Args:
+      bot: Botインスタンス
+      window: 最初のメッセージから送信までに待つ秒数（この間のメッセージは1通にまとめる）
+      max_queue: チャンネルごとに溜めておく最大件数（超えたら古いものから捨てる）
+    """
+    self.bot = bot;
+    self.window = window;
+    self.max_queue = max_queue;
+    self._queues = {};  # {channel_id: deque[(メッセージ, 積んだ時刻)]}
+    self._workers = {};  # {channel_id: Task}
+    # 統計
+    self.queued = 0;
+    self.merged = 0;
+    self.sent = 0;
+    self.dropped = 0;
+    self.rate_limited = 0;
+  
+  def enqueue(self, channel_id: int, message: str):
+    """
+    メッセージを送信キューに積む（イベントループ上で呼ぶ）
+    
+    Args:
+      channel_id: チャンネルID
+      message: メッセージ
+    """
+    queue = self._queues.setdefault(channel_id, deque());
+    if len(queue) >= self.max_queue:
+      queue.popleft();
+      self.dropped += 1;
+    queue.append((message[:MAX_LENGTH], time.monotonic()));
+    self.queued += 1;
+    worker = self._workers.get(channel_id);
+    if worker is None or worker.done():
+      self._workers[channel_id] = asyncio.create_task(self._run(channel_id));
+  
+  def _take_batch(self, queue: deque) -> List[Tuple[str, float]]:
+    """
+    キューの先頭から1通に収まる分だけ取り出す
+    
+    Args:
+      queue: チャンネルのキュー
+    
+    Returns:
+      List[Tuple[str, float]]: まとめて送る (メッセージ, 積んだ時刻)
+    """
+    batch = [queue.popleft()];
+    length = len(batch[0][0]);
+    while queue and length + 1 + len(queue[0][0]) <= MAX_LENGTH:
+      item = queue.popleft();
+      batch.append(item);
+      length += 1 + len(item[0]);
+    return batch;
+  
+  async def _run(self, channel_id: int):
+    """
+    チャンネルのキューが空になるまで、まとめて送信する
+    
+    Args:
+      channel_id: チャンネルID
+    """
+    queue = self._queues[channel_id];
+    backoff = 1.0;
+    while queue:
+      await asyncio.sleep(self.window);
+      batch = self._take_batch(queue);
+      retry_after = await self._send(channel_id, batch);
+      if retry_after is None:
+        backoff = 1.0;
+        continue;
+      # 送れなかった分は先頭に戻して、待ってから送り直す
+      self.rate_limited += 1;
+      queue.extendleft(reversed(batch));
+      await asyncio.sleep(max(retry_after, backoff));
+      backoff = min(backoff * 2, 60.0);
+  
+  async def _send(self, channel_id: int, batch: List[Tuple[str, float]]) -> Optional[float]:
+    """
+    まとめたメッセージを1通で送信する
+    
+    Args:
+      channel_id: チャンネルID
+      batch: (メッセージ, 積んだ時刻)
+    
+    Returns:
+      Optional[float]: レート制限で送れなかった場合は待つ秒数（送信済み・破棄した場合None）
+    """
+    channel = self.bot.get_channel(channel_id);
+    if channel is None:
+      self.dropped += len(batch);
+      return None;
+    start = time.monotonic();
+    try:
+      await channel.send("\n".join(message for message, _ in batch));
+    except discord.RateLimited as e:
+      return e.retry_after;
+    except discord.HTTPException as e:
+      if e.status == 429:
+        return 0.0;
+      print(f"ログ送信エラー: {e}");
+      self.dropped += len(batch);
+      return None;
+    now = time.monotonic();
+    LOG_SEND_SECONDS.observe(now - start);
+    for _, enqueued_at in batch:
+      LOG_DELAY_SECONDS.observe(now - enqueued_at);
+    self.sent += 1;
+    self.merged += len(batch) - 1;
+    return None;
+  
+  def stats(self) -> Dict[str, int]:
+    """
+    送信の統計を取得する
+    
+    Returns:
+      Dict[str, int]: {"queued", "merged", "sent", "dropped", "rate_limited", "pending"}
+    """
+    return {
+      "queued": self.queued,
+      "merged": self.merged,
+      "sent": self.sent,
+      "dropped": self.dropped,
+      "rate_limited": self.rate_limited,
+      "pending": sum(len(queue) for queue in self._queues.values())
+    };
+  
+  async def close(self, timeout: float = 5.0):
+    """
+    残っているメッセージを待たずに送り、ワーカーを止める
+    
+    Args:
+      timeout: 送り終わるのを待つ最大秒数
+    """
+    self.window = 0;
+    workers = [worker for worker in self._workers.values() if not worker.done()];
+    if workers:
+      _, pending = await asyncio.wait(workers, timeout=timeout);
+      for worker in pending:
+        worker.cancel();
+    self._workers = {};
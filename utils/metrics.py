@@ -0,0 +1,524 @@
+"""
+metrics.py - メトリクス収集モジュール
+
+コマンドの処理時間や保存・読み込みの時間などを集計し、
+Prometheusのテキスト形式で書き出す（ローカルのHTTPポートまたはファイル）
+"""
+import asyncio;
+import os;
+import threading;
+import time;
+from contextlib import contextmanager;
+from typing import Callable, Dict, Iterator, List, Optional, Tuple;
+
+# 処理時間のバケット（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0);
+# 書き込みバイト数のバケット
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864);
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+  """
+  ラベルを辞書のキーにできる形にする
+  
+  Args:
+    labels: ラベル
+  
+  Returns:
+    Tuple[Tuple[str, str], ...]: 名前順に並べたラベル
+  """
+  return tuple(sorted((name, str(value)) for name, value in labels.items()));
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+  """
+  ラベルをPrometheusのテキスト形式にする
+  
+  Args:
+    key: ラベル
+    extra: 追加するラベル（ヒストグラムのle）
+  
+  Returns:
+    str: {name="value",...}（ラベルがなければ空文字）
+  """
+  pairs = list(key) + ([extra] if extra else []);
+  if not pairs:
+    return "";
+  escape = lambda value: value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n');
+  return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}";
+
+def _format_value(value: float) -> str:
+  """
+  値をPrometheusのテキスト形式にする
+  
+  Args:
+    value: 値
+  
+  Returns:
+    str: 整数なら小数点なしの文字列
+  """
+  if value == int(value):
+    return str(int(value));
+  return repr(float(value));
+
+class _HistogramSeries:
+  """
+  ラベルの組み合わせ1つ分のヒストグラム
+  """
+  
+  __slots__ = ("counts", "count", "sum", "max");
+  
+  def __init__(self, bucket_count: int):
+    """
+    系列を初期化する
+    
+    Args:
+      bucket_count: バケットの数
+    """
+    self.counts = [0] * bucket_count;
+    self.count = 0;
+    self.sum = 0.0;
+    self.max = 0.0;
+
+class Histogram:
+  """
+  ヒストグラム
+  値はバケットごとの件数で持つので、観測回数が増えてもメモリは増えない
+  """
+  
+  def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+    """
+    ヒストグラムを初期化する
+    
+    Args:
+      name: メトリクス名
+      help_text: 説明
+      buckets: バケットの上限（昇順）
+    """
+    self.name = name;
+    self.help_text = help_text;
+    self.buckets = tuple(buckets);
+    self._series = {};  # {ラベル: _HistogramSeries}
+    # 保存はスレッドプールからも記録されるので排他する
+    self._lock = threading.Lock();
+  
+  def observe(self, value: float, **labels):
+    """
+    値を1件記録する
+    
+    Args:
+      value: 値
+      **labels: ラベル
+    """
+    key = _label_key(labels);
+    with self._lock:
+      series = self._series.get(key);
+      if series is None:
+        series = self._series[key] = _HistogramSeries(len(self.buckets));
+      for i, bound in enumerate(self.buckets):
+        if value <= bound:
+          series.counts[i] += 1;
+          break;
+      series.count += 1;
+      series.sum += value;
+      series.max = max(series.max, value);
+  
+  @contextmanager
+  def time(self, **labels) -> Iterator[None]:
+    """
+    ブロックの実行時間を記録する
+    
+    Args:
+      **labels: ラベル
+    
+    Yields:
+      None
+    """
+    start = time.perf_counter();
+    try:
+      yield;
+    finally:
+      self.observe(time.perf_counter() - start, **labels);
+  
+  def labels(self) -> List[Dict[str, str]]:
+    """
+    記録のあるラベルの一覧を取得する
+    
+    Returns:
+      List[Dict[str, str]]: ラベル
+    """
+    with self._lock:
+      return [dict(key) for key in self._series];
+  
+  def summary(self, **labels) -> Dict[str, float]:
+    """
+    系列の集計を取得する（p50・p95はバケットから線形補間した推定値）
+    
+    Args:
+      **labels: ラベル
+    
+    Returns:
+      Dict[str, float]: {"count", "sum", "mean", "p50", "p95", "max"}（記録がなければ全て0）
+    """
+    with self._lock:
+      series = self._series.get(_label_key(labels));
+      if series is None or series.count == 0:
+        return {"count": 0, "sum": 0.0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0};
+      counts = list(series.counts);
+      count, total, largest = series.count, series.sum, series.max;
+    return {
+      "count": count,
+      "sum": total,
+      "mean": total / count,
+      "p50": self._quantile(counts, count, largest, 0.50),
+      "p95": self._quantile(counts, count, largest, 0.95),
+      "max": largest
+    };
+  
+  def _quantile(self, counts: List[int], count: int, largest: float, q: float) -> float:
+    """
+    バケットの件数から分位点を推定する
+    
+    Args:
+      counts: バケットごとの件数
+      count: 全体の件数
+      largest: 最大値（最後のバケットを超えた場合に使う）
+      q: 分位（0〜1）
+    
+    Returns:
+      float: 推定値（最大値を超えない）
+    """
+    rank = q * count;
+    seen = 0;
+    lower = 0.0;
+    for bound, bucket_count in zip(self.buckets, counts):
+      if bucket_count and seen + bucket_count >= rank:
+        return min(lower + (bound - lower) * (rank - seen) / bucket_count, largest);
+      seen += bucket_count;
+      lower = bound;
+    return largest;
+  
+  def render(self) -> List[str]:
+    """
+    Prometheusのテキスト形式にする
+    
+    Returns:
+      List[str]: 行
+    """
+    lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"];
+    with self._lock:
+      for key, series in sorted(self._series.items()):
+        cumulative = 0;
+        for bound, bucket_count in zip(self.buckets, series.counts):
+          cumulative += bucket_count;
+          lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {cumulative}");
+        lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {series.count}");
+        lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series.sum)}");
+        lines.append(f"{self.name}_count{_format_labels(key)} {series.count}");
+    return lines;
+
+class Counter:
+  """
+  カウンター（増えるだけの値）
+  """
+  
+  def __init__(self, name: str, help_text: str):
+    """
+    カウンターを初期化する
+    
+    Args:
+      name: メトリクス名（_totalで終わる）
+      help_text: 説明
+    """
+    self.name = name;
+    self.help_text = help_text;
+    self._values = {};  # {ラベル: 値}
+    self._lock = threading.Lock();
+  
+  def inc(self, amount: float = 1, **labels):
+    """
+    値を増やす
+    
+    Args:
+      amount: 増やす量
+      **labels: ラベル
+    """
+    key = _label_key(labels);
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount;
+  
+  def value(self, **labels) -> float:
+    """
+    現在の値を取得する
+    
+    Args:
+      **labels: ラベル
+    
+    Returns:
+      float: 値（記録がなければ0）
+    """
+    with self._lock:
+      return self._values.get(_label_key(labels), 0);
+  
+  def render(self) -> List[str]:
+    """
+    Prometheusのテキスト形式にする
+    
+    Returns:
+      List[str]: 行
+    """
+    lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"];
+    with self._lock:
+      for key, value in sorted(self._values.items()):
+        lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}");
+    return lines;
+
+class CallbackMetric:
+  """
+  書き出すときに関数を呼んで値を集めるメトリクス
+  他のクラスが持っている統計（ログ送信の件数など）をそのまま出す
+  """
+  
+  def __init__(self, name: str, kind: str, help_text: str, collect: Callable[[], List[Tuple[Dict[str, str], float]]]):
+    """
+    メトリクスを初期化する
+    
+    Args:
+      name: メトリクス名
+      kind: 種類（gauge / counter）
+      help_text: 説明
+      collect: [(ラベル, 値)] を返す関数
+    """
+    self.name = name;
+    self.kind = kind;
+    self.help_text = help_text;
+    self.collect = collect;
+  
+  def render(self) -> List[str]:
+    """
+    Prometheusのテキスト形式にする
+    
+    Returns:
+      List[str]: 行
+    """
+    lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"];
+    for labels, value in self.collect():
+      lines.append(f"{self.name}{_format_labels(_label_key(labels))} {_format_value(value)}");
+    return lines;
+
+class MetricsRegistry:
+  """
+  メトリクスの登録先
+  同じ名前で登録した場合は既存のものを返す（サーバーごとのデータベースで共有する）
+  """
+  
+  def __init__(self):
+    """
+    登録先を初期化する
+    """
+    self._metrics = {};  # {名前: メトリクス}
+  
+  def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+    """
+    ヒストグラムを登録する
+    
+    Args:
+      name: メトリクス名
+      help_text: 説明
+      buckets: バケットの上限
+    
+    Returns:
+      Histogram: ヒストグラム
+    """
+    return self._metrics.setdefault(name, Histogram(name, help_text, buckets));
+  
+  def counter(self, name: str, help_text: str) -> Counter:
+    """
+    カウンターを登録する
+    
+    Args:
+      name: メトリクス名
+      help_text: 説明
+    
+    Returns:
+      Counter: カウンター
+    """
+    return self._metrics.setdefault(name, Counter(name, help_text));
+  
+  def callback(self, name: str, kind: str, help_text: str, collect: Callable[[], List[Tuple[Dict[str, str], float]]]):
+    """
+    値を関数で集めるメトリクスを登録する（同じ名前なら置き換える。Cogの再読み込み用）
+    
+    Args:
+      name: メトリクス名
+      kind: 種類（gauge / counter）
+      help_text: 説明
+      collect: [(ラベル, 値)] を返す関数
+    """
+    self._metrics[name] = CallbackMetric(name, kind, help_text, collect);
+  
+  def render(self) -> str:
+    """
+    全てのメトリクスをPrometheusのテキスト形式にする
+    
+    Returns:
+      str: テキスト
+    """
+    lines = [];
+    for metric in list(self._metrics.values()):
+      try:
+        lines.extend(metric.render());
+      except Exception as e:
+        print(f"メトリクス集計エラー（{metric.name}）: {e}");
+    return "\n".join(lines) + "\n";
+
+# プロセス全体で共有する登録先
+REGISTRY = MetricsRegistry();
+
+COMMAND_SECONDS = REGISTRY.histogram(
+  "fusaikanri_command_seconds", "スラッシュコマンドの処理時間（秒）"
+);
+STORAGE_LOAD_SECONDS = REGISTRY.histogram(
+  "fusaikanri_storage_load_seconds", "データファイルの読み込み時間（秒）"
+);
+STORAGE_SAVE_SECONDS = REGISTRY.histogram(
+  "fusaikanri_storage_save_seconds", "保存1回の時間（秒）。kindはsnapshot/journal/sqlite"
+);
+STORAGE_SAVE_BYTES = REGISTRY.histogram(
+  "fusaikanri_storage_save_bytes", "保存1回で書き込んだバイト数", SIZE_BUCKETS
+);
+USER_LOOKUPS = REGISTRY.counter(
+  "fusaikanri_user_lookups_total", "ユーザー名の解決回数。sourceがfetchのものがfetch_userの呼び出し"
+);
+LOG_SEND_SECONDS = REGISTRY.histogram(
+  "fusaikanri_log_send_seconds", "ログチャンネルへの送信1回のAPI呼び出し時間（秒）"
+);
+LOG_DELAY_SECONDS = REGISTRY.histogram(
+  "fusaikanri_log_delay_seconds", "ログをキューに積んでから送信するまでの時間（秒）"
+);
+MUTATION_GROUP_SIZE = REGISTRY.histogram(
+  "fusaikanri_mutation_group_size", "1回のコミットにまとめた変更の件数", (1, 2, 4, 8, 16, 32, 64, 128, 256)
+);
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+  "fusaikanri_event_loop_lag_seconds", "イベントループの遅れ（sleepが予定より遅れて戻った秒数）"
+);
+
+class MetricsExporter:
+  """
+  メトリクスの書き出しとイベントループの遅れの計測を行うクラス
+  """
+  
+  def __init__(self, registry: MetricsRegistry = REGISTRY, lag_interval: float = 0.5):
+    """
+    書き出し器を初期化する
+    
+    Args:
+      registry: 書き出すメトリクスの登録先
+      lag_interval: イベントループの遅れを測る間隔（秒）
+    """
+    self.registry = registry;
+    self.lag_interval = lag_interval;
+    self._server = None;
+    self._tasks = [];
+  
+  async def start(self, host: str, port: int, file_path: str = "", file_interval: float = 15.0):
+    """
+    計測と書き出しを開始する（イベントループ上で呼ぶ）
+    
+    Args:
+      host: HTTPで公開するアドレス
+      port: HTTPで公開するポート（0なら公開しない）
+      file_path: 定期的に書き出すファイル（空なら書き出さない）
+      file_interval: ファイルに書き出す間隔（秒）
+    """
+    self._tasks.append(asyncio.create_task(self._watch_loop_lag()));
+    if port:
+      self._server = await asyncio.start_server(self._handle, host, port);
+      print(f"メトリクスを http://{host}:{port}/metrics で公開した");
+    if file_path:
+      self._tasks.append(asyncio.create_task(self._write_file_periodically(file_path, file_interval)));
+  
+  async def _watch_loop_lag(self):
+    """
+    一定間隔でsleepし、予定より遅れて戻った時間をイベントループの遅れとして記録する
+    """
+    loop = asyncio.get_running_loop();
+    while True:
+      start = loop.time();
+      await asyncio.sleep(self.lag_interval);
+      LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - self.lag_interval));
+  
+  async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    HTTPリクエストに応答する（GET /metrics のみ）
+    
+    Args:
+      reader: リクエストの読み込み
+      writer: レスポンスの書き込み
+    """
+    try:
+      request_line = await asyncio.wait_for(reader.readline(), timeout=5);
+      # ヘッダーは読み捨てる
+      while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+        pass;
+      parts = request_line.decode('latin-1').split();
+      if len(parts) >= 2 and parts[0] == "GET" and parts[1].split('?')[0] == "/metrics":
+        status, body = "200 OK", self.registry.render().encode('utf-8');
+      else:
+        status, body = "404 Not Found", b"not found\n";
+      writer.write(
+        f"HTTP/1.1 {status}\r\n"
+        f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n".encode('latin-1') + body
+      );
+      await writer.drain();
+    except (asyncio.TimeoutError, ConnectionError):
+      pass;
+    finally:
+      writer.close();
+  
+  def write_file(self, path: str) -> bool:
+    """
+    メトリクスをファイルに書き出す（一時ファイルに書いてから置き換える）
+    
+    Args:
+      path: 書き出し先
+    
+    Returns:
+      bool: 書き出し成功時True
+    """
+    try:
+      directory = os.path.dirname(path);
+      if directory:
+        os.makedirs(directory, exist_ok=True);
+      tmp_path = path + '.tmp';
+      with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(self.registry.render());
+      os.replace(tmp_path, path);
+      return True;
+    except Exception as e:
+      print(f"メトリクス書き出しエラー: {e}");
+      return False;
+  
+  async def _write_file_periodically(self, path: str, interval: float):
+    """
+    一定間隔でメトリクスをファイルに書き出す
+    
+    Args:
+      path: 書き出し先
+      interval: 間隔（秒）
+    """
+    while True:
+      await asyncio.to_thread(self.write_file, path);
+      await asyncio.sleep(interval);
+  
+  async def close(self):
+    """
+    計測と書き出しを止める
+    """
+    for task in self._tasks:
+      task.cancel();
+    self._tasks = [];
+    if self._server is not None:
+      self._server.close();
+      await self._server.wait_closed();
+      self._server = None;
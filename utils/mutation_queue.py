@@ -0,0 +1,225 @@
+"""
+mutation_queue.py - 単一書き込みキューモジュール
+
+データベースへの変更を1つのキューに積み、1つのワーカーが順番に適用する
+同時に届いた変更は1つのbatch()にまとめ、保存（コミット）を1回で済ませる
+適用と保存はスレッドで行い、大きな精算や取り込みでもイベントループを止めない
+"""
+import asyncio;
+from typing import Any, Callable, List, Optional, Tuple;
+from utils.metrics import MUTATION_GROUP_SIZE;
+
+class MutationQueue:
+  """
+  単一書き込みキュークラス
+  変更はここを通して1つずつ順番に適用するので、確認してから書き換える処理同士が混ざらない
+  適用中はデータベースのstate_lockを持つ。公開中の版から読む読み取りは待たずに読めるが、
+  メモリ上のデータ（SQLiteでは書き込み用の接続）を読む処理はstate_lockを取ってから行う
+  """
+  
+  def __init__(self, db, max_batch: int = 100):
+    """
+    キューを初期化する（ワーカーは最初の変更が積まれたときに開始する）
+    
+    Args:
+      db: DebtDatabase または SQLiteDebtDatabase
+      max_batch: 1回のコミットにまとめる最大件数
+    """
+    self.db = db;
+    self.max_batch = max_batch;
+    self._queue = None;
+    self._task = None;
+    # 統計
+    self.batches = 0;
+    self.mutations = 0;
+  
+  async def submit(self, mutation: Callable[[Any], Any], on_failure: Any) -> Any:
+    """
+    変更をキューに積み、適用されて保存されるまで待つ
+    
+    Args:
+      mutation: データベースを受け取って変更を行う関数（ワーカーから呼ばれる）
+      on_failure: 保存に失敗した場合に返す値
+    
+    Returns:
+      Any: mutationの戻り値（保存に失敗した場合はon_failure）
+    
+    Raises:
+      Exception: mutationが投げた例外（その変更だけ取り消される）
+    """
+    if self._task is None or self._task.done():
+      self._queue = asyncio.Queue();
+      self._task = asyncio.create_task(self._run());
+    future = asyncio.get_running_loop().create_future();
+    self._queue.put_nowait((mutation, on_failure, future));
+    return await future;
+  
+  async def _run(self):
+    """
+    キューに溜まった変更をまとめて適用する（Noneが来たら止まる）
+    """
+    closing = False;
+    while not closing:
+      item = await self._queue.get();
+      if item is None:
+        break;
+      # 同じタイミングで届いたコマンドが変更を積めるよう1回だけ譲る
+      await asyncio.sleep(0);
+      items = [item];
+      while len(items) < self.max_batch and not self._queue.empty():
+        item = self._queue.get_nowait();
+        if item is None:
+          closing = True;
+          break;
+        items.append(item);
+      # 待っている側がキャンセルした変更は適用しない
+      items = [item for item in items if not item[2].done()];
+      if not items:
+        continue;
+      async with self.db.state_lock:
+        ok, results = await asyncio.to_thread(self._apply, [mutation for mutation, _, _ in items]);
+      self._resolve(items, ok, results);
+  
+  def _apply(self, mutations: List[Callable[[Any], Any]]) -> Tuple[bool, List[Tuple[bool, Any]]]:
+    """
+    変更を1つのbatch()で適用して保存する（スレッドで呼ばれる）
+    変更ごとに内側のbatch()で囲むので、例外を投げた変更だけが取り消される
+    
+    Args:
+      mutations: 変更
+    
+    Returns:
+      Tuple[bool, List[Tuple[bool, Any]]]: (保存に成功したか, [(戻り値を返したか, 戻り値または例外)])
+    """
+    results = [];
+    try:
+      with self.db.batch() as batch:
+        for mutation in mutations:
+          try:
+            with self.db.batch():
+              results.append((True, mutation(self.db)));
+          except Exception as e:
+            results.append((False, e));
+      return batch.ok, results;
+    except Exception as e:
+      print(f"変更の適用エラー: {e}");
+      return False, [(True, None)] * len(mutations);
+  
+  def _resolve(self, items: List[Tuple[Callable[[Any], Any], Any, asyncio.Future]], ok: bool, results: List[Tuple[bool, Any]]):
+    """
+    適用した結果を待っている呼び出し元に返す（イベントループ上で呼ぶ）
+    
+    Args:
+      items: (変更, 失敗時の値, 結果を返すFuture)
+      ok: 保存に成功したか
+      results: _applyの結果
+    """
+    self.batches += 1;
+    self.mutations += len(items);
+    MUTATION_GROUP_SIZE.observe(len(items));
+    
+    for (_, on_failure, future), (returned, value) in zip(items, results):
+      if future.done():
+        continue;
+      if not returned:
+        future.set_exception(value);
+      elif not ok:
+        future.set_result(on_failure);
+      else:
+        future.set_result(value);
+  
+  async def close(self):
+    """
+    積まれている変更を全て適用してからワーカーを止める
+    """
+    if self._task is None:
+      return;
+    if not self._task.done():
+      self._queue.put_nowait(None);
+      await self._task;
+    self._task = None;
+  
+  async def add_debt(self, creditor_id: int, debtor_id: int, amount: int, description: str = "") -> bool:
+    """
+    借金を追加する
+    
+    Args:
+      creditor_id: 債権者ID
+      debtor_id: 債務者ID
+      amount: 金額
+      description: 説明
+    
+    Returns:
+      bool: 成功時True
+    """
+    return await self.submit(lambda db: db.add_debt(creditor_id, debtor_id, amount, description), False);
+  
+  async def add_debts(self, entries: List[Tuple[int, int, int, str]]) -> bool:
+    """
+    複数の借金をまとめて追加する
+    
+    Args:
+      entries: [(債権者ID, 債務者ID, 金額, 説明)]
+    
+    Returns:
+      bool: 成功時True
+    """
+    return await self.submit(lambda db: db.add_debts(entries), False);
+  
+  async def pay_debt(self, creditor_id: int, debtor_id: int, amount: int, payer_id: Optional[int] = None) -> Tuple[bool, int]:
+    """
+    借金を返済する
+    
+    Args:
+      creditor_id: 債権者ID
+      debtor_id: 債務者ID
+      amount: 返済額
+      payer_id: 実際に返済した人のID（代理返済の場合）
+    
+    Returns:
+      Tuple[bool, int]: (成功したか, 残りの借金額)
+    """
+    return await self.submit(lambda db: db.pay_debt(creditor_id, debtor_id, amount, payer_id), (False, 0));
+  
+  async def transfer_debt(self, creditor_id: int, debtor_id: int, new_creditor_id: int, amount: int) -> Tuple[bool, str, int]:
+    """
+    債権を譲渡する
+    
+    Args:
+      creditor_id: 現在の債権者ID
+      debtor_id: 債務者ID
+      new_creditor_id: 新しい債権者ID
+      amount: 譲渡額
+    
+    Returns:
+      Tuple[bool, str, int]: (成功したか, エラーメッセージ, 残りの債権額)
+    """
+    return await self.submit(
+      lambda db: db.transfer_debt(creditor_id, debtor_id, new_creditor_id, amount),
+      (False, "保存に失敗した", 0)
+    );
+  
+  async def apply_settlement(self, plan: List[Tuple[int, int, int]]) -> Tuple[bool, str]:
+    """
+    精算案を反映する
+    
+    Args:
+      plan: plan_settlementの結果
+    
+    Returns:
+      Tuple[bool, str]: (成功したか, エラーメッセージ)
+    """
+    return await self.submit(lambda db: db.apply_settlement(plan), (False, "保存に失敗した"));
+  
+  async def set_log_channel(self, guild_id: int, channel_id: int) -> bool:
+    """
+    ログチャンネルを設定する
+    
+    Args:
+      guild_id: サーバーID
+      channel_id: チャンネルID
+    
+    Returns:
+      bool: 成功時True
+    """
+    return await self.submit(lambda db: db.set_log_channel(guild_id, channel_id), False);
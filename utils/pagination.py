@@ -0,0 +1,140 @@
+"""
+pagination.py - ページ送りモジュール
+
+一覧を1ページずつ表示し、前へ・次へボタンが押されたときに次のページを取得して描画する
+"""
+from typing import Awaitable, Callable, Optional, Tuple;
+import discord;
+
+# ページを描画する関数（カーソルを受け取り、埋め込みと次のページのカーソルを返す。次がなければNone）
+PageRenderer = Callable[[Optional[int]], Awaitable[Tuple[discord.Embed, Optional[int]]]];
+
+class CursorPaginator(discord.ui.View):
+  """
+  カーソル方式のページ送りビュー
+  表示したページのカーソルを積んでおき、前へは1つ戻し、次へは最後に描画したページが返したカーソルで描画する
+  ページは押されたときに初めて取得するので、最初のページは件数によらずすぐに返せる
+  """
+  
+  def __init__(self, owner_id: int, render: PageRenderer, timeout: float = 300):
+    """
+    ビューを初期化する
+    
+    Args:
+      owner_id: ボタンを押せるユーザーのID（コマンドを実行した人）
+      render: ページを描画する関数
+      timeout: ボタンを受け付ける秒数
+    """
+    super().__init__(timeout=timeout);
+    self.owner_id = owner_id;
+    self.render = render;
+    self._cursors = [];  # 表示したページのカーソル（先頭は最初のページ）
+    self._next_cursor = None;
+    self._origin = None;
+  
+  def _update_buttons(self):
+    """
+    今のページに合わせてボタンの有効・無効を切り替える
+    """
+    self.previous_page.disabled = len(self._cursors) <= 1;
+    self.next_page.disabled = self._next_cursor is None;
+  
+  async def _show(self, cursor: Optional[int]) -> discord.Embed:
+    """
+    ページを描画し、ページ番号をフッターに付ける
+    
+    Args:
+      cursor: 描画するページのカーソル
+    
+    Returns:
+      discord.Embed: 埋め込み
+    """
+    embed, self._next_cursor = await self.render(cursor);
+    footer = f"{len(self._cursors)}ページ目";
+    if embed.footer and embed.footer.text:
+      footer = f"{embed.footer.text} / {footer}";
+    embed.set_footer(text=footer);
+    self._update_buttons();
+    return embed;
+  
+  async def start(self, interaction: discord.Interaction, cursor: Optional[int] = None):
+    """
+    最初のページを表示する（interactionはdeferで応答を保留済みであること）
+    次のページがなければボタンは付けない
+    
+    Args:
+      interaction: コマンドのインタラクション
+      cursor: 最初のページのカーソル
+    """
+    self._cursors = [cursor];
+    self._origin = interaction;
+    embed = await self._show(cursor);
+    if self._next_cursor is None:
+      self.stop();
+      await interaction.edit_original_response(embed=embed);
+      return;
+    await interaction.edit_original_response(embed=embed, view=self);
+  
+  async def interaction_check(self, interaction: discord.Interaction) -> bool:
+    """
+    コマンドを実行した人だけがボタンを押せるようにする
+    
+    Args:
+      interaction: ボタンのインタラクション
+    
+    Returns:
+      bool: 押せる場合True
+    """
+    if interaction.user.id == self.owner_id:
+      return True;
+    await interaction.response.send_message("この一覧は実行した人しか操作できないぞ", ephemeral=True);
+    return False;
+  
+  async def _turn(self, interaction: discord.Interaction):
+    """
+    積んだカーソルの最後のページを描画してメッセージを書き換える
+    
+    Args:
+      interaction: ボタンのインタラクション
+    """
+    # 描画に時間がかかっても期限に間に合うよう先に応答する
+    await interaction.response.defer();
+    embed = await self._show(self._cursors[-1]);
+    await interaction.edit_original_response(embed=embed, view=self);
+  
+  @discord.ui.button(label="前へ", style=discord.ButtonStyle.secondary)
+  async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+    """
+    前のページを表示する
+    
+    Args:
+      interaction: ボタンのインタラクション
+      button: 押されたボタン
+    """
+    if len(self._cursors) > 1:
+      self._cursors.pop();
+    await self._turn(interaction);
+  
+  @discord.ui.button(label="次へ", style=discord.ButtonStyle.primary)
+  async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+    """
+    次のページを表示する
+    
+    Args:
+      interaction: ボタンのインタラクション
+      button: 押されたボタン
+    """
+    if self._next_cursor is not None:
+      self._cursors.append(self._next_cursor);
+    await self._turn(interaction);
+  
+  async def on_timeout(self):
+    """
+    受付時間が過ぎたらボタンを外す
+    """
+    if self._origin is None:
+      return;
+    try:
+      await self._origin.edit_original_response(view=None);
+    except discord.HTTPException:
+      pass;
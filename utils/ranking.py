@@ -0,0 +1,378 @@
+"""
+ranking.py - ランキング管理モジュール
+
+ユーザーごとの合計額を常にソート済みで保持し、
+上位k件・任意の位置のページ・ユーザーの順位を全体ソートなしで取り出せるようにする
+"""
+import bisect;
+from itertools import accumulate;
+from typing import Any, Dict, List, Optional, Tuple;
+from utils.ledger_version import CowMap;
+
+class RankIndex:
+  """
+  順位付きのソート済みリストクラス
+  要素を最大LOAD * 2件ずつのソート済みの塊に分けて持ち、各塊の先頭位置から何番目かを求める
+  追加・削除は1つの塊の中だけで済み、位置からの取り出しも二分探索で塊を探すだけで済む
+  freeze()で切り出した版とは塊を共有し、変更する塊だけを複製する
+  """
+  
+  __slots__ = ("_chunks", "_maxes", "_owned", "_offsets", "_len", "_frozen", "_last_frozen");
+  
+  # 塊の目安の件数（LOAD * 2を超えたら2つに分ける）
+  LOAD = 256;
+  
+  def __init__(self, items: Optional[List] = None):
+    """
+    リストを作る
+    
+    Args:
+      items: ソート済みの要素
+    """
+    items = items or [];
+    load = self.LOAD;
+    self._chunks = [items[i:i + load] for i in range(0, len(items), load)];
+    # 各塊の最後（最大）の要素
+    self._maxes = [chunk[-1] for chunk in self._chunks];
+    # 最後に版を切り出してから複製した（このリストだけが持っている）塊か
+    self._owned = [True] * len(self._chunks);
+    # 各塊の先頭の位置（変更したら捨て、次に使うときに作り直す）
+    self._offsets = None;
+    self._len = len(items);
+    self._frozen = False;
+    self._last_frozen = None;
+  
+  def __len__(self) -> int:
+    return self._len;
+  
+  def _own_chunk(self, index: int) -> List:
+    """
+    塊を変更用に取得する（版と共有していれば複製する）
+    
+    Args:
+      index: 塊の位置
+    
+    Returns:
+      List: 塊
+    
+    Raises:
+      TypeError: 切り出した版を変更しようとした場合
+    """
+    if self._frozen:
+      raise TypeError("切り出した版は変更できない");
+    if not self._owned[index]:
+      self._chunks[index] = list(self._chunks[index]);
+      self._owned[index] = True;
+    self._offsets = None;
+    self._last_frozen = None;
+    return self._chunks[index];
+  
+  def add(self, item: Any):
+    """
+    要素を追加する
+    
+    Args:
+      item: 要素
+    """
+    if not self._chunks:
+      if self._frozen:
+        raise TypeError("切り出した版は変更できない");
+      self._chunks.append([item]);
+      self._maxes.append(item);
+      self._owned.append(True);
+      self._offsets = None;
+      self._last_frozen = None;
+      self._len = 1;
+      return;
+    index = min(bisect.bisect_left(self._maxes, item), len(self._chunks) - 1);
+    chunk = self._own_chunk(index);
+    bisect.insort(chunk, item);
+    self._maxes[index] = chunk[-1];
+    self._len += 1;
+    load = self.LOAD;
+    if len(chunk) > load * 2:
+      self._chunks[index:index + 1] = [chunk[:load], chunk[load:]];
+      self._maxes[index:index + 1] = [chunk[load - 1], chunk[-1]];
+      self._owned[index:index + 1] = [True, True];
+  
+  def remove(self, item: Any):
+    """
+    要素を削除する（要素があること）
+    
+    Args:
+      item: 要素
+    """
+    index = bisect.bisect_left(self._maxes, item);
+    chunk = self._own_chunk(index);
+    del chunk[bisect.bisect_left(chunk, item)];
+    self._len -= 1;
+    if not chunk:
+      del self._chunks[index];
+      del self._maxes[index];
+      del self._owned[index];
+      return;
+    self._maxes[index] = chunk[-1];
+    if len(chunk) < self.LOAD // 4 and len(self._chunks) > 1:
+      # 小さくなった塊は隣とまとめる（削除が続いても塊の数が増えたままにならないように）
+      left = index - 1 if index > 0 else index;
+      merged = self._chunks[left] + self._chunks[left + 1];
+      self._chunks[left:left + 2] = [merged];
+      self._maxes[left:left + 2] = [merged[-1]];
+      self._owned[left:left + 2] = [True];
+  
+  def _chunk_offsets(self) -> List[int]:
+    """
+    各塊の先頭の位置を取得する
+    
+    Returns:
+      List[int]: 位置
+    """
+    offsets = self._offsets;
+    if offsets is None:
+      # 作り直したリストを丸ごと差し替えるので、版を複数のスレッドから読んでいても壊れない
+      offsets = self._offsets = list(accumulate((len(chunk) for chunk in self._chunks), initial=0));
+    return offsets;
+  
+  def index(self, key: Any) -> int:
+    """
+    key以上の最初の要素の位置（keyより小さい要素の数）を求める
+    
+    Args:
+      key: 比べる値
+    
+    Returns:
+      int: 位置
+    """
+    index = bisect.bisect_left(self._maxes, key);
+    if index == len(self._chunks):
+      return self._len;
+    return self._chunk_offsets()[index] + bisect.bisect_left(self._chunks[index], key);
+  
+  def slice(self, start: int, stop: int) -> List:
+    """
+    位置がstartからstop - 1までの要素を取得する
+    
+    Args:
+      start: 最初の位置
+      stop: 最後の位置 + 1
+    
+    Returns:
+      List: 要素
+    """
+    stop = min(stop, self._len);
+    if start >= stop:
+      return [];
+    offsets = self._chunk_offsets();
+    index = bisect.bisect_right(offsets, start) - 1;
+    items = [];
+    position = start - offsets[index];
+    while len(items) < stop - start:
+      chunk = self._chunks[index];
+      items.extend(chunk[position:position + stop - start - len(items)]);
+      index += 1;
+      position = 0;
+    return items;
+  
+  def freeze(self) -> "RankIndex":
+    """
+    今の内容を読み取り専用の版として切り出す（塊の一覧を写すだけで、塊は共有する）
+    
+    Returns:
+      RankIndex: 読み取り専用の版（前回から変更がなければ前回と同じもの）
+    """
+    if self._frozen:
+      return self;
+    if self._last_frozen is not None:
+      return self._last_frozen;
+    frozen = RankIndex.__new__(RankIndex);
+    frozen._chunks = tuple(self._chunks);
+    frozen._maxes = tuple(self._maxes);
+    frozen._owned = ();
+    frozen._offsets = self._offsets;
+    frozen._len = self._len;
+    frozen._frozen = True;
+    frozen._last_frozen = None;
+    self._owned = [False] * len(self._chunks);
+    self._last_frozen = frozen;
+    return frozen;
+
+def ranked_page(rows: List[Tuple[int, int]], offset: int, first_rank: int) -> List[Tuple[int, int, int]]:
+  """
+  合計額の多い順に並んだページに順位を付ける（同額は同順位）
+  
+  Args:
+    rows: [(user, 合計額)]（全体のoffset番目から）
+    offset: ページの先頭の位置
+    first_rank: ページの先頭の順位
+  
+  Returns:
+    List[Tuple[int, int, int]]: [(順位, user, 合計額)]
+  """
+  ranked = [];
+  rank = first_rank;
+  previous = None;
+  for position, (user, total) in enumerate(rows, offset + 1):
+    if previous is not None and total != previous:
+      rank = position;
+    ranked.append((rank, user, total));
+    previous = total;
+  return ranked;
+
+class RankedTotals:
+  """
+  合計額ランキングクラス
+  合計額の辞書と (-合計額, ユーザー) のソート済みリストを同期して持つ
+  """
+  
+  def __init__(self):
+    """
+    ランキングを初期化する
+    """
+    self._totals = CowMap();  # {user: 合計額}
+    self._order = RankIndex();  # [(-合計額, user)] 金額の多い順
+    self._frozen = False;
+    self._last_frozen = None;
+  
+  @classmethod
+  def from_totals(cls, totals: Dict[int, int]) -> "RankedTotals":
+    """
+    集計済みの合計額からランキングをまとめて作る（1件ずつaddするより速い）
+    
+    Args:
+      totals: {user: 合計額}（0のユーザーは含めない）
+    
+    Returns:
+      RankedTotals: ランキング
+    """
+    ranked = cls();
+    totals = {user: total for user, total in totals.items() if total};
+    ranked._totals = CowMap(totals);
+    ranked._order = RankIndex(sorted((-total, user) for user, total in totals.items()));
+    return ranked;
+  
+  def __len__(self) -> int:
+    """
+    合計額が0より大きいユーザー数を返す
+    
+    Returns:
+      int: ユーザー数
+    """
+    return len(self._totals);
+  
+  def __contains__(self, user: int) -> bool:
+    """
+    合計額が0より大きいユーザーか判定する
+    
+    Args:
+      user: ユーザー
+    
+    Returns:
+      bool: ランキングに載っている場合True
+    """
+    return user in self._totals;
+  
+  def get(self, user: int) -> int:
+    """
+    ユーザーの合計額を取得する
+    
+    Args:
+      user: ユーザー
+    
+    Returns:
+      int: 合計額
+    """
+    return self._totals.get(user, 0);
+  
+  def add(self, user: int, delta: int):
+    """
+    ユーザーの合計額を増減する
+    二分探索で位置を求めるので全体の並べ替えは発生しない
+    
+    Args:
+      user: ユーザー
+      delta: 増減額
+    """
+    if delta == 0:
+      return;
+    self._last_frozen = None;
+    old = self._totals.get(user, 0);
+    if old:
+      self._order.remove((-old, user));
+    new = old + delta;
+    if new:
+      self._totals[user] = new;
+      self._order.add((-new, user));
+    else:
+      del self._totals[user];
+  
+  def top(self, k: int) -> List[Tuple[int, int]]:
+    """
+    合計額の多い順に上位k件を取得する
+    
+    Args:
+      k: 件数
+    
+    Returns:
+      List[Tuple[int, int]]: [(user, 合計額)]
+    """
+    return [(user, -neg_total) for neg_total, user in self._order.slice(0, k)];
+  
+  def rank(self, user: int) -> Optional[int]:
+    """
+    ユーザーの順位を求める（自分より合計額の多いユーザー数 + 1。同額は同順位）
+    
+    Args:
+      user: ユーザー
+    
+    Returns:
+      Optional[int]: 順位（合計額が0ならNone）
+    """
+    total = self._totals.get(user, 0);
+    if not total:
+      return None;
+    # (-合計額,) は同額のどのユーザーよりも前に並ぶ
+    return self._order.index((-total,)) + 1;
+  
+  def page(self, offset: int, limit: int) -> List[Tuple[int, int, int]]:
+    """
+    合計額の多い順にoffset番目からlimit件を順位付きで取得する
+    
+    Args:
+      offset: 先頭から飛ばす件数
+      limit: 取得件数
+    
+    Returns:
+      List[Tuple[int, int, int]]: [(順位, user, 合計額)]（同額はユーザーIDの小さい順）
+    """
+    rows = [(user, -neg_total) for neg_total, user in self._order.slice(offset, offset + limit)];
+    if not rows:
+      return [];
+    return ranked_page(rows, offset, self._order.index((-rows[0][1],)) + 1);
+  
+  def totals(self) -> CowMap:
+    """
+    全ユーザーの合計額を取得する
+    
+    Returns:
+      CowMap: {user: 合計額}
+    """
+    return self._totals;
+  
+  def freeze(self) -> "RankedTotals":
+    """
+    今のランキングを読み取り専用の版として切り出す（合計額・順位とも変わった部分だけを複製する）
+    
+    Returns:
+      RankedTotals: 読み取り専用の版（前回から変更がなければ前回と同じもの）
+    """
+    if self._frozen:
+      return self;
+    if self._last_frozen is None:
+      frozen = RankedTotals.__new__(RankedTotals);
+      frozen._totals = self._totals.freeze();
+      frozen._order = self._order.freeze();
+      frozen._frozen = True;
+      # 自分を指すと循環参照になり、古い版がGCまで解放されないのでNoneにする
+      frozen._last_frozen = None;
+      self._last_frozen = frozen;
+    return self._last_frozen;
@@ -0,0 +1,198 @@
+"""
+records.py - メモリ上の台帳表現モジュール
+
+債権はユーザーIDを整数のまま辞書のキーにし、履歴は__slots__付きのレコードで持つ
+ファイル・ジャーナル・アーカイブに書き出すとき（と読み込むとき）だけ、
+従来の形（文字列のID、ISO形式の日時、アクション名の辞書）との間で変換する
+
+同じユーザーIDは何度も出てくるので、ID辞書（{id: id}）を渡すと整数オブジェクトを1つに共有する
+"""
+from datetime import datetime, timedelta;
+from typing import Dict, List, Optional;
+
+# アクション名（コードはこのリストでの位置。既存のコードが変わらないよう末尾にだけ追加する）
+ACTIONS = ["add", "pay", "transfer", "settle", "settle_clear"];
+_ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)};
+
+# 日時の基準。履歴のISO文字列はタイムゾーンなしの現地時刻なので、タイムゾーンを挟まずに差を取る
+# （夏時間の切り替えがあっても元の文字列にそのまま戻る）
+_EPOCH = datetime(1970, 1, 1);
+
+def action_code(action: str) -> int:
+  """
+  アクション名をコードにする（知らない名前は新しいコードを割り当てる）
+  
+  Args:
+    action: アクション名
+  
+  Returns:
+    int: コード
+  """
+  code = _ACTION_CODES.get(action);
+  if code is None:
+    code = _ACTION_CODES[action] = len(ACTIONS);
+    ACTIONS.append(action);
+  return code;
+
+def to_epoch(value: datetime) -> float:
+  """
+  日時を基準からの秒数にする
+  
+  Args:
+    value: 日時（タイムゾーン付きの場合は現地時刻に直す）
+  
+  Returns:
+    float: 秒数（マイクロ秒まで元に戻せる）
+  """
+  if value.tzinfo is not None:
+    value = value.astimezone().replace(tzinfo=None);
+  return (value - _EPOCH).total_seconds();
+
+def from_epoch(seconds: float) -> datetime:
+  """
+  基準からの秒数を日時に戻す
+  
+  Args:
+    seconds: to_epochで求めた秒数
+  
+  Returns:
+    datetime: タイムゾーンなしの日時
+  """
+  return _EPOCH + timedelta(seconds=seconds);
+
+class HistoryRecord:
+  """
+  履歴レコードクラス
+  辞書と違いキーを持たないので、1件あたりのメモリが小さい
+  追加後は変更しない（スナップショット用のコピーやアーカイブとレコードを共有するため）
+  """
+  
+  __slots__ = ("action", "creditor", "debtor", "amount", "description", "timestamp");
+  
+  def __init__(self, action: int, creditor: int, debtor: int, amount: int, description: str, timestamp: float):
+    """
+    レコードを作る
+    
+    Args:
+      action: アクションのコード（action_codeで求める）
+      creditor: 債権者ID
+      debtor: 債務者ID
+      amount: 金額
+      description: 説明
+      timestamp: 日時（to_epochで求めた秒数）
+    """
+    self.action = action;
+    self.creditor = creditor;
+    self.debtor = debtor;
+    self.amount = amount;
+    self.description = description;
+    self.timestamp = timestamp;
+  
+  @classmethod
+  def from_dict(cls, entry: Dict, ids: Optional[Dict[int, int]] = None) -> "HistoryRecord":
+    """
+    保存形式の履歴からレコードを作る
+    
+    Args:
+      entry: 履歴 {"action", "creditor", "debtor", "amount", "description", "timestamp"}
+      ids: ID辞書（指定時はIDの整数オブジェクトを共有する）
+    
+    Returns:
+      HistoryRecord: レコード
+    """
+    creditor = int(entry["creditor"]);
+    debtor = int(entry["debtor"]);
+    if ids is not None:
+      creditor = ids.setdefault(creditor, creditor);
+      debtor = ids.setdefault(debtor, debtor);
+    return cls(
+      action_code(entry["action"]),
+      creditor,
+      debtor,
+      entry["amount"],
+      entry.get("description", ""),
+      to_epoch(datetime.fromisoformat(entry["timestamp"]))
+    );
+  
+  @property
+  def action_name(self) -> str:
+    """
+    アクション名
+    
+    Returns:
+      str: アクション名（add, pay, transfer, settle, settle_clear）
+    """
+    return ACTIONS[self.action];
+  
+  def to_dict(self, seq: Optional[int] = None) -> Dict:
+    """
+    保存・表示用の形式に戻す
+    
+    Args:
+      seq: 通し番号（指定時は "id" として付ける）
+    
+    Returns:
+      Dict: 履歴（IDは文字列、日時はISO形式）
+    """
+    entry = {
+      "action": ACTIONS[self.action],
+      "creditor": str(self.creditor),
+      "debtor": str(self.debtor),
+      "amount": self.amount,
+      "description": self.description,
+      "timestamp": from_epoch(self.timestamp).isoformat()
+    };
+    if seq is not None:
+      entry["id"] = seq;
+    return entry;
+
+def decode_debts(debts: Dict[str, Dict[str, int]], ids: Dict[int, int]) -> Dict[int, Dict[int, int]]:
+  """
+  保存形式の債権を整数キーにする
+  
+  Args:
+    debts: {債権者ID(文字列): {債務者ID(文字列): 金額}}
+    ids: ID辞書（読み込んだIDを登録する）
+  
+  Returns:
+    Dict[int, Dict[int, int]]: {債権者ID: {債務者ID: 金額}}
+  """
+  intern = lambda user: ids.setdefault(int(user), int(user));
+  return {intern(creditor): {intern(debtor): amount for debtor, amount in debtors.items()} for creditor, debtors in debts.items()};
+
+def encode_debts(debts: Dict[int, Dict[int, int]]) -> Dict[str, Dict[str, int]]:
+  """
+  整数キーの債権を保存形式（JSONのキーは文字列）にする
+  
+  Args:
+    debts: {債権者ID: {債務者ID: 金額}}
+  
+  Returns:
+    Dict[str, Dict[str, int]]: {債権者ID(文字列): {債務者ID(文字列): 金額}}
+  """
+  return {str(creditor): {str(debtor): amount for debtor, amount in debtors.items()} for creditor, debtors in debts.items()};
+
+def decode_history(entries: List[Dict], ids: Dict[int, int]) -> List[HistoryRecord]:
+  """
+  保存形式の履歴をレコードにする
+  
+  Args:
+    entries: 履歴のリスト
+    ids: ID辞書
+  
+  Returns:
+    List[HistoryRecord]: レコードのリスト
+  """
+  return [HistoryRecord.from_dict(entry, ids) for entry in entries];
+
+def encode_history(records: List[HistoryRecord]) -> List[Dict]:
+  """
+  レコードを保存形式の履歴にする
+  
+  Args:
+    records: レコードのリスト
+  
+  Returns:
+    List[Dict]: 履歴のリスト
+  """
+  return [record.to_dict() for record in records];
@@ -0,0 +1,201 @@
+"""
+settlement.py - 精算モジュール
+
+貸し借りを各ユーザーの差し引き（純額）にまとめ、
+できるだけ少ない送金回数で全員を精算する組み合わせを求める
+
+使い方（合成データでのベンチマーク）:
+  python -m utils.settlement 10 100 500
+"""
+import heapq;
+import random;
+import sys;
+import time;
+from typing import Dict, Hashable, List, Tuple;
+
+# 残りの人数がこの値以下なら厳密解を求める（2^n の動的計画法）
+EXACT_LIMIT = 14;
+
+def net_positions(debts: Dict[Hashable, Dict[Hashable, int]]) -> Dict[Hashable, int]:
+  """
+  債権の一覧から各ユーザーの純額を求める
+  
+  Args:
+    debts: {creditor: {debtor: amount}}
+  
+  Returns:
+    Dict[Hashable, int]: {user: 純額}（プラスは受け取る側、0のユーザーは含めない）
+  """
+  net = {};
+  for creditor, debtors in debts.items():
+    for debtor, amount in debtors.items():
+      net[creditor] = net.get(creditor, 0) + amount;
+      net[debtor] = net.get(debtor, 0) - amount;
+  return {user: amount for user, amount in net.items() if amount};
+
+def transfers_net(transfers: List[Tuple[Hashable, Hashable, int]]) -> Dict[Hashable, int]:
+  """
+  送金の一覧から各ユーザーの純額を求める（精算案が今の貸し借りと合っているかの確認用）
+  
+  Args:
+    transfers: [(creditor, debtor, amount)]
+  
+  Returns:
+    Dict[Hashable, int]: {user: 純額}（0のユーザーは含めない）
+  """
+  net = {};
+  for creditor, debtor, amount in transfers:
+    net[creditor] = net.get(creditor, 0) + amount;
+    net[debtor] = net.get(debtor, 0) - amount;
+  return {user: amount for user, amount in net.items() if amount};
+
+def _settle_greedy(members: List[Tuple[Hashable, int]]) -> List[Tuple[Hashable, Hashable, int]]:
+  """
+  受け取る額が最大の人と払う額が最大の人を順に組み合わせる
+  合計0のグループをk人とすると送金はk-1回以下になる
+  
+  Args:
+    members: [(user, 純額)]（合計は0）
+  
+  Returns:
+    List[Tuple[Hashable, Hashable, int]]: [(creditor, debtor, amount)]
+  """
+  # 同額の場合の順序を決めるため位置も入れる（ユーザー同士は比較しない）
+  creditors = [(-amount, i, user) for i, (user, amount) in enumerate(members) if amount > 0];
+  debtors = [(amount, i, user) for i, (user, amount) in enumerate(members) if amount < 0];
+  heapq.heapify(creditors);
+  heapq.heapify(debtors);
+  transfers = [];
+  while creditors and debtors:
+    neg_credit, ci, creditor = heapq.heappop(creditors);
+    neg_debt, di, debtor = heapq.heappop(debtors);
+    amount = min(-neg_credit, -neg_debt);
+    transfers.append((creditor, debtor, amount));
+    if -neg_credit > amount:
+      heapq.heappush(creditors, (neg_credit + amount, ci, creditor));
+    if -neg_debt > amount:
+      heapq.heappush(debtors, (neg_debt + amount, di, debtor));
+  return transfers;
+
+def _zero_sum_groups(members: List[Tuple[Hashable, int]]) -> List[List[Tuple[Hashable, int]]]:
+  """
+  合計0のグループにできるだけ多く分ける（厳密解）
+  送金回数は「人数 - グループ数」なので、グループ数を最大にすれば最小になる
+  
+  Args:
+    members: [(user, 純額)]（合計は0、EXACT_LIMIT人以下）
+  
+  Returns:
+    List[List[Tuple[Hashable, int]]]: グループの一覧
+  """
+  n = len(members);
+  full = (1 << n) - 1;
+  sums = [0] * (full + 1);
+  best = [0] * (full + 1);
+  for mask in range(1, full + 1):
+    low = mask & -mask;
+    sums[mask] = sums[mask ^ low] + members[low.bit_length() - 1][1];
+    top = 0;
+    rest = mask;
+    while rest:
+      bit = rest & -rest;
+      rest ^= bit;
+      if best[mask ^ bit] > top:
+        top = best[mask ^ bit];
+    best[mask] = top + (sums[mask] == 0);
+  
+  # 最大値を保ったまま1人ずつ外していき、合計0になった所でグループを区切る
+  groups = [];
+  current = [];
+  mask = full;
+  while mask:
+    gain = sums[mask] == 0;
+    rest = mask;
+    while rest:
+      bit = rest & -rest;
+      rest ^= bit;
+      if best[mask ^ bit] + gain == best[mask]:
+        break;
+    current.append(members[bit.bit_length() - 1]);
+    mask ^= bit;
+    if sums[mask] == 0:
+      groups.append(current);
+      current = [];
+  return groups;
+
+def plan_transfers(net: Dict[Hashable, int], exact_limit: int = EXACT_LIMIT) -> List[Tuple[Hashable, Hashable, int]]:
+  """
+  純額を精算する送金の一覧を求める
+  同額で逆向きの2人は先に直接組み合わせ、残りが少なければ厳密解、多ければ貪欲法で求める
+  
+  Args:
+    net: {user: 純額}（合計は0）
+    exact_limit: 厳密解を求める最大人数
+  
+  Returns:
+    List[Tuple[Hashable, Hashable, int]]: [(creditor, debtor, amount)]（debtorがcreditorにamount払う）
+  
+  Raises:
+    ValueError: 純額の合計が0でない場合
+  """
+  if sum(net.values()) != 0:
+    raise ValueError("純額の合計が0になっていない");
+  
+  # 同額で逆向きの2人は1回の送金で済む（最適解を崩さない）
+  transfers = [];
+  waiting = {};  # {純額: [user]} 相手待ちの人
+  rest = [];
+  for user, amount in net.items():
+    if not amount:
+      continue;
+    partners = waiting.get(-amount);
+    if partners:
+      partner = partners.pop();
+      transfers.append((user, partner, amount) if amount > 0 else (partner, user, -amount));
+    else:
+      waiting.setdefault(amount, []).append(user);
+  for amount, users in waiting.items():
+    rest.extend((user, amount) for user in users);
+  
+  if len(rest) <= exact_limit:
+    for group in _zero_sum_groups(rest):
+      transfers.extend(_settle_greedy(group));
+  else:
+    transfers.extend(_settle_greedy(rest));
+  return transfers;
+
+def benchmark(participant_counts: List[int], edges_per_user: int = 10, seed: int = 0):
+  """
+  ランダムな貸し借りのグラフで精算の速さと送金回数を測る
+  
+  Args:
+    participant_counts: 試す人数の一覧
+    edges_per_user: 1人あたりの貸し借りの件数
+    seed: 乱数のシード
+  """
+  rng = random.Random(seed);
+  for count in participant_counts:
+    debts = {};
+    edges = count * edges_per_user;
+    for _ in range(edges):
+      creditor, debtor = rng.sample(range(count), 2);
+      debts.setdefault(creditor, {})[debtor] = debts.get(creditor, {}).get(debtor, 0) + rng.randint(1, 100) * 100;
+    pairs = sum(len(debtors) for debtors in debts.values());
+    
+    start = time.perf_counter();
+    net = net_positions(debts);
+    transfers = plan_transfers(net);
+    seconds = time.perf_counter() - start;
+    
+    # 送金後に全員の純額が0になることを確かめる
+    check = dict(net);
+    for creditor, debtor, amount in transfers:
+      check[creditor] -= amount;
+      check[debtor] += amount;
+    assert not any(check.values()), "精算後に残高が残っている";
+    
+    print(f"{count:>6}人 貸し借り{pairs:>8,}件 -> 送金{len(transfers):>6,}回 {seconds * 1000:8.1f} ms");
+
+if __name__ == '__main__':
+  counts = [int(arg) for arg in sys.argv[1:]] or [10, 100, 500, 2000];
+  benchmark(counts);
@@ -0,0 +1,150 @@
+"""
+snapshot.py - バイナリスナップショットモジュール
+
+残高などの小さい状態と大きい履歴を別セクションに分けて保存し、
+起動時は状態セクションだけを読めば済むようにする
+
+ファイル形式:
+  ヘッダー（固定長）: マジック(8) 状態セクション長(8) 履歴セクション長(8) 履歴件数(8)
+  状態セクション: 履歴以外のデータ（コンパクトなJSON）
+  履歴セクション: 履歴のリスト（コンパクトなJSON）
+
+使い方（debts.jsonからの変換）:
+  python -m utils.snapshot data/debts.json data/debts.snap
+"""
+import json;
+import os;
+import struct;
+import sys;
+import threading;
+import time;
+from typing import Dict, List, Optional;
+
+MAGIC = b"FSKSNAP\x01";
+HEADER = struct.Struct("<8sQQQ");
+
+def _encode(obj) -> bytes:
+  """
+  オブジェクトをコンパクトなJSONバイト列にする
+  
+  Args:
+    obj: 対象
+  
+  Returns:
+    bytes: UTF-8のJSON
+  """
+  return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8');
+
+def write_snapshot(path: str, data: Dict):
+  """
+  データをスナップショットファイルに書き出す（一時ファイル経由で置き換える）
+  
+  Args:
+    path: 出力先
+    data: DebtDatabaseのデータ
+  """
+  state = {key: value for key, value in data.items() if key != "history"};
+  state_bytes = _encode(state);
+  history_bytes = _encode(data["history"]);
+  tmp_path = path + '.tmp';
+  with open(tmp_path, 'wb') as f:
+    f.write(HEADER.pack(MAGIC, len(state_bytes), len(history_bytes), len(data["history"])));
+    f.write(state_bytes);
+    f.write(history_bytes);
+  os.replace(tmp_path, path);
+
+class SnapshotReader:
+  """
+  スナップショット読み込みクラス
+  状態セクションだけを先に読み、履歴セクションは必要になってから読む
+  開いたファイルを保持するので、途中でファイルが置き換えられても同じ内容を読める
+  """
+  
+  def __init__(self, path: str):
+    """
+    ヘッダーを読んでファイルを開いたままにする
+    
+    Args:
+      path: スナップショットのパス
+    
+    Raises:
+      ValueError: スナップショット形式でない場合
+    """
+    self._file = open(path, 'rb');
+    header = self._file.read(HEADER.size);
+    if len(header) != HEADER.size:
+      self._file.close();
+      raise ValueError("スナップショットのヘッダーが短すぎる");
+    magic, self.state_length, self.history_length, self.history_count = HEADER.unpack(header);
+    if magic != MAGIC:
+      self._file.close();
+      raise ValueError("スナップショット形式ではない");
+    # 起動後の先読みスレッドと同期読み込みが重なっても1回だけ読む
+    self._lock = threading.Lock();
+    self._history = None;
+  
+  def read_state(self) -> Dict:
+    """
+    状態セクション（履歴以外）を読む
+    
+    Returns:
+      Dict: 履歴以外のデータ
+    """
+    self._file.seek(HEADER.size);
+    return json.loads(self._file.read(self.state_length));
+  
+  def read_history(self) -> List[Dict]:
+    """
+    履歴セクションを読んでファイルを閉じる（2回目以降は同じリストを返す）
+    
+    Returns:
+      List[Dict]: 履歴
+    """
+    with self._lock:
+      if self._history is None:
+        self._file.seek(HEADER.size + self.state_length);
+        self._history = json.loads(self._file.read(self.history_length));
+        self.close();
+      return self._history;
+  
+  def close(self):
+    """
+    ファイルを閉じる
+    """
+    if not self._file.closed:
+      self._file.close();
+
+def convert(json_path: str, snapshot_path: Optional[str] = None):
+  """
+  既存のdebts.jsonをスナップショット形式に変換し、読み込み時間を比べる
+  
+  Args:
+    json_path: 変換元のdebts.json
+    snapshot_path: 出力先（省略時は拡張子を.snapにしたもの）
+  """
+  snapshot_path = snapshot_path or os.path.splitext(json_path)[0] + '.snap';
+  
+  start = time.perf_counter();
+  with open(json_path, 'r', encoding='utf-8') as f:
+    data = json.load(f);
+  json_seconds = time.perf_counter() - start;
+  
+  write_snapshot(snapshot_path, data);
+  
+  start = time.perf_counter();
+  reader = SnapshotReader(snapshot_path);
+  reader.read_state();
+  state_seconds = time.perf_counter() - start;
+  reader.read_history();
+  full_seconds = time.perf_counter() - start;
+  
+  print(f"{json_path} ({os.path.getsize(json_path):,} bytes) -> {snapshot_path} ({os.path.getsize(snapshot_path):,} bytes)");
+  print(f"履歴 {len(data['history']):,} 件");
+  print(f"JSON全体の読み込み: {json_seconds * 1000:.1f} ms");
+  print(f"スナップショット 状態のみ: {state_seconds * 1000:.1f} ms / 履歴込み: {full_seconds * 1000:.1f} ms");
+
+if __name__ == '__main__':
+  if len(sys.argv) not in (2, 3):
+    print("使い方: python -m utils.snapshot <debts.json> [出力先.snap]");
+    sys.exit(1);
+  convert(*sys.argv[1:]);
@@ -0,0 +1,32 @@
+"""
+split.py - 割り勘計算モジュール
+
+金額を比率に応じて1円単位で分ける
+"""
+from typing import List;
+
+def split_amount(amount: int, weights: List[int]) -> List[int]:
+  """
+  金額を比率で分ける（最大剰余法）
+  切り捨てで余った分は端数の大きい人から1円ずつ足し、端数が同じなら前の人を優先する
+  
+  Args:
+    amount: 分ける金額
+    weights: 各人の比率（1以上の整数）
+  
+  Returns:
+    List[int]: 各人の負担額（合計はamountに一致する）
+  
+  Raises:
+    ValueError: 比率が空または1未満を含む場合
+  """
+  if not weights or any(weight < 1 for weight in weights):
+    raise ValueError("比率は1以上の整数で指定してくれ");
+  total_weight = sum(weights);
+  shares = [amount * weight // total_weight for weight in weights];
+  remainders = [amount * weight % total_weight for weight in weights];
+  left = amount - sum(shares);
+  order = sorted(range(len(weights)), key=lambda i: (-remainders[i], i));
+  for i in order[:left]:
+    shares[i] += 1;
+  return shares;
@@ -0,0 +1,1096 @@
+"""
+sqlite_database.py - SQLiteデータベース操作モジュール
+
+DebtDatabaseと同じインターフェースで借金データをSQLiteに保存する
+全データをメモリに載せず、インデックスを使って必要な行だけを読む
+"""
+import asyncio;
+import json;
+import os;
+import sqlite3;
+import threading;
+from contextlib import contextmanager;
+from typing import Dict, Iterator, List, Optional, Tuple;
+from datetime import datetime;
+from config import Config;
+from utils.checkpoints import apply_record, pair_delta, touched_pairs;
+from utils.database import BatchResult;
+from utils.ledger_version import LEADERBOARD_SIDES;
+from utils.metrics import STORAGE_SAVE_SECONDS;
+from utils.ranking import ranked_page;
+from utils.records import HistoryRecord, action_code, from_epoch, to_epoch;
+from utils.settlement import plan_transfers, transfers_net;
+
+# テーブル定義
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS debts (
+  creditor INTEGER NOT NULL,
+  debtor INTEGER NOT NULL,
+  amount INTEGER NOT NULL,
+  PRIMARY KEY (creditor, debtor)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_debts_debtor ON debts (debtor, creditor);
+
+CREATE TABLE IF NOT EXISTS history (
+  id INTEGER PRIMARY KEY,
+  action TEXT NOT NULL,
+  creditor INTEGER NOT NULL,
+  debtor INTEGER NOT NULL,
+  amount INTEGER NOT NULL,
+  description TEXT NOT NULL DEFAULT '',
+  timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_creditor ON history (creditor, id);
+CREATE INDEX IF NOT EXISTS idx_history_debtor ON history (debtor, id);
+CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp);
+
+CREATE TABLE IF NOT EXISTS user_settings (
+  user_id INTEGER PRIMARY KEY,
+  transfer_enabled INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS log_channels (
+  guild_id INTEGER PRIMARY KEY,
+  channel_id INTEGER NOT NULL
+);
+
+-- サマリー用の集計。debtsへの変更をトリガーで差分反映する
+CREATE TABLE IF NOT EXISTS user_totals (
+  user_id INTEGER PRIMARY KEY,
+  lent INTEGER NOT NULL DEFAULT 0,
+  borrowed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_user_totals_lent ON user_totals (lent) WHERE lent > 0;
+CREATE INDEX IF NOT EXISTS idx_user_totals_borrowed ON user_totals (borrowed) WHERE borrowed > 0;
+
+CREATE TABLE IF NOT EXISTS ledger_stats (
+  id INTEGER PRIMARY KEY CHECK (id = 0),
+  total_amount INTEGER NOT NULL,
+  participants INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO ledger_stats (id, total_amount, participants) VALUES (0, 0, 0);
+
+CREATE TRIGGER IF NOT EXISTS trg_debts_insert AFTER INSERT ON debts BEGIN
+  INSERT INTO user_totals (user_id, lent) VALUES (NEW.creditor, NEW.amount)
+    ON CONFLICT (user_id) DO UPDATE SET lent = lent + NEW.amount;
+  INSERT INTO user_totals (user_id, borrowed) VALUES (NEW.debtor, NEW.amount)
+    ON CONFLICT (user_id) DO UPDATE SET borrowed = borrowed + NEW.amount;
+  UPDATE ledger_stats SET total_amount = total_amount + NEW.amount;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_debts_update AFTER UPDATE OF amount ON debts BEGIN
+  UPDATE user_totals SET lent = lent + NEW.amount - OLD.amount WHERE user_id = NEW.creditor;
+  UPDATE user_totals SET borrowed = borrowed + NEW.amount - OLD.amount WHERE user_id = NEW.debtor;
+  UPDATE ledger_stats SET total_amount = total_amount + NEW.amount - OLD.amount;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_debts_delete AFTER DELETE ON debts BEGIN
+  UPDATE user_totals SET lent = lent - OLD.amount WHERE user_id = OLD.creditor;
+  UPDATE user_totals SET borrowed = borrowed - OLD.amount WHERE user_id = OLD.debtor;
+  UPDATE ledger_stats SET total_amount = total_amount - OLD.amount;
+END;
+
+-- 貸し借りが両方0になったユーザーは関係者から外す
+CREATE TRIGGER IF NOT EXISTS trg_user_totals_cleanup AFTER UPDATE ON user_totals
+WHEN NEW.lent = 0 AND NEW.borrowed = 0 BEGIN
+  DELETE FROM user_totals WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_user_totals_insert AFTER INSERT ON user_totals BEGIN
+  UPDATE ledger_stats SET participants = participants + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_user_totals_delete AFTER DELETE ON user_totals BEGIN
+  UPDATE ledger_stats SET participants = participants - 1;
+END;
+
+-- 残高のチェックポイント（seqは適用済みの最後の履歴のid、timestampはその履歴の日時）
+CREATE TABLE IF NOT EXISTS checkpoints (
+  seq INTEGER PRIMARY KEY,
+  timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_checkpoints_timestamp ON checkpoints (timestamp);
+
+-- 前のチェックポイントから変わった組の、チェックポイントの時点の債権額（0も記録する）
+CREATE TABLE IF NOT EXISTS checkpoint_debts (
+  creditor INTEGER NOT NULL,
+  debtor INTEGER NOT NULL,
+  seq INTEGER NOT NULL,
+  amount INTEGER NOT NULL,
+  PRIMARY KEY (creditor, debtor, seq)
+) WITHOUT ROWID;
+
+-- チェックポイントを作ったか（行があれば作成済み）と、最初のチェックポイントより前も空の状態から再生できるか
+CREATE TABLE IF NOT EXISTS checkpoint_state (
+  id INTEGER PRIMARY KEY CHECK (id = 0),
+  origin INTEGER NOT NULL
+);
+""";
+
+class SQLiteDebtDatabase:
+  """
+  SQLite版借金データベースクラス
+  公開メソッドはDebtDatabaseと同じシグネチャを持つ
+  """
+  
+  # 読み取りは書き込みと同じ接続で行うので、変更の適用中は終わるまで待つ（版から読むのは書き出しと集計だけ）
+  READS_FROM_VERSIONS = False;
+  
+  def __init__(self, data_dir: Optional[str] = None):
+    """
+    データベースを初期化する
+    新規作成時に既存のJSONファイルがあれば取り込む
+    
+    Args:
+      data_dir: データを置くディレクトリ（省略時はConfig.DATA_DIR、サーバーごとに分ける場合はシャードのディレクトリ）
+    """
+    self.data_dir = data_dir or Config.DATA_DIR;
+    self.db_path = os.path.join(self.data_dir, os.path.basename(Config.SQLITE_PATH));
+    json_path = os.path.join(self.data_dir, os.path.basename(Config.DB_PATH));
+    directory = os.path.dirname(self.db_path);
+    if directory:
+      os.makedirs(directory, exist_ok=True);
+    is_new = not os.path.exists(self.db_path);
+    # トランザクションは_transactionで明示的に管理する
+    self._transaction_depth = 0;
+    # 変更の適用と書き込み用の接続での読み取りを重ねないためのロック（state_lockで初めて使うときに作る）
+    self._state_lock = None;
+    # 集計用の列形式の履歴（history_frameで初めて使うときに作る。スレッドから更新するのでロックで守る）
+    self._columns = None;
+    self._columns_lock = threading.Lock();
+    self.conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False);
+    self.conn.execute("PRAGMA journal_mode=WAL");
+    self.conn.execute("PRAGMA synchronous=NORMAL");
+    has_totals = self._table_exists("user_totals");
+    self.conn.executescript(SCHEMA);
+    # 残高のチェックポイントを作成済みか（時点指定の照会で初めて使うときに作る）
+    self._checkpoints_ready = self.conn.execute("SELECT 1 FROM checkpoint_state").fetchone() is not None;
+    if is_new and os.path.exists(json_path):
+      self._migrate_from_json(json_path);
+    elif not has_totals:
+      self._backfill_totals();
+  
+  def _table_exists(self, name: str) -> bool:
+    """
+    テーブルが存在するか確認する
+    
+    Args:
+      name: テーブル名
+    
+    Returns:
+      bool: 存在する場合True
+    """
+    row = self.conn.execute(
+      "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone();
+    return row is not None;
+  
+  def _backfill_totals(self):
+    """
+    集計テーブルがなかった既存データベース向けに、debtsから集計を作る
+    """
+    with self._transaction() as conn:
+      conn.execute(
+        "INSERT INTO user_totals (user_id, lent, borrowed) "
+        "SELECT user_id, SUM(lent), SUM(borrowed) FROM ("
+        "  SELECT creditor AS user_id, amount AS lent, 0 AS borrowed FROM debts"
+        "  UNION ALL SELECT debtor, 0, amount FROM debts"
+        ") GROUP BY user_id"
+      );
+      conn.execute("UPDATE ledger_stats SET total_amount = (SELECT COALESCE(SUM(amount), 0) FROM debts)");
+  
+  @contextmanager
+  def _transaction(self) -> Iterator[sqlite3.Connection]:
+    """
+    書き込みトランザクションを張る（入れ子の場合はセーブポイント）
+    例外が出た場合はロールバックする
+    
+    Yields:
+      sqlite3.Connection: コネクション
+    """
+    # batch()の中など、既にトランザクション中ならセーブポイントにする
+    depth = self._transaction_depth;
+    savepoint = f"sp{depth}";
+    self.conn.execute("BEGIN IMMEDIATE" if depth == 0 else f"SAVEPOINT {savepoint}");
+    self._transaction_depth += 1;
+    try:
+      yield self.conn;
+      if depth == 0:
+        self._checkpoint_if_due(self.conn);
+    except Exception:
+      if depth == 0:
+        self.conn.execute("ROLLBACK");
+      else:
+        self.conn.execute(f"ROLLBACK TO {savepoint}");
+        self.conn.execute(f"RELEASE {savepoint}");
+      raise;
+    else:
+      if depth == 0:
+        with STORAGE_SAVE_SECONDS.time(kind="sqlite"):
+          self.conn.execute("COMMIT");
+      else:
+        self.conn.execute(f"RELEASE {savepoint}");
+    finally:
+      self._transaction_depth -= 1;
+  
+  def _migrate_from_json(self, json_path: str):
+    """
+    既存のJSONデータをSQLiteに取り込む
+    
+    Args:
+      json_path: debts.jsonのパス
+    """
+    try:
+      with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f);
+    except Exception as e:
+      print(f"JSONデータ移行エラー: {e}");
+      return;
+    
+    with self._transaction() as conn:
+      conn.executemany(
+        "INSERT INTO debts (creditor, debtor, amount) VALUES (?, ?, ?)",
+        (
+          (int(creditor), int(debtor), amount)
+          for creditor, debtors in data.get("debts", {}).items()
+          for debtor, amount in debtors.items()
+        )
+      );
+      conn.executemany(
+        "INSERT INTO history (action, creditor, debtor, amount, description, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+          (h["action"], int(h["creditor"]), int(h["debtor"]), h["amount"], h.get("description", ""), h["timestamp"])
+          for h in data.get("history", [])
+        )
+      );
+      conn.executemany(
+        "INSERT INTO user_settings (user_id, transfer_enabled) VALUES (?, ?)",
+        (
+          (int(user), int(bool(settings.get("transfer_enabled", False))))
+          for user, settings in data.get("user_settings", {}).items()
+        )
+      );
+      conn.executemany(
+        "INSERT INTO log_channels (guild_id, channel_id) VALUES (?, ?)",
+        ((int(guild), channel) for guild, channel in data.get("log_channels", {}).items())
+      );
+    print(f"{json_path}をSQLiteに移行した");
+  
+  def _set_debt(self, conn: sqlite3.Connection, creditor_id: int, debtor_id: int, amount: int):
+    """
+    債権額を設定する（0の場合は削除する）
+    
+    Args:
+      conn: トランザクション中のコネクション
+      creditor_id: 債権者ID
+      debtor_id: 債務者ID
+      amount: 設定後の債権額
+    """
+    if amount == 0:
+      conn.execute("DELETE FROM debts WHERE creditor = ? AND debtor = ?", (creditor_id, debtor_id));
+    else:
+      conn.execute(
+        "INSERT INTO debts (creditor, debtor, amount) VALUES (?, ?, ?) "
+        "ON CONFLICT (creditor, debtor) DO UPDATE SET amount = excluded.amount",
+        (creditor_id, debtor_id, amount)
+      );
+  
+  def _add_history(self, conn: sqlite3.Connection, action: str, creditor_id: int, debtor_id: int, amount: int, description: str):
+    """
+    履歴を追加する
+    
+    Args:
+      conn: トランザクション中のコネクション
+      action: アクション種別（add, pay, transfer, settle, settle_clear）
+      creditor_id: 債権者ID
+      debtor_id: 債務者ID
+      amount: 金額
+      description: 説明
+    """
+    conn.execute(
+      "INSERT INTO history (action, creditor, debtor, amount, description, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+      (action, creditor_id, debtor_id, amount, description, datetime.now().isoformat())
+    );
+  
+  @staticmethod
+  def _history_row_to_record(row: Tuple) -> HistoryRecord:
+    """
+    履歴の行をレコードに変換する
+    
+    Args:
+      row: (id, action, creditor, debtor, amount, description, timestamp)
+    
+    Returns:
+      HistoryRecord: レコード
+    """
+    return HistoryRecord(action_code(row[1]), row[2], row[3], row[4], row[5], to_epoch(datetime.fromisoformat(row[6])));
+  
+  @staticmethod
+  def _history_row_to_dict(row: Tuple) -> Dict:
+    """
+    履歴の行をJSON版と同じ形式の辞書に変換する
+    通し番号はJSON版と同じく0から数える（行のidは1から始まるので1を引く）
+    
+    Args:
+      row: (id, action, creditor, debtor, amount, description, timestamp)
+    
+    Returns:
+      Dict: 履歴
+    """
+    return {
+      "id": row[0] - 1,
+      "action": row[1],
+      "creditor": str(row[2]),
+      "debtor": str(row[3]),
+      "amount": row[4],
+      "description": row[5],
+      "timestamp": row[6]
+    };
+  
+  @contextmanager
+  def batch(self) -> Iterator[BatchResult]:
+    """
+    ブロック内の変更を1トランザクションにまとめる
+    ブロック内で例外が出た場合はロールバックして例外を投げ直す（入れ子の場合はセーブポイントまで）
+    
+    Yields:
+      BatchResult: ブロックを抜けた後、okにコミットの成否が入る
+    """
+    result = BatchResult();
+    with self._transaction():
+      yield result;
+    result.ok = True;
+  
+  def add_debt(self, creditor_id: int, debtor_id: int, amount: int, description: str = "") -> bool:
+    """
+    借金を追加する
+    
+    Args:
+      creditor_id: 債権者のID（お金を貸す人）
+      debtor_id: 債務者のID（お金を借りる人）
+      amount: 金額
+      description: 説明
+    
+    Returns:
+      bool: 追加成功時True
+    """
+    try:
+      with self._transaction() as conn:
+        self._add_debt(conn, creditor_id, debtor_id, amount, description);
+      return True;
+    except (sqlite3.Error, OverflowError) as e:
+      print(f"データ保存エラー: {e}");
+      return False;
+  
+  def _add_debt(self, conn: sqlite3.Connection, creditor_id: int, debtor_id: int, amount: int, description: str):
+    """
+    トランザクション内で借金を1件追加する（エラーはそのまま投げる）
+    
+    Args:
+      conn: トランザクション中の接続
+      creditor_id: 債権者ID
+      debtor_id: 債務者ID
+      amount: 金額
+      description: 説明
+    """
+    current_amount = self.get_debt(creditor_id, debtor_id);
+    self._set_debt(conn, creditor_id, debtor_id, current_amount + amount);
+    self._add_history(conn, "add", creditor_id, debtor_id, amount, description);
+  
+  def add_debts(self, entries: List[Tuple[int, int, int, str]]) -> bool:
+    """
+    複数の借金をまとめて追加する（1回の保存で全件反映、失敗時は1件も反映しない）
+    
+    Args:
+      entries: [(債権者ID, 債務者ID, 金額, 説明)]
+    
+    Returns:
+      bool: 追加成功時True
+    """
+    # 1件でも失敗したらトランザクション（入れ子ならセーブポイント）ごと取り消す
+    try:
+      with self._transaction() as conn:
+        for creditor_id, debtor_id, amount, description in entries:
+          self._add_debt(conn, creditor_id, debtor_id, amount, description);
+      return True;
+    except (sqlite3.Error, OverflowError) as e:
+      print(f"データ保存エラー: {e}");
+      return False;
+  
+  def pay_debt(self, creditor_id: int, debtor_id: int, amount: int, payer_id: Optional[int] = None) -> Tuple[bool, int]:
+    """
+    借金を返済する
+    
+    Args:
+      creditor_id: 債権者のID
+      debtor_id: 債務者のID
+      amount: 返済額
+      payer_id: 代理で返済する人のID（任意）
+    
+    Returns:
+      Tuple[bool, int]: (成功フラグ, 残りの借金額)
+    """
+    with self._transaction() as conn:
+      current_amount = self.get_debt(creditor_id, debtor_id);
+      if current_amount == 0:
+        return False, 0;
+      if amount > current_amount:
+        return False, current_amount;
+      
+      new_amount = current_amount - amount;
+      self._set_debt(conn, creditor_id, debtor_id, new_amount);
+      
+      # 履歴を追加（代理返済の場合はpayer_idを記録）
+      description = f"paid_by:{payer_id}" if payer_id and payer_id != debtor_id else "";
+      self._add_history(conn, "pay", creditor_id, debtor_id, amount, description);
+    return True, new_amount;
+  
+  def get_debt(self, creditor_id: int, debtor_id: int) -> int:
+    """
+    特定の債権額を取得する
+    
+    Args:
+      creditor_id: 債権者のID
+      debtor_id: 債務者のID
+    
+    Returns:
+      int: 債権額
+    """
+    row = self.conn.execute(
+      "SELECT amount FROM debts WHERE creditor = ? AND debtor = ?",
+      (creditor_id, debtor_id)
+    ).fetchone();
+    return row[0] if row else 0;
+  
+  def get_user_debts(self, user_id: int) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    ユーザーの借金一覧を取得する
+    
+    Args:
+      user_id: ユーザーID
+    
+    Returns:
+      Dict: {"creditor": [(debtor_id, amount)], "debtor": [(creditor_id, amount)]}
+    """
+    return {
+      "creditor": self.conn.execute(
+        "SELECT debtor, amount FROM debts WHERE creditor = ?", (user_id,)
+      ).fetchall(),
+      "debtor": self.conn.execute(
+        "SELECT creditor, amount FROM debts WHERE debtor = ?", (user_id,)
+      ).fetchall()
+    };
+  
+  def get_user_debts_page(self, user_id: int, offset: int = 0, limit: int = 15) -> Dict:
+    """
+    ユーザーの貸し借り一覧を1ページ分取得する（金額の大きい順、同額なら相手のIDの小さい順）
+    
+    Args:
+      user_id: ユーザーID
+      offset: 先頭から飛ばす件数（貸し・借りそれぞれ）
+      limit: 取得件数（貸し・借りそれぞれ）
+    
+    Returns:
+      Dict: {"creditor": [(debtor_id, amount)], "debtor": [(creditor_id, amount)],
+        "creditor_count": 貸している相手の数, "debtor_count": 借りている相手の数,
+        "lent": 貸している合計, "borrowed": 借りている合計}
+    """
+    creditor_count, = self.conn.execute("SELECT COUNT(*) FROM debts WHERE creditor = ?", (user_id,)).fetchone();
+    debtor_count, = self.conn.execute("SELECT COUNT(*) FROM debts WHERE debtor = ?", (user_id,)).fetchone();
+    totals = self.conn.execute("SELECT lent, borrowed FROM user_totals WHERE user_id = ?", (user_id,)).fetchone();
+    return {
+      "creditor": self.conn.execute(
+        "SELECT debtor, amount FROM debts WHERE creditor = ? ORDER BY amount DESC, debtor LIMIT ? OFFSET ?",
+        (user_id, limit, offset)
+      ).fetchall(),
+      "debtor": self.conn.execute(
+        "SELECT creditor, amount FROM debts WHERE debtor = ? ORDER BY amount DESC, creditor LIMIT ? OFFSET ?",
+        (user_id, limit, offset)
+      ).fetchall(),
+      "creditor_count": creditor_count,
+      "debtor_count": debtor_count,
+      "lent": totals[0] if totals else 0,
+      "borrowed": totals[1] if totals else 0
+    };
+  
+  def transfer_debt(self, creditor_id: int, debtor_id: int, new_creditor_id: int, amount: int) -> Tuple[bool, str, int]:
+    """
+    債権を譲渡する
+    
+    Args:
+      creditor_id: 元の債権者ID
+      debtor_id: 債務者ID
+      new_creditor_id: 新しい債権者ID
+      amount: 譲渡額
+    
+    Returns:
+      Tuple[bool, str, int]: (成功フラグ, エラーメッセージ, 残りの債権額)
+    """
+    with self._transaction() as conn:
+      # 債権の存在チェック
+      current_debt = self.get_debt(creditor_id, debtor_id);
+      if current_debt == 0:
+        return False, f"債権がないぞ！", 0;
+      
+      # 譲渡額のチェック
+      if amount > current_debt:
+        return False, f"債権は{current_debt}円しかないぞ！", current_debt;
+      
+      if amount <= 0:
+        return False, "金額は1円以上を指定してくれ", current_debt;
+      
+      remaining = current_debt - amount;
+      self._set_debt(conn, creditor_id, debtor_id, remaining);
+      
+      # 新しい債権者に債権を追加
+      current_new_debt = self.get_debt(new_creditor_id, debtor_id);
+      self._set_debt(conn, new_creditor_id, debtor_id, current_new_debt + amount);
+      
+      self._add_history(conn, "transfer", creditor_id, debtor_id, amount, f"to:{new_creditor_id}");
+    return True, "", remaining;
+  
+  def _net_positions(self) -> Dict[int, int]:
+    """
+    各ユーザーの純額（貸している総額 - 借りている総額）を集計テーブルから求める
+    
+    Returns:
+      Dict[int, int]: {user_id: 純額}（0のユーザーは含めない）
+    """
+    return dict(self.conn.execute(
+      "SELECT user_id, lent - borrowed FROM user_totals WHERE lent != borrowed"
+    ).fetchall());
+  
+  def plan_settlement(self) -> List[Tuple[int, int, int]]:
+    """
+    全員の貸し借りを最小限の送金にまとめた精算案を求める（データは変更しない）
+    
+    Returns:
+      List[Tuple[int, int, int]]: [(債権者ID, 債務者ID, 金額)]
+    """
+    return plan_transfers(self._net_positions());
+  
+  def apply_settlement(self, plan: List[Tuple[int, int, int]]) -> Tuple[bool, str]:
+    """
+    精算案の通りに貸し借りを書き換える（1トランザクションで反映する）
+    
+    Args:
+      plan: plan_settlementで求めた精算案
+    
+    Returns:
+      Tuple[bool, str]: (成功フラグ, エラーメッセージ)
+    """
+    if any(amount <= 0 or creditor == debtor for creditor, debtor, amount in plan):
+      return False, "精算案が正しくない";
+    
+    with self._transaction() as conn:
+      # 精算案を出した後に貸し借りが変わっていたら反映しない
+      if transfers_net(plan) != self._net_positions():
+        return False, "精算案を出した後に貸し借りが変わった。もう一度確認してくれ";
+      
+      new_debts = {};
+      for creditor, debtor, amount in plan:
+        new_debts[(creditor, debtor)] = new_debts.get((creditor, debtor), 0) + amount;
+      
+      # 精算案にそのまま残る債権以外を消してから、新しい債権を設定する
+      for creditor, debtor, amount in conn.execute("SELECT creditor, debtor, amount FROM debts").fetchall():
+        if new_debts.get((creditor, debtor)) == amount:
+          del new_debts[(creditor, debtor)];
+          continue;
+        self._set_debt(conn, creditor, debtor, 0);
+        self._add_history(conn, "settle_clear", creditor, debtor, amount, "精算");
+      for (creditor, debtor), amount in new_debts.items():
+        self._set_debt(conn, creditor, debtor, amount);
+        self._add_history(conn, "settle", creditor, debtor, amount, "精算");
+    return True, "";
+  
+  def current_version(self) -> "SQLiteLedgerVersion":
+    """
+    今の時点の読み取り専用の版を開く（使い終わったらcloseする）
+    
+    Returns:
+      SQLiteLedgerVersion: 版
+    """
+    return SQLiteLedgerVersion(self.db_path);
+  
+  def iter_debts(self) -> Iterator[Tuple[int, int, int]]:
+    """
+    全ての債権を順に返す（書き出し用、カーソルで少しずつ読む）
+    
+    Yields:
+      Tuple[int, int, int]: (債権者ID, 債務者ID, 金額)
+    """
+    yield from self.conn.execute("SELECT creditor, debtor, amount FROM debts ORDER BY creditor, debtor");
+  
+  def iter_history(self) -> Iterator[Dict]:
+    """
+    全ての履歴を古い順に返す（書き出し用、カーソルで少しずつ読む）
+    
+    Yields:
+      Dict: 履歴（通し番号 "id" 付き）
+    """
+    cursor = self.conn.execute(
+      "SELECT id, action, creditor, debtor, amount, description, timestamp FROM history ORDER BY id"
+    );
+    for row in cursor:
+      yield self._history_row_to_dict(row);
+  
+  def history_frame(self, version: "SQLiteLedgerVersion"):
+    """
+    集計用の列形式の履歴を版の時点まで更新し、複製を返す
+    前回取り込んだ行より後（idが大きい行）だけを版の接続で読んで列に追加する。スレッドから呼んでよい
+    コミット済みの行しか読まないので、取り消された行が列に入ることはない
+    
+    Args:
+      version: current_versionで開いた版
+    
+    Returns:
+      HistoryFrame: 列の複製
+    """
+    # 集計を使うときだけインポートする（numpyがあれば読み込まれるため）
+    from utils.analytics import HistoryColumns;
+    with self._columns_lock:
+      if self._columns is None:
+        self._columns = HistoryColumns();
+      columns = self._columns;
+      cursor = version.conn.execute(
+        "SELECT id, action, creditor, debtor, amount, timestamp FROM history WHERE id >= ? ORDER BY id",
+        (columns.position,)
+      );
+      # 初回は全履歴を読むので、一定の行数ずつ列に移す
+      while True:
+        rows = cursor.fetchmany(10000);
+        if not rows:
+          break;
+        records = [
+          HistoryRecord(action_code(action), creditor, debtor, amount, "", to_epoch(datetime.fromisoformat(timestamp)))
+          for _, action, creditor, debtor, amount, timestamp in rows
+        ];
+        columns.extend(records, rows[-1][0] + 1);
+      return columns.frame();
+  
+  def _checkpoint_if_due(self, conn: sqlite3.Connection):
+    """
+    前のチェックポイントから履歴がCHECKPOINT_INTERVAL件以上増えていれば、
+    その間に変わった組の今の債権額をチェックポイントとして保存する
+    コミットの直前に呼ぶので、チェックポイントは履歴と同じトランザクションで保存される
+    
+    Args:
+      conn: トランザクション中のコネクション
+    """
+    if Config.CHECKPOINT_INTERVAL <= 0 or not self._checkpoints_ready:
+      return;
+    top = conn.execute("SELECT MAX(id) FROM history").fetchone()[0];
+    last = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM checkpoints").fetchone()[0];
+    if top is None or top - last < Config.CHECKPOINT_INTERVAL:
+      return;
+    conn.execute("INSERT INTO checkpoints (seq, timestamp) SELECT id, timestamp FROM history WHERE id = ?", (top,));
+    # 譲渡では説明の "to:<ID>" の相手の債権も変わる
+    conn.execute(
+      "INSERT INTO checkpoint_debts (creditor, debtor, seq, amount) "
+      "SELECT pairs.creditor, pairs.debtor, ?, COALESCE(debts.amount, 0) FROM ("
+      "  SELECT creditor, debtor FROM history WHERE id > ? AND id <= ?"
+      "  UNION SELECT CAST(substr(description, 4) AS INTEGER), debtor FROM history"
+      "  WHERE id > ? AND id <= ? AND action = 'transfer' AND description LIKE 'to:%'"
+      ") AS pairs LEFT JOIN debts ON debts.creditor = pairs.creditor AND debts.debtor = pairs.debtor",
+      (top, last, top, last, top)
+    );
+  
+  def _build_checkpoints(self):
+    """
+    全履歴を空の状態から再生し、CHECKPOINT_INTERVAL件ごとにチェックポイントを作る
+    再生した結果が今の債権と一致しない場合（履歴を記録する前からの債権がある場合）は、
+    今の債権全体を最初のチェックポイントにし、それより前の日時は求められないものとする
+    """
+    interval = Config.CHECKPOINT_INTERVAL;
+    with self._transaction() as conn:
+      conn.execute("DELETE FROM checkpoint_debts");
+      conn.execute("DELETE FROM checkpoints");
+      debts = {};
+      pairs = set();
+      count = 0;
+      last_id = 0;
+      last_timestamp = None;
+      cursor = conn.execute("SELECT id, action, creditor, debtor, amount, description, timestamp FROM history ORDER BY id");
+      while True:
+        rows = cursor.fetchmany(10000);
+        if not rows:
+          break;
+        for row in rows:
+          record = self._history_row_to_record(row);
+          apply_record(debts, record);
+          pairs.update(touched_pairs(record));
+          count += 1;
+          last_id = row[0];
+          last_timestamp = row[6];
+          if interval > 0 and count % interval == 0:
+            conn.execute("INSERT INTO checkpoints (seq, timestamp) VALUES (?, ?)", (last_id, last_timestamp));
+            conn.executemany(
+              "INSERT INTO checkpoint_debts (creditor, debtor, seq, amount) VALUES (?, ?, ?, ?)",
+              ((creditor, debtor, last_id, debts.get(creditor, {}).get(debtor, 0)) for creditor, debtor in pairs)
+            );
+            pairs = set();
+      
+      current = {};
+      for creditor, debtor, amount in conn.execute("SELECT creditor, debtor, amount FROM debts"):
+        current.setdefault(creditor, {})[debtor] = amount;
+      origin = debts == current;
+      if not origin:
+        print("履歴から今の債権を再現できないため、今の時点からチェックポイントを作る");
+        conn.execute("DELETE FROM checkpoint_debts");
+        conn.execute("DELETE FROM checkpoints");
+        conn.execute(
+          "INSERT INTO checkpoints (seq, timestamp) VALUES (?, ?)",
+          (last_id, last_timestamp or datetime.now().isoformat())
+        );
+        conn.execute("INSERT INTO checkpoint_debts (creditor, debtor, seq, amount) SELECT creditor, debtor, ?, amount FROM debts", (last_id,));
+      conn.execute("INSERT OR REPLACE INTO checkpoint_state (id, origin) VALUES (0, ?)", (int(origin),));
+    self._checkpoints_ready = True;
+  
+  def get_debt_at(self, creditor_id: int, debtor_id: int, when: datetime) -> Optional[int]:
+    """
+    指定した日時の時点の債権額を求める
+    直前のチェックポイントから、その日時までの履歴を再生する（再生する件数はチェックポイントの間隔まで）
+    
+    Args:
+      creditor_id: 債権者のID
+      debtor_id: 債務者のID
+      when: 日時（タイムゾーンなしの場合は現地時刻）
+    
+    Returns:
+      Optional[int]: 債権額（記録を始める前の日時で求められない場合None）
+    """
+    if not self._checkpoints_ready:
+      self._build_checkpoints();
+    # 履歴と同じ形式（タイムゾーンなしの現地時刻のISO文字列）で比べる
+    at = from_epoch(to_epoch(when)).isoformat();
+    row = self.conn.execute(
+      "SELECT seq FROM checkpoints WHERE timestamp <= ? ORDER BY timestamp DESC, seq DESC LIMIT 1", (at,)
+    ).fetchone();
+    if row is not None:
+      seq = row[0];
+      # その組が最後に記録されたチェックポイントの値
+      found = self.conn.execute(
+        "SELECT amount FROM checkpoint_debts WHERE creditor = ? AND debtor = ? AND seq <= ? ORDER BY seq DESC LIMIT 1",
+        (creditor_id, debtor_id, seq)
+      ).fetchone();
+      amount = found[0] if found else 0;
+    elif self.conn.execute("SELECT origin FROM checkpoint_state").fetchone()[0]:
+      seq = 0;
+      amount = 0;
+    else:
+      return None;
+    
+    # 次のチェックポイントまでの、債務者が同じ履歴だけを読む
+    end = self.conn.execute("SELECT MIN(seq) FROM checkpoints WHERE seq > ?", (seq,)).fetchone()[0];
+    cursor = self.conn.execute(
+      "SELECT id, action, creditor, debtor, amount, description, timestamp FROM history "
+      "WHERE debtor = ? AND id > ? AND id <= COALESCE(?, id) AND timestamp <= ? ORDER BY id",
+      (debtor_id, seq, end, at)
+    );
+    for history_row in cursor:
+      amount += pair_delta(self._history_row_to_record(history_row), creditor_id, debtor_id);
+    return amount;
+  
+  def get_history(self, user_id: Optional[int] = None, limit: int = 10, before: Optional[int] = None) -> List[Dict]:
+    """
+    履歴を取得する
+    
+    Args:
+      user_id: ユーザーID（指定時はそのユーザーの履歴のみ）
+      limit: 取得件数
+      before: この通し番号より前の履歴を取得する（指定なしで最新から）
+    
+    Returns:
+      List[Dict]: 履歴のリスト（古い順、各履歴に通し番号 "id" を付ける）
+    """
+    return self.get_history_page(user_id, limit, before)[0];
+  
+  def get_history_page(self, user_id: Optional[int] = None, limit: int = 10, before: Optional[int] = None) -> Tuple[List[Dict], Optional[int]]:
+    """
+    履歴を1ページ分取得する
+    idのインデックスを逆順にたどるキーセット方式なので、ページの深さに関係なく一定コスト
+    
+    Args:
+      user_id: ユーザーID（指定時はそのユーザーの履歴のみ）
+      limit: 取得件数
+      before: この通し番号より前の履歴を取得する（指定なしで最新から）
+    
+    Returns:
+      Tuple[List[Dict], Optional[int]]: (履歴のリスト（古い順）, 次のページのbefore。これより古い履歴がなければNone)
+    """
+    columns = "id, action, creditor, debtor, amount, description, timestamp";
+    # 続きがあるか判定するため1件多く取る
+    fetch = limit + 1;
+    # before未指定時はidの最大値を上限にして、常にインデックスの範囲検索にする（通し番号は行のidより1小さい）
+    cursor = before + 1 if before is not None else 2 ** 63 - 1;
+    if user_id:
+      # 債権者側と債務者側のインデックスをそれぞれ使い、新しい順にfetch件ずつ取って合わせる
+      rows = self.conn.execute(
+        f"SELECT * FROM ("
+        f"  SELECT {columns} FROM history WHERE creditor = ? AND id < ? ORDER BY id DESC LIMIT ?"
+        f") UNION SELECT * FROM ("
+        f"  SELECT {columns} FROM history WHERE debtor = ? AND id < ? ORDER BY id DESC LIMIT ?"
+        f") ORDER BY id DESC LIMIT ?",
+        (user_id, cursor, fetch, user_id, cursor, fetch, fetch)
+      ).fetchall();
+    else:
+      rows = self.conn.execute(
+        f"SELECT {columns} FROM history WHERE id < ? ORDER BY id DESC LIMIT ?",
+        (cursor, fetch)
+      ).fetchall();
+    
+    has_more = len(rows) > limit;
+    entries = [self._history_row_to_dict(row) for row in reversed(rows[:limit])];
+    next_before = entries[0]["id"] if has_more and entries else None;
+    return entries, next_before;
+  
+  def set_log_channel(self, guild_id: int, channel_id: int) -> bool:
+    """
+    ログチャンネルを設定する
+    
+    Args:
+      guild_id: サーバーID
+      channel_id: チャンネルID
+    
+    Returns:
+      bool: 設定成功時True
+    """
+    try:
+      with self._transaction() as conn:
+        conn.execute(
+          "INSERT INTO log_channels (guild_id, channel_id) VALUES (?, ?) "
+          "ON CONFLICT (guild_id) DO UPDATE SET channel_id = excluded.channel_id",
+          (guild_id, channel_id)
+        );
+      return True;
+    except sqlite3.Error as e:
+      print(f"データ保存エラー: {e}");
+      return False;
+  
+  def get_log_channel(self, guild_id: int) -> Optional[int]:
+    """
+    ログチャンネルを取得する
+    
+    Args:
+      guild_id: サーバーID
+    
+    Returns:
+      Optional[int]: チャンネルID
+    """
+    row = self.conn.execute(
+      "SELECT channel_id FROM log_channels WHERE guild_id = ?", (guild_id,)
+    ).fetchone();
+    return row[0] if row else None;
+  
+  def get_summary(self) -> Dict:
+    """
+    全体の借金サマリーを取得する
+    
+    Returns:
+      Dict: サマリー情報（DebtDatabase.get_summaryと同じ形式）
+    """
+    # 集計はトリガーで更新済みなので、部分インデックスから上位5件を読むだけ
+    total_amount, total_users = self.conn.execute(
+      "SELECT total_amount, participants FROM ledger_stats WHERE id = 0"
+    ).fetchone();
+    top_creditors = self.conn.execute(
+      "SELECT user_id, lent FROM user_totals WHERE lent > 0 ORDER BY lent DESC LIMIT 5"
+    ).fetchall();
+    top_debtors = self.conn.execute(
+      "SELECT user_id, borrowed FROM user_totals WHERE borrowed > 0 ORDER BY borrowed DESC LIMIT 5"
+    ).fetchall();
+    return {
+      "total_debts": total_amount,
+      "total_users": total_users,
+      "top_creditors": top_creditors,
+      "top_debtors": top_debtors
+    };
+  
+  def get_rank(self, user_id: int) -> Dict:
+    """
+    ユーザーの貸している総額・借りている総額の順位を求める（同額は同順位）
+    自分より多い人数は部分インデックスの範囲を数える
+    
+    Args:
+      user_id: ユーザーID
+    
+    Returns:
+      Dict: 順位（DebtDatabase.get_rankと同じ形式）
+    """
+    totals = self.conn.execute("SELECT lent, borrowed FROM user_totals WHERE user_id = ?", (user_id,)).fetchone() or (0, 0);
+    result = {};
+    for side, total, count_key in (("lent", totals[0], "creditor_count"), ("borrowed", totals[1], "debtor_count")):
+      result[side] = total;
+      result[f"{side}_rank"] = self._rank_of(side, total) if total else None;
+      result[count_key], = self.conn.execute(f"SELECT COUNT(*) FROM user_totals WHERE {side} > 0").fetchone();
+    return result;
+  
+  def _rank_of(self, side: str, total: int) -> int:
+    """
+    総額の順位を求める（自分より多い人数 + 1）
+    
+    Args:
+      side: "lent" または "borrowed"（呼び出し側で確認済みの列名）
+      total: 総額
+    
+    Returns:
+      int: 順位
+    """
+    greater, = self.conn.execute(f"SELECT COUNT(*) FROM user_totals WHERE {side} > ?", (total,)).fetchone();
+    return greater + 1;
+  
+  def get_leaderboard(self, side: str, offset: int = 0, limit: int = 20) -> Tuple[List[Tuple[int, int, int]], int]:
+    """
+    総額の多い順のランキングを1ページ分取得する
+    
+    Args:
+      side: "lent"（貸している総額）または "borrowed"（借りている総額）
+      offset: 先頭から飛ばす件数
+      limit: 取得件数
+    
+    Returns:
+      Tuple[List[Tuple[int, int, int]], int]: ([(順位, user_id, 総額)], ランキングの人数)
+    
+    Raises:
+      ValueError: sideが正しくない場合
+    """
+    if side not in LEADERBOARD_SIDES:
+      raise ValueError(f"ランキングの種類が正しくない: {side}");
+    count, = self.conn.execute(f"SELECT COUNT(*) FROM user_totals WHERE {side} > 0").fetchone();
+    rows = self.conn.execute(
+      f"SELECT user_id, {side} FROM user_totals WHERE {side} > 0 ORDER BY {side} DESC, user_id LIMIT ? OFFSET ?",
+      (limit, offset)
+    ).fetchall();
+    if not rows:
+      return [], count;
+    return ranked_page(rows, offset, self._rank_of(side, rows[0][1])), count;
+  
+  def archive_history(self) -> int:
+    """
+    SQLiteは履歴をインデックス付きでディスクに置くのでアーカイブは不要
+    
+    Returns:
+      int: 常に0
+    """
+    return 0;
+  
+  def needs_compaction(self) -> bool:
+    """
+    SQLiteはトランザクション単位で書き込むのでコンパクションは不要
+    
+    Returns:
+      bool: 常にFalse
+    """
+    return False;
+  
+  def compact(self) -> bool:
+    """
+    SQLiteではコンパクション不要のため何もしない（DebtDatabase.compactと同じ使い方にするため）
+    
+    Returns:
+      bool: 常にFalse（ジャーナルを使わないDebtDatabaseと同じ）
+    """
+    return False;
+  
+  @property
+  def state_lock(self) -> asyncio.Lock:
+    """
+    変更の適用中に書き込み用の接続を使わないためのロック（DebtDatabase.state_lockと同じ）
+    
+    Returns:
+      asyncio.Lock: ロック（イベントループ上で初めて使うときに作る）
+    """
+    if self._state_lock is None:
+      self._state_lock = asyncio.Lock();
+    return self._state_lock;
+  
+  async def compact_async(self) -> bool:
+    """
+    SQLiteではコンパクション不要のため何もしない
+    
+    Returns:
+      bool: 常にTrue
+    """
+    return True;
+  
+  def start_writer(self):
+    """
+    SQLiteはコミットごとに書き込むのでバックグラウンド書き込みはない
+    """
+    pass;
+  
+  async def wait_durable(self) -> bool:
+    """
+    コミット済みの変更は既に書き込まれている
+    
+    Returns:
+      bool: 常にTrue
+    """
+    return True;
+  
+  async def preload_history(self):
+    """
+    SQLiteは履歴を必要な分だけ読むので先読みは不要
+    """
+    pass;
+  
+  async def aclose(self):
+    """
+    データベースを閉じる
+    """
+    self.close();
+  
+  def close(self):
+    """
+    データベースを閉じる
+    """
+    self.conn.close();
+
+class SQLiteLedgerVersion:
+  """
+  SQLite版の版クラス
+  専用の接続で読み取りトランザクションを開いたままにし、WALのスナップショットとして開いた時点の内容を読む
+  書き込み側の接続を待たせず、書き込みからも待たされない
+  """
+  
+  def __init__(self, db_path: str):
+    """
+    版を開く
+    
+    Args:
+      db_path: データベースファイルのパス
+    """
+    # 読み終えるまでスレッドから使うので、作ったスレッド以外からも使えるようにする
+    self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, isolation_level=None, check_same_thread=False);
+    self.conn.execute("BEGIN");
+    # 最初の読み取りでスナップショットが決まるので、開いた時点で読んでおく
+    self.conn.execute("SELECT 1 FROM debts LIMIT 1").fetchall();
+  
+  def iter_debts(self) -> Iterator[Tuple[int, int, int]]:
+    """
+    全ての債権を順に返す（書き出し用、カーソルで少しずつ読む）
+    
+    Yields:
+      Tuple[int, int, int]: (債権者ID, 債務者ID, 金額)
+    """
+    yield from self.conn.execute("SELECT creditor, debtor, amount FROM debts ORDER BY creditor, debtor");
+  
+  def iter_history(self) -> Iterator[Dict]:
+    """
+    全ての履歴を古い順に返す（書き出し用、カーソルで少しずつ読む）
+    
+    Yields:
+      Dict: 履歴（通し番号 "id" 付き）
+    """
+    cursor = self.conn.execute(
+      "SELECT id, action, creditor, debtor, amount, description, timestamp FROM history ORDER BY id"
+    );
+    for row in cursor:
+      yield SQLiteDebtDatabase._history_row_to_dict(row);
+  
+  def close(self):
+    """
+    読み取りトランザクションを終えて接続を閉じる（WALのチェックポイントを止めないよう、使い終わったらすぐ呼ぶ）
+    """
+    self.conn.execute("ROLLBACK");
+    self.conn.close();
@@ -0,0 +1,443 @@
+"""
+storage_client.py - ストレージサービスのクライアントモジュール
+
+複数のBotプロセス（シャード）から、1つのストレージサービス（storage_service.py）に
+ローカルのUnixソケット越しに読み書きを頼む
+要求は応答を待たずに続けて送り（パイプライン）、同じタイミングで積まれた要求は1回の書き込みにまとめる
+
+通信は1行1件のJSONで、要求は {"id", "op", "guild", "args"}、
+応答は {"id", "result"} / {"id", "error"}（書き出しの途中経過は {"id", "chunk"}）
+"""
+import asyncio;
+import base64;
+import json;
+from datetime import datetime;
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple;
+
+# 1行の最大長（書き出しの途中経過を1行で送るため、既定の64KiBより大きくする）
+LINE_LIMIT = 16 * 1024 * 1024;
+# 送信待ちがこのバイト数を超えたら、相手が読み終わるのを待ってから次を積む
+HIGH_WATER = 1024 * 1024;
+
+def encode_frame(message: Dict) -> bytes:
+  """
+  メッセージを1行のJSONにする
+  
+  Args:
+    message: メッセージ
+  
+  Returns:
+    bytes: 改行で終わるUTF-8のJSON
+  """
+  return (json.dumps(message, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8');
+
+class FrameWriter:
+  """
+  フレーム送信クラス
+  同じタイミングで積まれたフレームは次のイベントループの周回で1回のwriteにまとめる
+  """
+  
+  def __init__(self, writer: asyncio.StreamWriter):
+    """
+    送信器を初期化する
+    
+    Args:
+      writer: 送信先のストリーム
+    """
+    self._writer = writer;
+    self._frames = [];
+    self._scheduled = False;
+    # 統計
+    self.writes = 0;
+    self.frames = 0;
+  
+  def send(self, message: Dict):
+    """
+    フレームを積む（送信は次の周回でまとめて行う）
+    
+    Args:
+      message: メッセージ
+    """
+    self._frames.append(encode_frame(message));
+    if not self._scheduled:
+      self._scheduled = True;
+      asyncio.get_running_loop().call_soon(self._flush);
+  
+  def _flush(self):
+    """
+    積まれたフレームをまとめて書き込む
+    """
+    self._scheduled = False;
+    frames = self._frames;
+    self._frames = [];
+    if not frames or self._writer.is_closing():
+      return;
+    self._writer.write(b"".join(frames));
+    self.writes += 1;
+    self.frames += len(frames);
+  
+  async def drain(self):
+    """
+    送信待ちが多すぎる場合、相手が読むまで待つ
+    """
+    if self._writer.transport.get_write_buffer_size() + sum(len(frame) for frame in self._frames) > HIGH_WATER:
+      self._flush();
+      await self._writer.drain();
+
+class StorageClient:
+  """
+  ストレージサービスのクライアントクラス
+  接続は最初の要求のときに開き、切れた場合は次の要求でつなぎ直す
+  """
+  
+  def __init__(self, path: str, connect_timeout: float = 30.0):
+    """
+    クライアントを初期化する
+    
+    Args:
+      path: ストレージサービスのUnixソケット
+      connect_timeout: サービスの起動を待つ最大秒数
+    """
+    self.path = path;
+    self.connect_timeout = connect_timeout;
+    self._writer = None;
+    self._frames = None;
+    self._read_task = None;
+    self._connecting = None;
+    self._pending = {};  # {要求ID: (Future, 途中経過を受け取る関数)}
+    self._next_id = 0;
+    # 統計
+    self.requests = 0;
+  
+  async def _connect(self):
+    """
+    ストレージサービスに接続する（ソケットがまだない場合はサービスの起動を待つ）
+    
+    Raises:
+      ConnectionError: 待っても接続できない場合
+    """
+    loop = asyncio.get_running_loop();
+    deadline = loop.time() + self.connect_timeout;
+    while True:
+      try:
+        reader, writer = await asyncio.open_unix_connection(self.path, limit=LINE_LIMIT);
+        break;
+      except (FileNotFoundError, ConnectionRefusedError) as e:
+        if loop.time() >= deadline:
+          raise ConnectionError(f"ストレージサービス（{self.path}）に接続できない") from e;
+        await asyncio.sleep(0.2);
+    self._writer = writer;
+    self._frames = FrameWriter(writer);
+    self._read_task = asyncio.create_task(self._read_loop(reader));
+  
+  async def _ensure_connected(self):
+    """
+    接続していなければ接続する（同時に呼ばれても接続は1本だけ開く）
+    """
+    if self._writer is not None:
+      return;
+    if self._connecting is None:
+      self._connecting = asyncio.ensure_future(self._connect());
+    try:
+      await asyncio.shield(self._connecting);
+    finally:
+      if self._connecting is not None and self._connecting.done():
+        self._connecting = None;
+  
+  async def _read_loop(self, reader: asyncio.StreamReader):
+    """
+    応答を読み、待っている要求に返す（接続が切れたら待っている要求を全て失敗させる）
+    
+    Args:
+      reader: 受信側のストリーム
+    """
+    try:
+      while True:
+        line = await reader.readline();
+        if not line:
+          break;
+        message = json.loads(line);
+        entry = self._pending.get(message["id"]);
+        if entry is None:
+          continue;
+        future, on_chunk = entry;
+        if "chunk" in message:
+          if on_chunk is not None:
+            on_chunk(message["chunk"]);
+          continue;
+        del self._pending[message["id"]];
+        if future.done():
+          continue;
+        if "error" in message:
+          future.set_exception(RuntimeError(message["error"]));
+        else:
+          future.set_result(message["result"]);
+    except (ConnectionError, ValueError) as e:
+      print(f"ストレージサービスからの受信エラー: {e}");
+    finally:
+      self._disconnect();
+  
+  def _disconnect(self):
+    """
+    接続を捨て、応答を待っている要求を失敗させる（次の要求でつなぎ直す）
+    """
+    if self._writer is not None:
+      self._writer.close();
+    self._writer = None;
+    self._frames = None;
+    pending = self._pending;
+    self._pending = {};
+    for future, _ in pending.values():
+      if not future.done():
+        future.set_exception(ConnectionError("ストレージサービスとの接続が切れた"));
+  
+  async def call(self, op: str, guild_id: Optional[int], *args, on_chunk: Optional[Callable[[Any], None]] = None) -> Any:
+    """
+    ストレージサービスに要求を送り、応答を待つ
+    前の要求の応答を待たずに送るので、複数のコマンドから同時に呼んでよい
+    
+    Args:
+      op: 操作名（DatabaseView / MutationQueue のメソッド名）
+      guild_id: サーバーID
+      *args: 引数（JSONにできる値）
+      on_chunk: 途中経過を受け取る関数
+    
+    Returns:
+      Any: 操作の戻り値（タプルはリストになる）
+    
+    Raises:
+      RuntimeError: サービス側で操作が失敗した場合
+      ConnectionError: サービスに接続できない・接続が切れた場合
+    """
+    await self._ensure_connected();
+    self._next_id += 1;
+    request_id = self._next_id;
+    future = asyncio.get_running_loop().create_future();
+    self._pending[request_id] = (future, on_chunk);
+    self._frames.send({"id": request_id, "op": op, "guild": guild_id, "args": list(args)});
+    self.requests += 1;
+    try:
+      await self._frames.drain();
+      return await future;
+    finally:
+      self._pending.pop(request_id, None);
+  
+  async def aclose(self):
+    """
+    接続を閉じる
+    """
+    if self._connecting is not None:
+      self._connecting.cancel();
+      self._connecting = None;
+    if self._read_task is not None:
+      self._read_task.cancel();
+      try:
+        await self._read_task;
+      except asyncio.CancelledError:
+        pass;
+      self._read_task = None;
+    self._disconnect();
+
+class RemoteDatabase:
+  """
+  ストレージサービス上のデータベースの読み取りの窓口クラス（DatabaseViewと同じメソッドを持つ）
+  """
+  
+  def __init__(self, client: StorageClient, guild_id: Optional[int]):
+    """
+    窓口を初期化する
+    
+    Args:
+      client: クライアント
+      guild_id: サーバーID
+    """
+    self.client = client;
+    self.guild_id = guild_id;
+  
+  async def get_debt(self, creditor_id: int, debtor_id: int) -> int:
+    """債権額を取得する（DebtDatabase.get_debtと同じ）"""
+    return await self.client.call("get_debt", self.guild_id, creditor_id, debtor_id);
+  
+  async def get_debt_at(self, creditor_id: int, debtor_id: int, when: datetime) -> Optional[int]:
+    """ある時点の債権額を取得する（DebtDatabase.get_debt_atと同じ）"""
+    return await self.client.call("get_debt_at", self.guild_id, creditor_id, debtor_id, when.isoformat());
+  
+  async def get_user_debts_page(self, user_id: int, offset: int = 0, limit: int = 15) -> Dict:
+    """貸し借り一覧を1ページ分取得する（DebtDatabase.get_user_debts_pageと同じ）"""
+    return await self.client.call("get_user_debts_page", self.guild_id, user_id, offset, limit);
+  
+  async def get_history_page(self, user_id: Optional[int] = None, limit: int = 10, before: Optional[int] = None) -> Tuple[List[Dict], Optional[int]]:
+    """履歴を1ページ分取得する（DebtDatabase.get_history_pageと同じ）"""
+    history, next_before = await self.client.call("get_history_page", self.guild_id, user_id, limit, before);
+    return history, next_before;
+  
+  async def get_summary(self) -> Dict:
+    """サマリーを取得する（DebtDatabase.get_summaryと同じ）"""
+    return await self.client.call("get_summary", self.guild_id);
+  
+  async def get_rank(self, user_id: int) -> Dict:
+    """ユーザーの順位を求める（DebtDatabase.get_rankと同じ）"""
+    return await self.client.call("get_rank", self.guild_id, user_id);
+  
+  async def get_leaderboard(self, side: str, offset: int = 0, limit: int = 20) -> Tuple[List[Tuple[int, int, int]], int]:
+    """ランキングを1ページ分取得する（DebtDatabase.get_leaderboardと同じ）"""
+    entries, count = await self.client.call("get_leaderboard", self.guild_id, side, offset, limit);
+    return [tuple(entry) for entry in entries], count;
+  
+  async def plan_settlement(self) -> List[Tuple[int, int, int]]:
+    """精算案を求める（DebtDatabase.plan_settlementと同じ）"""
+    return [tuple(step) for step in await self.client.call("plan_settlement", self.guild_id)];
+  
+  async def get_log_channel(self, guild_id: int) -> Optional[int]:
+    """ログチャンネルを取得する（DebtDatabase.get_log_channelと同じ）"""
+    return await self.client.call("get_log_channel", self.guild_id, guild_id);
+  
+  async def wait_durable(self) -> bool:
+    """変更がディスクに書かれるまで待つ（DebtDatabase.wait_durableと同じ）"""
+    return await self.client.call("wait_durable", self.guild_id);
+  
+  async def trend_report(self, user_id: Optional[int], months: int) -> Dict:
+    """月ごとの推移を集計する（DatabaseView.trend_reportと同じ。集計はサービス側で行う）"""
+    return await self.client.call("trend_report", self.guild_id, user_id, months);
+  
+  async def export(self, debts_file: BinaryIO, history_file: BinaryIO) -> Tuple[int, int]:
+    """
+    債権をCSV、履歴をNDJSONとしてファイルに書き出す（サービスが書いた内容を少しずつ受け取る）
+    
+    Args:
+      debts_file: 債権の書き込み先
+      history_file: 履歴の書き込み先
+    
+    Returns:
+      Tuple[int, int]: (債権の件数, 履歴の件数)
+    """
+    files = {"debts": debts_file, "history": history_file};
+    
+    def on_chunk(chunk: List[str]):
+      name, data = chunk;
+      files[name].write(base64.b64decode(data));
+    
+    debt_count, history_count = await self.client.call("export", self.guild_id, on_chunk=on_chunk);
+    return debt_count, history_count;
+
+class RemoteQueue:
+  """
+  ストレージサービス上の書き込みキューの窓口クラス（MutationQueueと同じメソッドを持つ）
+  変更はサービス側のサーバーごとの単一書き込みキューで、他のプロセスからの変更とまとめて適用される
+  """
+  
+  def __init__(self, client: StorageClient, guild_id: Optional[int]):
+    """
+    窓口を初期化する
+    
+    Args:
+      client: クライアント
+      guild_id: サーバーID
+    """
+    self.client = client;
+    self.guild_id = guild_id;
+  
+  async def add_debt(self, creditor_id: int, debtor_id: int, amount: int, description: str = "") -> bool:
+    """借金を追加する（MutationQueue.add_debtと同じ）"""
+    return await self.client.call("add_debt", self.guild_id, creditor_id, debtor_id, amount, description);
+  
+  async def add_debts(self, entries: List[Tuple[int, int, int, str]]) -> bool:
+    """複数の借金をまとめて追加する（MutationQueue.add_debtsと同じ）"""
+    return await self.client.call("add_debts", self.guild_id, entries);
+  
+  async def pay_debt(self, creditor_id: int, debtor_id: int, amount: int, payer_id: Optional[int] = None) -> Tuple[bool, int]:
+    """借金を返済する（MutationQueue.pay_debtと同じ）"""
+    success, remaining = await self.client.call("pay_debt", self.guild_id, creditor_id, debtor_id, amount, payer_id);
+    return success, remaining;
+  
+  async def transfer_debt(self, creditor_id: int, debtor_id: int, new_creditor_id: int, amount: int) -> Tuple[bool, str, int]:
+    """債権を譲渡する（MutationQueue.transfer_debtと同じ）"""
+    success, error_msg, remaining = await self.client.call("transfer_debt", self.guild_id, creditor_id, debtor_id, new_creditor_id, amount);
+    return success, error_msg, remaining;
+  
+  async def apply_settlement(self, plan: List[Tuple[int, int, int]]) -> Tuple[bool, str]:
+    """精算案を反映する（MutationQueue.apply_settlementと同じ）"""
+    success, error_msg = await self.client.call("apply_settlement", self.guild_id, plan);
+    return success, error_msg;
+  
+  async def set_log_channel(self, guild_id: int, channel_id: int) -> bool:
+    """ログチャンネルを設定する（MutationQueue.set_log_channelと同じ）"""
+    return await self.client.call("set_log_channel", self.guild_id, guild_id, channel_id);
+
+class RemoteShards:
+  """
+  ストレージサービスを使う場合のサーバー別データベース管理クラス（GuildShardsの代わりに使う）
+  データベースはサービス側で開くので、このプロセスでは何も開かない
+  """
+  
+  def __init__(self, path: str):
+    """
+    管理クラスを初期化する（接続は最初の要求のときに開く）
+    
+    Args:
+      path: ストレージサービスのUnixソケット
+    """
+    self.client = StorageClient(path);
+    self._views = {};
+    self._queues = {};
+  
+  def view(self, guild_id: Optional[int]) -> RemoteDatabase:
+    """
+    サーバーのデータベースの読み取りの窓口を取得する
+    
+    Args:
+      guild_id: サーバーID
+    
+    Returns:
+      RemoteDatabase: 読み取りの窓口
+    """
+    view = self._views.get(guild_id);
+    if view is None:
+      view = self._views[guild_id] = RemoteDatabase(self.client, guild_id);
+    return view;
+  
+  def queue(self, guild_id: Optional[int]) -> RemoteQueue:
+    """
+    サーバーのデータベースへの変更の窓口を取得する
+    
+    Args:
+      guild_id: サーバーID
+    
+    Returns:
+      RemoteQueue: 変更の窓口
+    """
+    queue = self._queues.get(guild_id);
+    if queue is None:
+      queue = self._queues[guild_id] = RemoteQueue(self.client, guild_id);
+    return queue;
+  
+  def open_queues(self) -> List:
+    """
+    このプロセスで開いている書き込みキューの一覧（サービス側にあるので常に空）
+    
+    Returns:
+      List: 空のリスト
+    """
+    return [];
+  
+  def open_databases(self) -> List:
+    """
+    このプロセスで開いているデータベースの一覧（サービス側にあるので常に空。コンパクションなどもサービスが行う）
+    
+    Returns:
+      List: 空のリスト
+    """
+    return [];
+  
+  def start(self):
+    """
+    バックグラウンド処理を開始する（サービス側で行うので何もしない）
+    """
+  
+  async def aclose(self):
+    """
+    ストレージサービスとの接続を閉じる
+    """
+    await self.client.aclose();
+    self._views = {};
+    self._queues = {};
@@ -0,0 +1,259 @@
+"""
+storage_service.py - ストレージサービスモジュール
+
+データベースを開く唯一のプロセスとして、ローカルのUnixソケットで複数のBotプロセス（シャード）からの読み書きを受ける
+変更はサーバーごとの単一書き込みキューに積むので、別々のプロセスから同時に届いた変更もまとめて順番に適用され、
+どのプロセスもdebts.jsonを上書きし合わない
+
+起動: python -m utils.storage_service （STORAGE_SOCKETに待ち受けるソケットのパスを設定する）
+"""
+import asyncio;
+import base64;
+import json;
+import os;
+import signal;
+import socket;
+import sys;
+import tempfile;
+from datetime import datetime;
+from typing import Any, Callable, Dict, List, Optional;
+
+# python -m で起動したときもプロジェクトルートのconfigを読めるようにする
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))));
+
+from config import Config;
+from utils.guild_shards import GuildShards;
+from utils.storage_client import LINE_LIMIT, FrameWriter;
+
+# 読み取り（DatabaseViewのメソッド）と変更（MutationQueueのメソッド）として受け付ける操作
+READ_OPS = frozenset((
+  "get_debt", "get_debt_at", "get_user_debts_page", "get_history_page", "get_summary", "get_rank", "get_leaderboard",
+  "plan_settlement", "get_log_channel", "wait_durable", "trend_report"
+));
+MUTATION_OPS = frozenset(("add_debt", "add_debts", "pay_debt", "transfer_debt", "apply_settlement", "set_log_channel"));
+# 書き出しを送るときの1回分のバイト数
+EXPORT_CHUNK_SIZE = 256 * 1024;
+
+class StorageServer:
+  """
+  ストレージサービスクラス
+  1つの接続から続けて届いた要求も1件ずつ別のタスクで処理するので、応答は終わった順に返す
+  """
+  
+  def __init__(self, shards: GuildShards, path: str):
+    """
+    サービスを初期化する
+    
+    Args:
+      shards: サーバー別データベース
+      path: 待ち受けるUnixソケットのパス
+    """
+    self.shards = shards;
+    self.path = path;
+    self._server = None;
+    self._connections = set();
+    self._tasks = set();
+    self._maintenance = [];
+    # 統計
+    self.requests = 0;
+  
+  def _remove_stale_socket(self):
+    """
+    前回のサービスが残したソケットファイルを消す
+    
+    Raises:
+      RuntimeError: 別のサービスがそのソケットで動いている場合
+    """
+    if not os.path.exists(self.path):
+      return;
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM);
+    try:
+      probe.connect(self.path);
+    except OSError:
+      os.unlink(self.path);
+    else:
+      raise RuntimeError(f"{self.path}で別のストレージサービスが動いている");
+    finally:
+      probe.close();
+  
+  async def start(self):
+    """
+    待ち受けと、コンパクション・アーカイブの定期処理を開始する
+    """
+    directory = os.path.dirname(self.path);
+    if directory:
+      os.makedirs(directory, exist_ok=True);
+    self._remove_stale_socket();
+    self._server = await asyncio.start_unix_server(self._handle, self.path, limit=LINE_LIMIT);
+    # 同じマシンのBotプロセスだけがつなげるよう、所有者以外は読み書きできなくする
+    os.chmod(self.path, 0o600);
+    self._maintenance.append(asyncio.create_task(self._compaction_loop()));
+    if Config.HISTORY_ARCHIVE_DAYS > 0:
+      self._maintenance.append(asyncio.create_task(self._archive_loop()));
+  
+  async def _compaction_loop(self):
+    """
+    ジャーナルが溜まっていたらスナップショットにまとめる（BotのCogが行っていた処理）
+    """
+    while True:
+      await asyncio.sleep(Config.JOURNAL_COMPACT_INTERVAL);
+      for db in self.shards.open_databases():
+        if db.needs_compaction():
+          await db.compact_async();
+  
+  async def _archive_loop(self):
+    """
+    古くなった履歴を1時間ごとにアーカイブへ移す（BotのCogが行っていた処理）
+    """
+    while True:
+      await asyncio.sleep(3600);
+      for db in self.shards.open_databases():
+        async with db.state_lock:
+          db.archive_history();
+  
+  async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    1つの接続の要求を読み、1件ずつタスクにして処理する
+    
+    Args:
+      reader: 受信側のストリーム
+      writer: 送信側のストリーム
+    """
+    frames = FrameWriter(writer);
+    self._connections.add(writer);
+    try:
+      while True:
+        line = await reader.readline();
+        if not line:
+          break;
+        task = asyncio.create_task(self._serve(json.loads(line), frames));
+        self._tasks.add(task);
+        task.add_done_callback(self._tasks.discard);
+    except (ConnectionError, ValueError) as e:
+      print(f"ストレージサービスの受信エラー: {e}");
+    finally:
+      self._connections.discard(writer);
+      writer.close();
+  
+  async def _serve(self, request: Dict, frames: FrameWriter):
+    """
+    要求を1件処理して応答を積む
+    
+    Args:
+      request: 要求 {"id", "op", "guild", "args"}
+      frames: 応答の送信器
+    """
+    request_id = request["id"];
+    self.requests += 1;
+    try:
+      send_chunk = lambda chunk: frames.send({"id": request_id, "chunk": chunk});
+      result = await self._execute(request["op"], request["guild"], request["args"], send_chunk, frames);
+    except Exception as e:
+      frames.send({"id": request_id, "error": f"{type(e).__name__}: {e}"});
+    else:
+      frames.send({"id": request_id, "result": result});
+  
+  async def _execute(self, op: str, guild_id: Optional[int], args: List, send_chunk: Callable[[Any], None], frames: FrameWriter) -> Any:
+    """
+    操作を実行する
+    
+    Args:
+      op: 操作名
+      guild_id: サーバーID
+      args: 引数
+      send_chunk: 途中経過を送る関数
+      frames: 応答の送信器（書き出しで相手が読むのを待つため）
+    
+    Returns:
+      Any: 操作の戻り値
+    
+    Raises:
+      ValueError: 知らない操作の場合
+    """
+    if op in MUTATION_OPS:
+      return await getattr(self.shards.queue(guild_id), op)(*args);
+    view = self.shards.view(guild_id);
+    if op == "get_debt_at":
+      creditor_id, debtor_id, when = args;
+      return await view.get_debt_at(creditor_id, debtor_id, datetime.fromisoformat(when));
+    if op == "export":
+      return await self._export(view, send_chunk, frames);
+    if op in READ_OPS:
+      return await getattr(view, op)(*args);
+    raise ValueError(f"知らない操作: {op}");
+  
+  async def _export(self, view, send_chunk: Callable[[Any], None], frames: FrameWriter) -> List[int]:
+    """
+    書き出した債権・履歴を一時ファイルから少しずつ送る（全体をメモリに持たない）
+    
+    Args:
+      view: 読み取りの窓口
+      send_chunk: 途中経過を送る関数
+      frames: 応答の送信器
+    
+    Returns:
+      List[int]: [債権の件数, 履歴の件数]
+    """
+    with tempfile.TemporaryFile() as debts_file, tempfile.TemporaryFile() as history_file:
+      counts = await view.export(debts_file, history_file);
+      for name, fp in (("debts", debts_file), ("history", history_file)):
+        fp.seek(0);
+        while True:
+          data = fp.read(EXPORT_CHUNK_SIZE);
+          if not data:
+            break;
+          send_chunk([name, base64.b64encode(data).decode('ascii')]);
+          await frames.drain();
+    return list(counts);
+  
+  async def close(self):
+    """
+    待ち受けを止め、処理中の要求が終わるのを待つ
+    """
+    for task in self._maintenance:
+      task.cancel();
+    self._maintenance = [];
+    if self._server is not None:
+      self._server.close();
+      for writer in list(self._connections):
+        writer.close();
+      await self._server.wait_closed();
+      self._server = None;
+    if self._tasks:
+      await asyncio.gather(*self._tasks, return_exceptions=True);
+    if os.path.exists(self.path):
+      os.unlink(self.path);
+
+async def serve(path: str):
+  """
+  ストレージサービスを起動し、SIGINT / SIGTERM を受けたら変更を保存して止まる
+  
+  Args:
+    path: 待ち受けるUnixソケットのパス
+  """
+  shards = GuildShards();
+  shards.start();
+  server = StorageServer(shards, path);
+  await server.start();
+  print(f"ストレージサービスを{path}で起動した");
+  
+  stop = asyncio.Event();
+  loop = asyncio.get_running_loop();
+  for signum in (signal.SIGINT, signal.SIGTERM):
+    loop.add_signal_handler(signum, stop.set);
+  await stop.wait();
+  
+  await server.close();
+  await shards.aclose();
+  print("ストレージサービスを止めた");
+
+def main():
+  """メイン関数 - ストレージサービスを起動する"""
+  if not Config.STORAGE_SOCKET:
+    print("エラー: STORAGE_SOCKETが設定されていない");
+    print(".envファイルに待ち受けるソケットのパスを設定してください");
+    exit(1);
+  asyncio.run(serve(Config.STORAGE_SOCKET));
+
+if __name__ == '__main__':
+  main();
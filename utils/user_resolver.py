@@ -0,0 +1,133 @@
+"""
+user_resolver.py - ユーザー名解決モジュール
+
+ユーザーIDから表示名を引く処理をまとめ、
+Discord APIへの問い合わせ（fetch_user）をできるだけ減らす
+"""
+import asyncio;
+import time;
+from collections import OrderedDict;
+from typing import Dict, Iterable;
+import discord;
+from discord.ext import commands;
+from utils.metrics import USER_LOOKUPS;
+
+class UserResolver:
+  """
+  ユーザー名解決クラス
+  ゲートウェイのキャッシュ → TTL付きキャッシュ → fetch_user の順に引く
+  同じIDへの問い合わせが同時に来た場合は1回のfetch_userにまとめる
+  """
+  
+  def __init__(self, bot: commands.Bot, ttl: int = 600, max_size: int = 10000):
+    """
+    解決器を初期化する
+    
+    Args:
+      bot: Botインスタンス
+      ttl: 表示名をキャッシュしておく秒数
+      max_size: キャッシュする最大件数
+    """
+    self.bot = bot;
+    self.ttl = ttl;
+    self.max_size = max_size;
+    self._cache = OrderedDict();  # {user_id: (表示名, 期限)}
+    self._inflight = {};  # {user_id: Future}
+  
+  def _get_cached(self, user_id: int):
+    """
+    キャッシュから表示名を取得する
+    
+    Args:
+      user_id: ユーザーID
+    
+    Returns:
+      Optional[str]: 表示名（キャッシュにない・期限切れの場合None）
+    """
+    cached = self._cache.get(user_id);
+    if cached is None:
+      return None;
+    name, expires_at = cached;
+    if expires_at < time.monotonic():
+      del self._cache[user_id];
+      return None;
+    self._cache.move_to_end(user_id);
+    return name;
+  
+  def _store(self, user_id: int, name: str):
+    """
+    表示名をキャッシュに入れる（古いものから追い出す）
+    
+    Args:
+      user_id: ユーザーID
+      name: 表示名
+    """
+    self._cache[user_id] = (name, time.monotonic() + self.ttl);
+    self._cache.move_to_end(user_id);
+    while len(self._cache) > self.max_size:
+      self._cache.popitem(last=False);
+  
+  async def _fetch_name(self, user_id: int) -> str:
+    """
+    Discord APIからユーザーを取得して表示名を返す
+    
+    Args:
+      user_id: ユーザーID
+    
+    Returns:
+      str: 表示名（取得できない場合は「ユーザー#ID」）
+    """
+    USER_LOOKUPS.inc(source="fetch");
+    try:
+      user = await self.bot.fetch_user(user_id);
+      name = user.display_name;
+    except (discord.NotFound, discord.HTTPException):
+      return f"ユーザー#{user_id}";
+    self._store(user_id, name);
+    return name;
+  
+  async def resolve_name(self, user_id: int) -> str:
+    """
+    ユーザーIDから表示名を取得する
+    
+    Args:
+      user_id: ユーザーID
+    
+    Returns:
+      str: 表示名
+    """
+    name = self._get_cached(user_id);
+    if name is not None:
+      USER_LOOKUPS.inc(source="cache");
+      return name;
+    
+    # ゲートウェイで受け取ったユーザーならAPIを叩かずに済む
+    user = self.bot.get_user(user_id);
+    if user is not None:
+      USER_LOOKUPS.inc(source="gateway");
+      self._store(user_id, user.display_name);
+      return user.display_name;
+    
+    # 同じIDを取得中なら、その結果を待つ
+    future = self._inflight.get(user_id);
+    if future is not None:
+      USER_LOOKUPS.inc(source="inflight");
+    else:
+      future = asyncio.ensure_future(self._fetch_name(user_id));
+      self._inflight[user_id] = future;
+      future.add_done_callback(lambda _: self._inflight.pop(user_id, None));
+    return await asyncio.shield(future);
+  
+  async def resolve_names(self, user_ids: Iterable[int]) -> Dict[int, str]:
+    """
+    複数のユーザーIDの表示名をまとめて取得する（並行に問い合わせる）
+    
+    Args:
+      user_ids: ユーザーIDの一覧（重複可）
+    
+    Returns:
+      Dict[int, str]: {user_id: 表示名}
+    """
+    unique_ids = list(dict.fromkeys(user_ids));
+    names = await asyncio.gather(*(self.resolve_name(user_id) for user_id in unique_ids));
+    return dict(zip(unique_ids, names));
@@ -0,0 +1,166 @@
+"""
+writer.py - グループコミット書き込みモジュール
+
+変更をメモリに反映した後、ディスクへの書き込みはバックグラウンドで行う
+短時間に続いた変更は1回の書き込みにまとめる
+"""
+import asyncio;
+from typing import Any, Callable, Optional;
+
+class GroupCommitWriter:
+  """
+  グループコミット書き込みクラス
+  prepareはイベントループ上で書き込む内容を取り出し、
+  writeはスレッドプール上で実際にファイルへ書き込む
+  """
+  
+  def __init__(self, prepare: Callable[[], Any], write: Callable[[Any], bool], max_delay: float = 0.5,
+               prepare_lock: Optional[Callable[[], asyncio.Lock]] = None):
+    """
+    書き込み器を初期化する
+    
+    Args:
+      prepare: 書き込む内容を取り出す関数（イベントループ上で呼ばれる）
+      write: 内容をファイルに書き込む関数（スレッドで呼ばれる、成功時True）
+      max_delay: 最初の変更から書き込みまで待つ最大秒数
+      prepare_lock: prepareを呼ぶ間だけ持つロックを返す関数（変更の適用中に内容を取り出さないため）
+    """
+    self._prepare = prepare;
+    self._prepare_lock = prepare_lock;
+    self._write = write;
+    self.max_delay = max_delay;
+    self._dirty = False;
+    # 次の書き込みを待っているFuture / 書き込み中のFuture
+    self._next_waiters = [];
+    self._inflight_waiters = [];
+    self._wakeup = None;
+    self._closing = None;
+    self._lock = None;
+    self._loop = None;
+    self._task = None;
+    # 統計
+    self.batches = 0;
+    self.mutations = 0;
+  
+  @property
+  def running(self) -> bool:
+    """
+    バックグラウンドタスクが動いているか
+    
+    Returns:
+      bool: 動いている場合True
+    """
+    return self._task is not None and not self._task.done();
+  
+  def start(self):
+    """
+    バックグラウンドタスクを開始する（イベントループ上で呼ぶ）
+    """
+    if self.running:
+      return;
+    self._wakeup = asyncio.Event();
+    self._closing = asyncio.Event();
+    self._lock = asyncio.Lock();
+    self._loop = asyncio.get_running_loop();
+    self._task = asyncio.create_task(self._run());
+  
+  def notify(self):
+    """
+    変更があったことを知らせる（変更をスレッドで適用する場合もあるので、どのスレッドから呼んでもよい）
+    """
+    self._dirty = True;
+    self.mutations += 1;
+    self._loop.call_soon_threadsafe(self._wakeup.set);
+  
+  def durable(self) -> "asyncio.Future[bool]":
+    """
+    ここまでの変更がディスクに書かれるのを待つFutureを返す
+    
+    Returns:
+      asyncio.Future[bool]: 書き込み完了時に成否がセットされる
+    """
+    future = asyncio.get_running_loop().create_future();
+    if self._dirty:
+      self._next_waiters.append(future);
+    elif self._inflight_waiters:
+      self._inflight_waiters.append(future);
+    else:
+      future.set_result(True);
+    return future;
+  
+  async def _run(self):
+    """
+    変更を待ち、max_delayの間に来た変更をまとめて書き込む
+    """
+    while not self._closing.is_set():
+      await self._wakeup.wait();
+      # 終了要求が来たら待たずに書き込む
+      try:
+        await asyncio.wait_for(self._closing.wait(), timeout=self.max_delay);
+      except asyncio.TimeoutError:
+        pass;
+      await self.flush();
+  
+  async def flush(self) -> bool:
+    """
+    溜まっている変更をすぐに書き込む
+    
+    Returns:
+      bool: 書き込み成功時True（変更がなければTrue）
+    """
+    async with self._lock:
+      self._wakeup.clear();
+      if not self._dirty:
+        return True;
+      if self._prepare_lock is not None:
+        async with self._prepare_lock():
+          payload = self._prepare();
+      else:
+        payload = self._prepare();
+      self._dirty = False;
+      waiters = self._next_waiters;
+      self._next_waiters = [];
+      self._inflight_waiters = waiters;
+      try:
+        ok = await asyncio.to_thread(self._write, payload);
+      except Exception as e:
+        print(f"バックグラウンド書き込みエラー: {e}");
+        ok = False;
+      self._inflight_waiters = [];
+      self.batches += 1;
+      if not ok:
+        # 失敗したら次の周期でもう一度書く
+        self._dirty = True;
+        self._wakeup.set();
+      for waiter in waiters:
+        if not waiter.done():
+          waiter.set_result(ok);
+      return ok;
+  
+  async def close(self) -> bool:
+    """
+    バックグラウンドタスクを止め、残っている変更を書き込む
+    
+    Returns:
+      bool: 最後の書き込み成功時True
+    """
+    if self._task is None:
+      return True;
+    # 書き込み途中で止めないよう、キャンセルではなく終了要求で止める
+    self._closing.set();
+    self._wakeup.set();
+    await self._task;
+    self._task = None;
+    return await self.flush();
+  
+  def flush_sync(self) -> bool:
+    """
+    イベントループが止まった後に残りを同期的に書き込む（プロセス終了時用）
+    
+    Returns:
+      bool: 書き込み成功時True
+    """
+    if not self._dirty:
+      return True;
+    self._dirty = False;
+    return self._write(self._prepare());